@@ -13,7 +13,7 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from services.hls_proxy import HLSProxy
 from services.ffmpeg_manager import FFmpegManager
-from config import PORT, DVR_ENABLED, RECORDINGS_DIR, MAX_RECORDING_DURATION, RECORDINGS_RETENTION_DAYS
+from config import PORT, DVR_ENABLED, RECORDINGS_DIR, MAX_RECORDING_DURATION, RECORDINGS_RETENTION_DAYS, TRANSPORT_ROUTES, TRANSPORT_ROUTES_RELOAD_INTERVAL
 
 # Only import DVR components if enabled
 if DVR_ENABLED:
@@ -273,6 +273,9 @@ def create_app():
     app.router.add_get('/builder', proxy.handle_builder)
     app.router.add_get('/info', proxy.handle_info_page)
     app.router.add_get('/api/info', proxy.handle_api_info)
+    app.router.add_get('/api/prewarm', proxy.handle_prewarm_status)
+    app.router.add_post('/api/prewarm/{id}/cancel', proxy.handle_prewarm_cancel)
+    app.router.add_delete('/api/prewarm/{id}', proxy.handle_prewarm_cancel)
     app.router.add_get('/key', proxy.handle_key_request)
     app.router.add_get('/proxy/manifest.m3u8', proxy.handle_proxy_request)
     app.router.add_get('/proxy/hls/manifest.m3u8', proxy.handle_proxy_request)
@@ -280,9 +283,9 @@ def create_app():
     app.router.add_get('/proxy/stream', proxy.handle_proxy_request)
     app.router.add_get('/extractor', proxy.handle_extractor_request)
     app.router.add_get('/extractor/video', proxy.handle_extractor_request)
-    app.router.add_get('/proxy/hls/segment.ts', proxy.handle_proxy_request)
-    app.router.add_get('/proxy/hls/segment.m4s', proxy.handle_proxy_request)
-    app.router.add_get('/proxy/hls/segment.mp4', proxy.handle_proxy_request)
+    app.router.add_get('/proxy/hls/segment.ts', proxy.handle_segment_request)
+    app.router.add_get('/proxy/hls/segment.m4s', proxy.handle_segment_request)
+    app.router.add_get('/proxy/hls/segment.mp4', proxy.handle_segment_request)
     app.router.add_get('/playlist', proxy.handle_playlist_request)
     app.router.add_get('/segment/{segment}', proxy.handle_ts_segment)
     app.router.add_get('/decrypt/segment.mp4', proxy.handle_decrypt_segment)
@@ -397,11 +400,14 @@ def create_app():
     app.router.add_route('OPTIONS', '/{tail:.*}', proxy.handle_options)
 
     async def cleanup_handler(app):
+        await TRANSPORT_ROUTES.stop()
         await proxy.cleanup()
     app.on_cleanup.append(cleanup_handler)
 
     async def on_startup(app):
         asyncio.create_task(ffmpeg_manager.cleanup_loop())
+        # Reload a caldo delle TRANSPORT_ROUTES (SIGHUP / modifica di TRANSPORT_ROUTES_FILE)
+        TRANSPORT_ROUTES.start(TRANSPORT_ROUTES_RELOAD_INTERVAL)
         if DVR_ENABLED:
             asyncio.create_task(recording_manager.cleanup_loop())
     app.on_startup.append(on_startup)
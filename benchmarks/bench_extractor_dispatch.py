@@ -0,0 +1,149 @@
+"""
+Micro-benchmark: dispatch URL -> estrattore.
+
+Confronta la vecchia catena if/elif di HLSProxy.get_extractor (riprodotta qui senza la costruzione
+degli estrattori) con ExtractorRegistry.match su 10k URL misti, e verifica che scelgano lo stesso
+estrattore.
+
+    python benchmarks/bench_extractor_dispatch.py [--urls 10000] [--rounds 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors.registry import EXTRACTOR_REGISTRY, ExtractorRegistry, EXTRACTOR_SPECS
+
+
+def legacy_match(url: str) -> str:
+    """Copia della catena if/elif originale (solo la scelta della chiave)."""
+    if "vavoo.to" in url:
+        return "vavoo"
+    elif any(domain in url for domain in ["daddylive", "dlhd", "daddyhd", "dlstreams.top"]) or re.search(r'watch\.php\?id=\d+', url):
+        return "dlhd"
+    elif 'vixsrc.to/' in url.lower() and any(x in url for x in ['/movie/', '/tv/', '/iframe/']):
+        return "vixsrc"
+    elif any(domain in url for domain in ["sportzonline", "sportsonline", "sprtsonline", "sportsnline"]):
+        return "sportsonline"
+    elif "mixdrop" in url:
+        return "mixdrop"
+    elif any(d in url for d in ["voe.sx", "voe.to", "voe.st", "voe.eu", "voe.la", "voe-network.net"]):
+        return "voe"
+    elif "popcdn.day" in url:
+        return "freeshot"
+    elif "streamtape.com" in url or "streamtape.to" in url or "streamtape.net" in url:
+        return "streamtape"
+    elif "orionoid.com" in url:
+        return "orion"
+    elif any(d in url for d in ["doodstream", "d000d.com", "dood.wf", "dood.cx", "dood.la", "dood.so", "dood.pm"]):
+        return "doodstream"
+    elif "fastream" in url:
+        return "fastream"
+    elif "filelions" in url:
+        return "filelions"
+    elif "filemoon" in url:
+        return "filemoon"
+    elif "lulustream" in url:
+        return "lulustream"
+    elif "maxstream" in url or "uprot.net" in url:
+        return "maxstream"
+    elif "ok.ru" in url or "odnoklassniki" in url:
+        return "okru"
+    elif any(d in url for d in ["streamwish", "swish", "wishfast", "embedwish", "wishembed"]):
+        return "streamwish"
+    elif "supervideo" in url:
+        return "supervideo"
+    elif "uqload" in url and not any(url.endswith(ext) or f"{ext}?" in url for ext in (".mp4", ".m3u8", ".ts", ".mkv", ".avi", ".mpd")):
+        return "uqload"
+    elif "vidmoly" in url:
+        return "vidmoly"
+    elif "vidoza" in url or "videzz" in url:
+        return "vidoza"
+    elif any(d in url for d in ["turboviplay", "emturbovid", "tuborstb", "javggvideo", "stbturbo", "turbovidhls"]):
+        return "turbovidplay"
+    elif "/e/" in url and any(d in url for d in ["f16px", "embedme", "embedsb", "playersb"]):
+        return "f16px"
+    return "hls_generic"
+
+
+SAMPLE_URLS = [
+    "https://vavoo.to/vavoo-iptv/play/12345",
+    "https://dlhd.dad/watch.php?id=577",
+    "https://daddylive.mp/stream/stream-577.php",
+    "https://dlstreams.top/embed/stream-1.php",
+    "https://vixsrc.to/movie/603",
+    "https://sportzonline.si/channels/hd/hd1.php",
+    "https://voe.sx/e/abcdef123",
+    "https://popcdn.day/player/abc",
+    "https://streamtape.com/e/xyz",
+    "https://d000d.com/e/abc123",
+    "https://fastream.to/embed-abc.html",
+    "https://filemoon.sx/e/abc",
+    "https://ok.ru/videoembed/1234",
+    "https://streamwish.to/e/abc",
+    "https://supervideo.cc/e/abc",
+    "https://uqload.is/embed-abc.html",
+    "https://vidmoly.to/embed-abc.html",
+    "https://vidoza.net/embed-abc.html",
+    "https://emturbovid.com/t/abc",
+    "https://f16px.com/e/abc",
+    # Traffico "generico": CDN HLS e segmenti (la maggioranza delle richieste reali)
+    "https://cdn1.example-cdn.net/live/channel1/index.m3u8",
+    "https://edge-42.streaming.example.org/hls/seg-1234.ts",
+    "https://video.somecdn.com/vod/movie/master.m3u8?token=abc",
+    "https://m80.uqload.is/abc/v.mp4",
+]
+
+
+def build_urls(count: int):
+    rng = random.Random(42)
+    urls = []
+    for i in range(count):
+        base = rng.choice(SAMPLE_URLS)
+        urls.append(f"{base}{'&' if '?' in base else '?'}n={i}")
+    return urls
+
+
+def bench(fn, urls, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for url in urls:
+            fn(url)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args):
+    urls = build_urls(args.urls)
+
+    def registry_match(url):
+        spec = EXTRACTOR_REGISTRY.match(url)
+        return spec.name if spec else "hls_generic"
+
+    mismatches = [(u, legacy_match(u), registry_match(u)) for u in urls if legacy_match(u) != registry_match(u)]
+
+    legacy = bench(legacy_match, urls, args.rounds)
+    fresh_registry = ExtractorRegistry(EXTRACTOR_SPECS)
+    cold = bench(lambda u: fresh_registry.match(u), urls, 1)
+    warm = bench(registry_match, urls, args.rounds)
+
+    print(f"urls={len(urls)} rounds={args.rounds}")
+    print(f"legacy if/elif : {legacy * 1e3:8.2f} ms  ({legacy / len(urls) * 1e6:.2f} µs/url)")
+    print(f"registry cold  : {cold * 1e3:8.2f} ms  ({cold / len(urls) * 1e6:.2f} µs/url)")
+    print(f"registry warm  : {warm * 1e3:8.2f} ms  ({warm / len(urls) * 1e6:.2f} µs/url)")
+    print(f"speedup (warm) : {legacy / warm:.2f}x")
+    print(f"mismatches     : {len(mismatches)}")
+    for url, old, new in mismatches[:10]:
+        print(f"  {url}: legacy={old} registry={new}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--urls', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,121 @@
+"""
+Benchmark: segmenti HLS via handle_proxy_request (vecchio percorso) vs handle_segment_request (fast path).
+
+Avvia una CDN finta locale e un'istanza del proxy su porte locali, poi misura le richieste/secondo
+per /proxy/hls/segment.ts con N client concorrenti.
+
+    python benchmarks/bench_segment_fastpath.py [--clients 50] [--duration 5] [--size 262144] [--unique]
+
+--unique  ogni richiesta chiede un segmento diverso (niente hit in cache: misura solo l'overhead
+          di dispatch); senza flag i client condividono la stessa finestra di segmenti live.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web, ClientSession, TCPConnector
+
+from services.hls_proxy import HLSProxy
+
+CDN_PORT = 18081
+PROXY_PORT = 18082
+
+
+def make_cdn_app(segment_size: int) -> web.Application:
+    payload = b"\x47" * segment_size
+    stats = {"requests": 0}
+
+    async def segment(request):
+        stats["requests"] += 1
+        return web.Response(body=payload, content_type="video/MP2T")
+
+    app = web.Application()
+    app.router.add_get('/live/{name}', segment)
+    app["stats"] = stats
+    return app
+
+
+def make_proxy_app(proxy: HLSProxy) -> web.Application:
+    app = web.Application()
+    app.router.add_get('/legacy/hls/segment.ts', proxy.handle_proxy_request)
+    app.router.add_get('/proxy/hls/segment.ts', proxy.handle_segment_request)
+    return app
+
+
+async def run_load(path: str, clients: int, duration: float, unique: bool) -> tuple:
+    counter = {"ok": 0, "err": 0, "seq": 0}
+    deadline = time.perf_counter() + duration
+    window = 5  # segmenti "live" condivisi tra i client
+
+    async def worker(session):
+        while time.perf_counter() < deadline:
+            counter["seq"] += 1
+            seq = counter["seq"] if unique else counter["seq"] % window
+            upstream = f"http://127.0.0.1:{CDN_PORT}/live/seg-{path.strip('/').replace('/', '-')}-{seq}.ts"
+            url = (f"http://127.0.0.1:{PROXY_PORT}{path}?d={urllib.parse.quote(upstream, safe='')}"
+                   f"&h_Referer={urllib.parse.quote('https://example.com/')}")
+            try:
+                async with session.get(url) as resp:
+                    await resp.read()
+                    if resp.status == 200:
+                        counter["ok"] += 1
+                    else:
+                        counter["err"] += 1
+            except Exception:
+                counter["err"] += 1
+
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+    return counter["ok"] / elapsed, counter["err"]
+
+
+async def main(args):
+    logging.disable(logging.CRITICAL)
+
+    cdn_app = make_cdn_app(args.size)
+    cdn_runner = web.AppRunner(cdn_app)
+    await cdn_runner.setup()
+    await web.TCPSite(cdn_runner, '127.0.0.1', CDN_PORT).start()
+
+    proxy = HLSProxy()
+    proxy_runner = web.AppRunner(make_proxy_app(proxy))
+    await proxy_runner.setup()
+    await web.TCPSite(proxy_runner, '127.0.0.1', PROXY_PORT).start()
+
+    mode = "unique segments" if args.unique else "shared live window"
+    print(f"clients={args.clients} duration={args.duration}s size={args.size}B mode={mode}")
+
+    results = {}
+    for label, path in (("before (handle_proxy_request)", "/legacy/hls/segment.ts"),
+                        ("after  (handle_segment_request)", "/proxy/hls/segment.ts")):
+        upstream_before = cdn_app["stats"]["requests"]
+        rps, errors = await run_load(path, args.clients, args.duration, args.unique)
+        upstream = cdn_app["stats"]["requests"] - upstream_before
+        results[label] = rps
+        print(f"{label}: {rps:8.1f} req/s  errors={errors}  upstream fetches={upstream}")
+
+    before, after = results.values()
+    if before:
+        print(f"speedup: {after / before:.2f}x")
+    print(f"segment cache: {proxy.segment_cache.stats()}")
+
+    await proxy.cleanup()
+    await proxy_runner.cleanup()
+    await cdn_runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--size', type=int, default=256 * 1024)
+    parser.add_argument('--unique', action='store_true')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""
+Benchmark: costo di import all'avvio (cold start su Render/HF Spaces).
+
+Per ogni scenario lancia N processi Python nuovi e misura il tempo di import (mediana),
+poi usa `python -X importtime` per mostrare i moduli più costosi.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 15]
+
+Scenari:
+  lazy   import di app_advanced (estrattori caricati al primo URL, comportamento attuale)
+  eager  import di app_advanced + tutti gli estrattori (equivalente al vecchio import a tappeto)
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "lazy": "import app_advanced",
+    "eager": (
+        "import app_advanced\n"
+        "from extractors.registry import EXTRACTOR_SPECS\n"
+        "for spec in EXTRACTOR_SPECS:\n"
+        "    try:\n"
+        "        spec.load()\n"
+        "    except Exception:\n"
+        "        pass\n"
+    ),
+}
+
+TIMER = (
+    "import time, logging\n"
+    "logging.disable(logging.CRITICAL)\n"
+    "start = time.perf_counter()\n"
+    "{code}\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def run_python(args, env=None):
+    return subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True, env=env)
+
+
+def measure(code: str, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        result = run_python(["-c", TIMER.format(code=code)])
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def importtime_top(code: str, top=None) -> list:
+    """Esegue `python -X importtime` e restituisce i moduli con il tempo cumulativo più alto."""
+    result = run_python(["-X", "importtime", "-c", code])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main(args):
+    results = {}
+    for name, code in SCENARIOS.items():
+        timings = measure(code, args.runs)
+        results[name] = statistics.median(timings)
+        print(f"{name:6s}: median {results[name] * 1e3:7.1f} ms  (min {min(timings) * 1e3:.1f}, max {max(timings) * 1e3:.1f}, runs={args.runs})")
+    print(f"saved : {(results['eager'] - results['lazy']) * 1e3:.1f} ms per cold start")
+
+    lazy_rows = importtime_top(SCENARIOS["lazy"], None)
+    eager_rows = importtime_top(SCENARIOS["eager"], None)
+
+    print(f"\n-X importtime, top {args.top} by cumulative time (lazy):")
+    for cumulative_us, self_us, module in lazy_rows[:args.top]:
+        print(f"  {cumulative_us / 1e3:8.1f} ms cumulative  {self_us / 1e3:7.1f} ms self  {module}")
+
+    lazy_modules = {module for _, _, module in lazy_rows}
+    deferred = [row for row in eager_rows if row[2] not in lazy_modules]
+    print(f"\nModules no longer imported at startup ({len(deferred)}), top {args.top} by cumulative time:")
+    for cumulative_us, self_us, module in deferred[:args.top]:
+        print(f"  {cumulative_us / 1e3:8.1f} ms cumulative  {self_us / 1e3:7.1f} ms self  {module}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    main(parser.parse_args())
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark: lookup TRANSPORT_ROUTES con 500 route.
+
+Confronta la vecchia scansione lineare (`route['url'] in url` su ogni route, ripetuta per
+proxy e SSL) con RouteTable (Aho–Corasick + memo per host) su 10k URL misti, e verifica che
+scelgano la stessa route.
+
+    python benchmarks/bench_transport_routes.py [--routes 500] [--urls 10000] [--rounds 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.route_matcher import RouteTable
+
+
+def build_routes(count: int):
+    rng = random.Random(7)
+    routes = []
+    for i in range(count):
+        if i % 10 == 9:
+            # Una route su dieci limita un path specifico
+            pattern = f"origin{i}.example.org/live/"
+        else:
+            pattern = f"cdn{i}.{rng.choice(['akamai', 'edge', 'fastly', 'stream'])}{i % 37}.net"
+        routes.append({
+            'url': pattern,
+            'proxy': f"socks5://10.0.{i // 256}.{i % 256}:1080" if i % 3 else None,
+            'disable_ssl': i % 4 == 0,
+            'max_conn': None,
+        })
+    return routes
+
+
+def build_urls(routes, count: int):
+    rng = random.Random(42)
+    hosts = [f"edge-{n}.somecdn.com" for n in range(40)] + [route['url'] for route in routes if '/' not in route['url']]
+    urls = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.6:
+            # Traffico senza route (la maggioranza): la scansione lineare le prova tutte
+            host = rng.choice(hosts[:40])
+            urls.append(f"https://{host}/hls/stream{i % 50}/seg-{i}.ts?token=abc{i}")
+        elif roll < 0.9:
+            host = rng.choice(hosts[40:])
+            urls.append(f"https://{host}/hls/seg-{i}.ts")
+        else:
+            n = rng.randrange(9, len(routes), 10)
+            urls.append(f"https://origin{n}.example.org/live/index-{i}.m3u8")
+    return urls
+
+
+def legacy_match(url, routes):
+    for route in routes:
+        if route['url'] in url:
+            return route
+    return None
+
+
+def legacy_lookup(url, routes):
+    # get_proxy_for_url + get_ssl_setting_for_url: due scansioni complete per richiesta
+    legacy_match(url, routes)
+    legacy_match(url, routes)
+
+
+def bench(fn, urls, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for url in urls:
+            fn(url)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args):
+    routes = build_routes(args.routes)
+    urls = build_urls(routes, args.urls)
+
+    start = time.perf_counter()
+    table = RouteTable(routes)
+    compile_time = time.perf_counter() - start
+
+    mismatches = [url for url in urls if legacy_match(url, routes) is not table.match(url)]
+
+    legacy = bench(lambda u: legacy_lookup(u, routes), urls, args.rounds)
+    cold_table = RouteTable(routes)
+    cold = bench(lambda u: (cold_table.match(u), cold_table.match(u)), urls, 1)
+    warm = bench(lambda u: (table.match(u), table.match(u)), urls, args.rounds)
+
+    print(f"routes={len(routes)} urls={len(urls)} rounds={args.rounds} (2 lookups per url: proxy + ssl)")
+    print(f"compile        : {compile_time * 1e3:8.2f} ms")
+    print(f"linear scan    : {legacy * 1e3:8.2f} ms  ({legacy / len(urls) * 1e6:.2f} µs/url)")
+    print(f"compiled cold  : {cold * 1e3:8.2f} ms  ({cold / len(urls) * 1e6:.2f} µs/url)")
+    print(f"compiled warm  : {warm * 1e3:8.2f} ms  ({warm / len(urls) * 1e6:.2f} µs/url)")
+    print(f"speedup (warm) : {legacy / warm:.1f}x")
+    print(f"memo           : {table.matcher.stats()}")
+    print(f"mismatches     : {len(mismatches)}")
+    for url in mismatches[:10]:
+        print(f"  {url}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, default=500)
+    parser.add_argument('--urls', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5)
+    main(parser.parse_args())
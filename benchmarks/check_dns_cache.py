@@ -0,0 +1,135 @@
+"""
+Verifica del CachingResolver contro un server DNS stub locale (UDP su 127.0.0.1, porta casuale).
+
+Lo stub risponde ai nomi *.test con un record A e TTL configurabile, con NXDOMAIN (SOA con
+MINIMUM=2s) a nx.test, e conta le query ricevute. Lo script controlla:
+
+  - cache positiva: N risoluzioni dello stesso host -> 1 query
+  - single-flight: risoluzioni concorrenti dello stesso host -> 1 query
+  - cache negativa: NXDOMAIN ricordato per il TTL del SOA
+  - rispetto del TTL e ri-risoluzione in background: un host "caldo" viene aggiornato prima della
+    scadenza e la risoluzione sul percorso della richiesta resta un hit (nessuna attesa DNS)
+  - latenza: lookup a freddo (con ritardo simulato dello stub) vs hit in cache
+
+    python benchmarks/check_dns_cache.py [--ttl 2] [--delay-ms 50]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.dns_cache import CachingResolver
+
+
+class StubDNS(asyncio.DatagramProtocol):
+    def __init__(self, ttl: int, delay: float):
+        self.ttl = ttl
+        self.delay = delay
+        self.queries = {}
+        self.answer_ip = "10.0.0.1"
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.get_running_loop().call_later(self.delay, self._answer, data, addr)
+
+    def _answer(self, data, addr):
+        qid, _, qdcount = struct.unpack_from('!HHH', data)
+        offset, labels = 12, []
+        while data[offset]:
+            labels.append(data[offset + 1:offset + 1 + data[offset]].decode())
+            offset += 1 + data[offset]
+        question_end = offset + 5
+        qtype = struct.unpack_from('!H', data, offset + 1)[0]
+        name = '.'.join(labels)
+        self.queries[name] = self.queries.get(name, 0) + 1
+        question = data[12:question_end]
+
+        if name.startswith('nx.'):
+            soa = b'\x00' * 2 + struct.pack('!IIIII', 1, 3600, 600, 86400, 2)
+            authority = b'\xc0\x0c' + struct.pack('!HHIH', 6, 1, 60, len(soa)) + soa
+            header = struct.pack('!HHHHHH', qid, 0x8183, qdcount, 0, 1, 0)
+            self.transport.sendto(header + question + authority, addr)
+            return
+
+        answers = b''
+        ancount = 0
+        if qtype == 1:
+            answers = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, self.ttl, 4) + socket.inet_aton(self.answer_ip)
+            ancount = 1
+        header = struct.pack('!HHHHHH', qid, 0x8180, qdcount, ancount, 0, 0)
+        self.transport.sendto(header + question + answers, addr)
+
+
+def check(label, condition, detail=""):
+    print(f"  {'OK  ' if condition else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+    transport, stub = await loop.create_datagram_endpoint(
+        lambda: StubDNS(args.ttl, args.delay_ms / 1000), local_addr=('127.0.0.1', 0)
+    )
+    port = transport.get_extra_info('sockname')[1]
+    resolver = CachingResolver(nameservers=[('127.0.0.1', port)], min_ttl=1, hot_window=60)
+    ok = True
+    print(f"stub DNS on 127.0.0.1:{port} (ttl={args.ttl}s, delay={args.delay_ms}ms)")
+
+    start = time.perf_counter()
+    result = await resolver.resolve('cdn.test', 443)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(100):
+        await resolver.resolve('cdn.test', 443)
+    warm = (time.perf_counter() - start) / 100
+    ok &= check("positive cache", stub.queries.get('cdn.test') == 1, f"{stub.queries.get('cdn.test')} queries for 101 lookups")
+    ok &= check("result", result[0]['host'] == stub.answer_ip and result[0]['port'] == 443, str(result[0]))
+    print(f"  cold lookup {cold * 1e3:.1f} ms, cached lookup {warm * 1e6:.1f} µs")
+
+    await asyncio.gather(*(resolver.resolve('burst.test') for _ in range(50)))
+    ok &= check("single-flight", stub.queries.get('burst.test') == 1, f"{stub.queries.get('burst.test')} queries for 50 concurrent lookups")
+
+    for _ in range(3):
+        try:
+            await resolver.resolve('nx.test')
+        except OSError:
+            pass
+    ok &= check("negative cache", stub.queries.get('nx.test') == 1, f"{stub.queries.get('nx.test')} queries for 3 lookups")
+    await asyncio.sleep(2.5)
+    try:
+        await resolver.resolve('nx.test')
+    except OSError:
+        pass
+    ok &= check("negative TTL from SOA expires", stub.queries.get('nx.test') == 2, f"{stub.queries.get('nx.test')} queries")
+
+    # Host "caldo": continua a essere usato oltre il TTL, il refresher lo aggiorna in anticipo
+    stub.answer_ip = "10.0.0.2"
+    slowest = 0.0
+    deadline = time.monotonic() + args.ttl * 3
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        result = await resolver.resolve('cdn.test', 443)
+        slowest = max(slowest, time.perf_counter() - start)
+        await asyncio.sleep(0.1)
+    ok &= check("background refresh picked up the new address", result[0]['host'] == "10.0.0.2", result[0]['host'])
+    ok &= check("no request waited on DNS", slowest < args.delay_ms / 1000, f"slowest lookup {slowest * 1e3:.2f} ms")
+    print(f"  stats: {resolver.stats()}")
+
+    await resolver.stop()
+    transport.close()
+    print("ALL OK" if ok else "SOME CHECKS FAILED")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ttl', type=int, default=2)
+    parser.add_argument('--delay-ms', type=float, default=50)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
@@ -0,0 +1,96 @@
+"""
+Verifica dell'extraction store SQLite (senza rete: l'"estrazione" è uno sleep).
+
+Due istanze di ExtractionStore sullo stesso file simulano due worker gunicorn:
+  - le scritture sono write-behind (put() non blocca) e visibili subito a chi le ha fatte
+  - dopo il flush l'altro worker legge il risultato invece di ri-estrarre
+  - le righe scadute non vengono restituite
+  - un riavvio (nuova istanza dopo stop()) trova i risultati ancora validi
+  - N worker che scrivono in parallelo non perdono aggiornamenti (WAL + busy_timeout)
+
+    python benchmarks/check_extraction_store.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.extraction_cache import ExtractionCache
+from services.extraction_store import ExtractionStore
+
+URL = "https://channel.example.test/stream-1.php"
+
+
+def check(label, condition, detail=""):
+    print(f"  {'OK  ' if condition else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+async def main():
+    ok = True
+    path = os.path.join(tempfile.mkdtemp(), "extractions.db")
+    extractions = []
+
+    async def extract():
+        extractions.append(time.monotonic())
+        await asyncio.sleep(0.2)
+        return {"destination_url": "https://cdn.example.test/live/TOKEN/index.m3u8", "request_headers": {"Referer": "x"}}
+
+    worker_a = ExtractionStore(path, flush_interval=0.05)
+    worker_b = ExtractionStore(path, flush_interval=0.05)
+    cache_a = ExtractionCache(default_ttl=60, store=worker_a)
+    cache_b = ExtractionCache(default_ttl=60, store=worker_b)
+
+    start = time.perf_counter()
+    worker_a.put("bench", "write", {"n": 1})
+    ok &= check("put() does not block the loop", time.perf_counter() - start < 0.005,
+                f"{(time.perf_counter() - start) * 1e3:.2f} ms")
+    ok &= check("read-your-writes before flush", await worker_a.get("bench", "write") == {"n": 1})
+
+    _, state = await cache_a.get_or_extract("dlhd", URL, extract)
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    result, state_b = await cache_b.get_or_extract("dlhd", URL, extract)
+    ok &= check("second worker reuses the extraction", len(extractions) == 1 and state_b == "miss",
+                f"{len(extractions)} extractions, resolved in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    ok &= check("store hit counted", cache_b.stats()["per_extractor"]["dlhd"]["store_hits"] == 1)
+
+    worker_a.put("bench", "expired", {"n": 2}, expires_at=time.time() - 1)
+    await asyncio.sleep(0.2)
+    ok &= check("expired rows are not returned", await worker_b.get("bench", "expired") is None)
+
+    await worker_a.stop()
+    await worker_b.stop()
+    restarted = ExtractionStore(path)
+    cache_r = ExtractionCache(default_ttl=60, store=restarted)
+    _, state = await cache_r.get_or_extract("dlhd", URL, extract)
+    ok &= check("warm restart serves persisted extraction", len(extractions) == 1)
+
+    cache_r.invalidate("dlhd", URL)
+    await restarted.stop()
+    restarted = ExtractionStore(path)
+    ok &= check("invalidation is persisted", await restarted.get("extraction:dlhd", URL) is None)
+    await restarted.stop()
+
+    # Scritture concorrenti da più "worker" (thread diversi, connessioni diverse)
+    workers = [ExtractionStore(path, flush_interval=0.01) for _ in range(4)]
+    for round_ in range(50):
+        for i, worker in enumerate(workers):
+            worker.put("bench", f"w{i}-{round_}", {"round": round_})
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*(worker.stop() for worker in workers))
+    reader = ExtractionStore(path)
+    found = sum([await reader.get("bench", f"w{i}-{r}") is not None for i in range(4) for r in range(50)])
+    ok &= check("concurrent writers lose no rows", found == 200, f"{found}/200, errors {sum(w.errors for w in workers)}")
+    print(f"  stats: {reader.stats()}")
+    await reader.stop()
+
+    print("ALL OK" if ok else "SOME CHECKS FAILED")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,87 @@
+"""
+Verifica di HedgedFetcher contro un upstream aiohttp locale con connessioni che si bloccano.
+
+L'upstream risponde in ~20 ms, ma una richiesta su `--stall-every` resta ferma per `--stall` secondi
+(connessione "appesa"). Si confrontano i tempi di fetch con e senza hedging (stessa sessione in
+pool, stessa deadline) e si contano le richieste in più arrivate all'upstream.
+
+    python benchmarks/check_hedging.py [--requests 400] [--stall-every 25] [--stall 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.hedging import HedgedFetcher
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def run(session, url, requests, fetcher, deadline):
+    timings = []
+
+    async def attempt(timeout):
+        async with session.get(url, timeout=ClientTimeout(total=timeout)) as resp:
+            return resp.status, await resp.read()
+
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            if fetcher is None:
+                await attempt(deadline)
+            else:
+                await fetcher.fetch(url, attempt, deadline, record=lambda result: result[0] == 200)
+        except asyncio.TimeoutError:
+            pass
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def main(args):
+    state = {"count": 0}
+
+    async def segment(request):
+        state["count"] += 1
+        await asyncio.sleep(args.stall if state["count"] % args.stall_every == 0 else 0.02)
+        return web.Response(body=b"\x47" * 188 * 100)
+
+    app = web.Application()
+    app.router.add_get('/seg.ts', segment)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/seg.ts"
+
+    ok = True
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        plain = await run(session, url, args.requests, None, 30)
+        fetcher = HedgedFetcher(percentile=95, max_ratio=0.1)
+        hedged = await run(session, url, args.requests, fetcher, 8)
+
+    for label, timings in (("flat timeout", plain), ("hedged", hedged)):
+        print(f"{label:13}: p50 {percentile(timings, 50) * 1e3:7.1f} ms  p99 {percentile(timings, 99) * 1e3:7.1f} ms  "
+              f"max {max(timings) * 1e3:7.1f} ms  total {sum(timings):6.2f} s")
+    print(f"stats: {fetcher.stats()}")
+    ok &= max(hedged[fetcher.min_samples:]) < args.stall / 2
+    print(f"upstream requests: {state['count']} for {2 * args.requests} fetches")
+    await runner.cleanup()
+    print("ALL OK" if ok else "SOME CHECKS FAILED")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--stall-every', type=int, default=25)
+    parser.add_argument('--stall', type=float, default=5)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
@@ -0,0 +1,84 @@
+"""
+Verifica dello scheduler a priorità di HostConcurrencyGovernor (senza rete: il "fetch" è uno sleep).
+
+Scenario su un host con limite 8:
+  - 24 prefetch (run_speculative PREFETCH) da 1s ciascuno saturano l'host
+  - arrivano 6 segmenti on-demand, 2 manifest e 1 chiave
+Controlli:
+  - i prefetch non occupano più di limit - limit/4 slot (margine per l'on-demand)
+  - le richieste on-demand ottengono lo slot subito grazie alla preemption dei prefetch
+  - con la coda piena, l'ordine di servizio è key > manifest > segment > prefetch
+  - queue depth per classe esposta in stats()
+
+    python benchmarks/check_priority_scheduler.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.host_limiter import HostConcurrencyGovernor
+from services.request_priority import Priority, run_speculative
+
+URL = "https://cdn.example.test/seg.ts"
+
+
+def check(label, condition, detail=""):
+    print(f"  {'OK  ' if condition else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+async def work(governor, priority, seconds, log, name):
+    start = time.monotonic()
+    async with governor.slot(URL, priority=priority):
+        log.append((name, time.monotonic() - start))
+        await asyncio.sleep(seconds)
+
+
+async def main():
+    ok = True
+    governor = HostConcurrencyGovernor(default_ceiling=8, queue_timeout=10)
+    limiter = governor.limiter_for(URL)
+    log = []
+
+    prefetches = [
+        asyncio.ensure_future(run_speculative(Priority.PREFETCH, lambda i=i: work(governor, Priority.SEGMENT, 1.0, log, f"prefetch{i}")))
+        for i in range(24)
+    ]
+    await asyncio.sleep(0.05)
+    ok &= check("prefetch keeps a reserve for on-demand", limiter.in_flight == int(limiter.limit) - int(limiter.limit) // 4,
+                f"{limiter.in_flight} in flight, limit {int(limiter.limit)}")
+    depth = governor.stats()["queue_depth"]
+    ok &= check("queue depth per class", depth["prefetch"] == 24 - limiter.in_flight, str(depth))
+
+    on_demand = [asyncio.ensure_future(work(governor, Priority.SEGMENT, 0.05, log, f"segment{i}")) for i in range(6)]
+    await asyncio.gather(*on_demand)
+    waits = [wait for name, wait in log if name.startswith("segment")]
+    ok &= check("on-demand segments admitted without waiting for prefetch", max(waits) < 0.2,
+                f"max wait {max(waits) * 1e3:.0f} ms, preemptions {limiter.preemptions}")
+
+    # Host saturato da segmenti on-demand lunghi: l'ordine di uscita dalla coda segue la classe
+    log.clear()
+    blockers = [asyncio.ensure_future(work(governor, Priority.SEGMENT, 0.3, log, f"blocker{i}")) for i in range(int(limiter.limit))]
+    await asyncio.sleep(0.05)
+    queued = [asyncio.ensure_future(work(governor, Priority.SEGMENT, 0.01, log, "segment"))]
+    queued.append(asyncio.ensure_future(work(governor, Priority.MANIFEST, 0.01, log, "manifest")))
+    queued.append(asyncio.ensure_future(work(governor, Priority.KEY, 0.01, log, "key")))
+    await asyncio.gather(*blockers, *queued)
+    order = [name for name, _ in log if not name.startswith("blocker") and not name.startswith("prefetch")]
+    ok &= check("queued requests served by class", order[:3] == ["key", "manifest", "segment"], str(order[:3]))
+
+    for task in prefetches:
+        task.cancel()
+    results = await asyncio.gather(*prefetches, return_exceptions=True)
+    print(f"  prefetch outcomes: {sum(isinstance(r, asyncio.CancelledError) for r in results)} cancelled/preempted, "
+          f"{sum(r is None for r in results)} completed")
+    print(f"  stats: {governor.stats()['per_host']}")
+    print("ALL OK" if ok else "SOME CHECKS FAILED")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
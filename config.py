@@ -1,8 +1,13 @@
 import os
+import re
 import logging
-import random
-from dotenv import load_dotenv
+from dotenv import load_dotenv, dotenv_values
 
+from services.proxy_pool import PROXY_POOL
+from services.route_matcher import RouteTable
+
+# TRANSPORT_ROUTES impostata dall'ambiente reale (Docker/systemd): ha la precedenza sul .env anche nei reload
+_TRANSPORT_ROUTES_FROM_ENV = 'TRANSPORT_ROUTES' in os.environ
 load_dotenv() # Load variables from .env file
 
 # --- Log Level Configuration ---
@@ -45,16 +50,23 @@ def parse_proxies(proxy_env_var: str) -> list:
         return [p.strip() for p in proxies_str.split(',') if p.strip()]
     return []
 
-def parse_transport_routes() -> list:
-    """Analizza TRANSPORT_ROUTES nel formato {URL=domain, PROXY=proxy, DISABLE_SSL=true/false}, {URL=domain2, PROXY=proxy2}"""
-    routes_str = os.environ.get('TRANSPORT_ROUTES', "").strip()
+def parse_transport_routes(routes_str: str = None, strict: bool = False) -> list:
+    """Analizza TRANSPORT_ROUTES nel formato {URL=domain, PROXY=proxy, DISABLE_SSL=true/false, MAX_CONN=n}, {URL=domain2, PROXY=proxy2}
+
+    Con strict=True (reload) un errore di parsing viene propagato invece di restituire una lista parziale.
+    """
+    if routes_str is None:
+        routes_str = os.environ.get('TRANSPORT_ROUTES', "")
+    routes_str = routes_str.strip()
     if not routes_str:
         return []
 
     routes = []
     try:
         # Rimuovi spazi e dividi per }, {
-        route_parts = [part.strip() for part in routes_str.replace(' ', '').split('},{')]
+        # Accetta anche una route per riga (file TRANSPORT_ROUTES_FILE): "}\n{" equivale a "},{"
+        routes_str = re.sub(r'\s+', '', re.sub(r'\}\s*,?\s*\{', '},{', routes_str))
+        route_parts = [part.strip() for part in routes_str.split('},{')]
 
         for part in route_parts:
             if not part:
@@ -63,10 +75,11 @@ def parse_transport_routes() -> list:
             # Rimuovi { e } se presenti
             part = part.strip('{}')
 
-            # Parsea URL=..., PROXY=..., DISABLE_SSL=...
+            # Parsea URL=..., PROXY=..., DISABLE_SSL=..., MAX_CONN=...
             url_match = None
             proxy_match = None
             disable_ssl_match = None
+            max_conn_match = None
 
             for item in part.split(','):
                 if item.startswith('URL='):
@@ -76,56 +89,89 @@ def parse_transport_routes() -> list:
                 elif item.startswith('DISABLE_SSL='):
                     disable_ssl_str = item[12:].lower()
                     disable_ssl_match = disable_ssl_str in ('true', '1', 'yes', 'on')
+                elif item.startswith('MAX_CONN='):
+                    try:
+                        max_conn_match = int(item[9:])
+                    except ValueError:
+                        # Valore non valido: si ignora solo MAX_CONN, la route resta
+                        logger.warning(f"Invalid MAX_CONN '{item[9:]}' in TRANSPORT_ROUTES, ignored")
 
             if url_match:
                 routes.append({
                     'url': url_match,
                     'proxy': proxy_match if proxy_match else None,
-                    'disable_ssl': disable_ssl_match if disable_ssl_match is not None else False
+                    'disable_ssl': disable_ssl_match if disable_ssl_match is not None else False,
+                    'max_conn': max_conn_match
                 })
 
     except Exception as e:
+        if strict:
+            raise
         logger.warning(f"Error parsing TRANSPORT_ROUTES: {e}")
 
     return routes
 
-def get_proxy_for_url(url: str, transport_routes: list, global_proxies: list) -> str:
-    """Trova il proxy appropriato per un URL basato su TRANSPORT_ROUTES"""
-    if not url or not transport_routes:
-        return random.choice(global_proxies) if global_proxies else None
+def get_proxy_for_url(url: str, transport_routes: list, global_proxies: list, affinity_key: str = None) -> str:
+    """Trova il proxy appropriato per un URL basato su TRANSPORT_ROUTES.
 
-    # Cerca corrispondenze negli URL patterns
-    for route in transport_routes:
-        url_pattern = route['url']
-        if url_pattern in url:
-            proxy_value = route['proxy']
-            if proxy_value:
-                # Se è un singolo proxy, restituiscilo
-                return proxy_value
-            else:
-                # Se proxy è vuoto, usa connessione diretta
-                return None
+    Con affinity_key (URL originale del canale) i proxy globali restano fissi per tutto lo stream.
+    """
+    route = _match_route(url, transport_routes)
+    if route is not None:
+        # Proxy della route, oppure connessione diretta se PROXY è vuoto
+        return route['proxy']
 
     # Se non trova corrispondenza, usa global proxies
-    return random.choice(global_proxies) if global_proxies else None
+    return PROXY_POOL.choose(global_proxies, affinity_key)
 
 def get_ssl_setting_for_url(url: str, transport_routes: list) -> bool:
     """Determina se SSL deve essere disabilitato per un URL basato su TRANSPORT_ROUTES"""
+    route = _match_route(url, transport_routes)
+    # Se non trova corrispondenza, SSL abilitato per default
+    return route.get('disable_ssl', False) if route is not None else False
+
+def get_max_conn_for_url(url: str, transport_routes: list):
+    """Tetto di connessioni concorrenti per l'host dell'URL (MAX_CONN di TRANSPORT_ROUTES), None se non impostato"""
+    route = _match_route(url, transport_routes)
+    return route.get('max_conn') if route is not None else None
+
+def load_transport_routes() -> list:
+    """
+    Legge le route da TRANSPORT_ROUTES_FILE se impostato, altrimenti da TRANSPORT_ROUTES.
+    Stessa precedenza dell'avvio (load_dotenv non sovrascrive l'ambiente): se TRANSPORT_ROUTES era già
+    nell'ambiente del processo vale quella, altrimenti il .env viene riletto a ogni reload.
+    """
+    if TRANSPORT_ROUTES_FILE:
+        with open(TRANSPORT_ROUTES_FILE, encoding='utf-8') as f:
+            lines = [line for line in f if not line.lstrip().startswith('#')]
+        return parse_transport_routes(''.join(lines), strict=True)
+    # Le variabili d'ambiente del processo non cambiano a runtime: un reload può solo rileggere il .env
+    routes_str = None if _TRANSPORT_ROUTES_FROM_ENV else dotenv_values().get('TRANSPORT_ROUTES')
+    return parse_transport_routes(routes_str if routes_str is not None else os.environ.get('TRANSPORT_ROUTES', ""), strict=True)
+
+def _match_route(url: str, transport_routes: list):
+    """Prima route il cui URL è contenuto in `url` (matcher compilato se disponibile, altrimenti scansione lineare)."""
     if not url or not transport_routes:
-        return False  # Default: SSL enabled
-
-    # Cerca corrispondenze negli URL patterns
+        return None
+    if isinstance(transport_routes, RouteTable):
+        return transport_routes.match(url)
     for route in transport_routes:
-        url_pattern = route['url']
-        if url_pattern in url:
-            return route.get('disable_ssl', False)
-
-    # Se non trova corrispondenza, SSL abilitato per default
-    return False
+        if route['url'] in url:
+            return route
+    return None
 
 # Configurazione proxy
 GLOBAL_PROXIES = parse_proxies('GLOBAL_PROXY')
-TRANSPORT_ROUTES = parse_transport_routes()
+# File opzionale con le route (stesso formato, una per riga): modifiche e SIGHUP le ricaricano senza riavvio
+TRANSPORT_ROUTES_FILE = os.environ.get("TRANSPORT_ROUTES_FILE", "").strip() or None
+TRANSPORT_ROUTES_RELOAD_INTERVAL = float(os.environ.get("TRANSPORT_ROUTES_RELOAD_INTERVAL", 5))
+_initial_routes = parse_transport_routes()
+if TRANSPORT_ROUTES_FILE:
+    try:
+        _initial_routes = load_transport_routes()
+    except Exception as e:
+        logging.error(f"❌ Cannot load TRANSPORT_ROUTES_FILE {TRANSPORT_ROUTES_FILE}: {e}")
+TRANSPORT_ROUTES = RouteTable(_initial_routes, loader=load_transport_routes, source_file=TRANSPORT_ROUTES_FILE)
 
 # Logging configurazione proxy
 if GLOBAL_PROXIES: logging.info(f"🌍 Loaded {len(GLOBAL_PROXIES)} global proxies.")
@@ -152,6 +198,86 @@ if MPD_MODE not in ("ffmpeg", "legacy"):
     MPD_MODE = "legacy"
 logging.info(f"🎬 MPD Mode: {MPD_MODE}")
 
+# --- Segment Cache Configuration ---
+# Cache in memoria condivisa tra i viewer dello stesso canale (budget totale in MB e TTL in secondi)
+SEGMENT_CACHE_MAX_MB = int(os.environ.get("SEGMENT_CACHE_MAX_MB", 256))
+SEGMENT_CACHE_TTL = float(os.environ.get("SEGMENT_CACHE_TTL", 30))
+
+# --- Upstream Concurrency Configuration ---
+# Tetto di richieste concorrenti per host upstream (il limite effettivo si adatta in AIMD sotto questo valore).
+# Sovrascrivibile per dominio con MAX_CONN=n in TRANSPORT_ROUTES.
+HOST_MAX_CONCURRENCY = int(os.environ.get("HOST_MAX_CONCURRENCY", 32))
+HOST_QUEUE_SIZE = int(os.environ.get("HOST_QUEUE_SIZE", 256))
+HOST_QUEUE_TIMEOUT = float(os.environ.get("HOST_QUEUE_TIMEOUT", 10))
+
+# --- Manifest Cache Configuration ---
+# I manifest HLS riscritti restano in cache per questa frazione di EXT-X-TARGETDURATION (0 = disabilitata)
+MANIFEST_CACHE_TTL_FRACTION = float(os.environ.get("MANIFEST_CACHE_TTL_FRACTION", 0.5))
+# Poller in background per i playlist live con viewer attivi: si ferma dopo N secondi senza richieste (0 = disabilitato)
+LIVE_POLLER_IDLE_TIMEOUT = float(os.environ.get("LIVE_POLLER_IDLE_TIMEOUT", 30))
+# Prefetch look-ahead dei segmenti HLS: numero massimo di segmenti scaricati in anticipo (0 = disabilitato)
+SEGMENT_PREFETCH_MAX_AHEAD = int(os.environ.get("SEGMENT_PREFETCH_MAX_AHEAD", 4))
+# Deadline del fetch di un segmento = N x EXT-X-TARGETDURATION (minimo SEGMENT_DEADLINE_MIN, 30s se il playlist non è noto)
+SEGMENT_DEADLINE_FACTOR = float(os.environ.get("SEGMENT_DEADLINE_FACTOR", 2.0))
+SEGMENT_DEADLINE_MIN = float(os.environ.get("SEGMENT_DEADLINE_MIN", 4))
+# Hedging: se un segmento supera questo percentile della latenza dell'host parte una seconda richiesta (0 = disabilitato)
+SEGMENT_HEDGE_PERCENTILE = float(os.environ.get("SEGMENT_HEDGE_PERCENTILE", 95))
+# Frazione massima di richieste per host che possono essere duplicate
+SEGMENT_HEDGE_MAX_RATIO = float(os.environ.get("SEGMENT_HEDGE_MAX_RATIO", 0.1))
+
+# --- Extraction Cache Configuration ---
+# Risultati degli estrattori riutilizzati per N secondi (0 = disabilitata); mai oltre l'expires_at del token
+EXTRACTION_CACHE_TTL = float(os.environ.get("EXTRACTION_CACHE_TTL", 300))
+# Dopo il TTL il risultato resta servibile per N secondi mentre viene aggiornato in background
+EXTRACTION_CACHE_STALE = float(os.environ.get("EXTRACTION_CACHE_STALE", 120))
+# TTL per estrattore, es. "vavoo=600,sportsonline=60,hls_generic=0"
+EXTRACTION_CACHE_TTLS = os.environ.get("EXTRACTION_CACHE_TTLS", "")
+# Database SQLite (WAL) condiviso tra i worker: estrazioni e cache DLHD sopravvivono ai riavvii (vuoto = solo memoria)
+EXTRACTION_STORE_PATH = os.environ.get("EXTRACTION_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "extractions.db"))
+
+# --- Extraction Pre-warm Configuration ---
+# Dopo /playlist i canali della lista vengono estratti in anticipo: massimo N per playlist, i più richiesti per primi (0 = disabilitato)
+PREWARM_MAX_CHANNELS = int(os.environ.get("PREWARM_MAX_CHANNELS", 200))
+# Estrazioni di pre-warm in parallelo e avviate al secondo
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", 4))
+PREWARM_RATE = float(os.environ.get("PREWARM_RATE", 5))
+
+# --- Token Lifecycle Configuration ---
+# Token con scadenza nota: ri-estrazione quando resta questa frazione della durata, finché il canale ha viewer (0 = disabilitato)
+TOKEN_REFRESH_FRACTION = float(os.environ.get("TOKEN_REFRESH_FRACTION", 0.5))
+# Anticipo massimo del refresh rispetto alla scadenza (secondi), per i token a lunga durata
+TOKEN_REFRESH_MAX_LEAD = float(os.environ.get("TOKEN_REFRESH_MAX_LEAD", 300))
+# Secondi senza richieste dopo i quali un canale non viene più rinnovato
+TOKEN_VIEWER_IDLE = float(os.environ.get("TOKEN_VIEWER_IDLE", 60))
+
+# --- Proxy Pool Configuration ---
+# I proxy globali sono scelti in base a latenza ed errori misurati; una probe periodica verifica quelli noti (0 = nessuna probe)
+PROXY_PROBE_INTERVAL = float(os.environ.get("PROXY_PROBE_INTERVAL", 60))
+PROXY_PROBE_URL = os.environ.get("PROXY_PROBE_URL", "https://www.gstatic.com/generate_204")
+# Errori consecutivi dopo i quali un proxy viene escluso temporaneamente (cooldown in secondi, raddoppia a ogni ricaduta)
+PROXY_FAILURE_THRESHOLD = int(os.environ.get("PROXY_FAILURE_THRESHOLD", 3))
+PROXY_DOWN_COOLDOWN = float(os.environ.get("PROXY_DOWN_COOLDOWN", 30))
+# Affinità stream -> proxy: scade dopo N secondi senza richieste per quel canale
+PROXY_AFFINITY_TTL = float(os.environ.get("PROXY_AFFINITY_TTL", 600))
+
+# --- DNS Cache Configuration ---
+# Nameserver interrogati dalla cache DNS condivisa ("1.1.1.1,8.8.8.8:53"); vuoto = /etc/resolv.conf
+DNS_SERVERS = os.environ.get("DNS_SERVERS", "").strip()
+# I TTL dei record vengono rispettati entro questi limiti (secondi); le risposte negative restano in cache DNS_CACHE_NEGATIVE_TTL
+DNS_CACHE_MIN_TTL = float(os.environ.get("DNS_CACHE_MIN_TTL", 5))
+DNS_CACHE_MAX_TTL = float(os.environ.get("DNS_CACHE_MAX_TTL", 300))
+DNS_CACHE_NEGATIVE_TTL = float(os.environ.get("DNS_CACHE_NEGATIVE_TTL", 30))
+# Hostname usati negli ultimi N secondi vengono ririsolti in background prima della scadenza (0 = disabilitato)
+DNS_PREFETCH_WINDOW = float(os.environ.get("DNS_PREFETCH_WINDOW", 600))
+# --- Playlist Builder Configuration ---
+# Una sorgente di /playlist che resta N secondi senza inviare dati viene scartata (le altre non la aspettano)
+PLAYLIST_SOURCE_TIMEOUT = float(os.environ.get("PLAYLIST_SOURCE_TIMEOUT", 15))
+# Cache su disco delle playlist sorgente, revalidate con ETag/Last-Modified (vuoto = disabilitata)
+PLAYLIST_CACHE_DIR = os.environ.get("PLAYLIST_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "playlist_cache"))
+# Una sorgente controllata da meno di N secondi viene servita dalla cache senza richieste (sovrascrivibile con |refresh=N)
+PLAYLIST_CACHE_MIN_REFRESH = float(os.environ.get("PLAYLIST_CACHE_MIN_REFRESH", 300))
+PLAYLIST_CACHE_MAX_MB = int(os.environ.get("PLAYLIST_CACHE_MAX_MB", 500))
+
 def check_password(request):
     """Verifica la password API se impostata."""
     if not API_PASSWORD:
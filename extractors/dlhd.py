@@ -1,4 +1,5 @@
 import asyncio
+import contextvars
 import logging
 import re
 import base64
@@ -7,7 +8,6 @@ import os
 import gzip
 import zlib
 import zstandard
-import random
 import time
 from urllib.parse import urlparse, quote_plus
 import aiohttp
@@ -15,9 +15,15 @@ from aiohttp import ClientSession, ClientTimeout, TCPConnector, FormData
 from aiohttp_socks import ProxyConnector
 from typing import Dict, Any, Optional
 from urllib.parse import urljoin
+from services.proxy_pool import PROXY_POOL
+from services.dns_cache import DNS_RESOLVER
+from services.extraction_store import EXTRACTION_STORE
 
 logger = logging.getLogger(__name__)
 
+# True dentro i tentativi della gara degli host iframe (vedi _get_stream_data_direct)
+_HOST_RACE: contextvars.ContextVar = contextvars.ContextVar("dlhd_host_race", default=False)
+
 class ExtractorError(Exception):
     pass
 
@@ -35,6 +41,17 @@ class DLHDExtractor:
         r'[?&]id=(\d+)',
         r'daddyhd\.php\?id=(\d+)',
     ]
+    # Namespace nell'extraction store: configurazione/host e stream per channel_id
+    STORE_NAMESPACE = "dlhd"
+    STREAMS_NAMESPACE = "dlhd_streams"
+    # Rivalidazione in background dei canali in cache: intervallo, inattività dopo cui un canale
+    # non viene più verificato, verifiche concorrenti
+    REVALIDATE_INTERVAL = 60
+    REVALIDATE_IDLE = 600
+    REVALIDATE_CONCURRENCY = 4
+    # Gara tra host iframe: tentativi in parallelo e ritardo prima di avviare il successivo (secondi)
+    HOST_RACE_WIDTH = 3
+    HOST_RACE_STAGGER = 0.75
 
     def __init__(self, request_headers: dict, proxies: list = None):
         self.request_headers = request_headers
@@ -42,18 +59,29 @@ class DLHDExtractor:
             "user-agent": self.USER_AGENT,
         }
         self.session = None
+        # Proxy della sessione corrente: HLSProxy ci lega lo stream estratto (token legati all'IP)
+        self.session_proxy = None
         self.mediaflow_endpoint = "hls_manifest_proxy"
         self._session_lock = asyncio.Lock()
         self.proxies = proxies or []
         self._extraction_locks: Dict[str, asyncio.Lock] = {} # ✅ NUOVO: Lock per evitare estrazioni multiple
+        # Vecchia cache su file (Base64 JSON): letta una sola volta per migrarla nello store condiviso
         self.cache_file = os.path.join(os.path.dirname(__file__), '.dlhd_cache')
         
         # Carica cache e inizializza host
         cache_data = self._load_cache()
+        # Cache L1 in memoria; lo store (SQLite condiviso tra i worker) viene letto sui miss
         self._stream_data_cache: Dict[str, Dict[str, Any]] = cache_data.get('streams', {})
+        # Rivalidazione in background: ultimo uso per canale, voci con verifica fallita, refresh in corso
+        self._last_access: Dict[str, float] = {}
+        self._stale_streams = set()
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        self._revalidator_task: Optional[asyncio.Task] = None
         
         # ✅ Lista host iframe (caricata da cache o vuota)
         self.iframe_hosts = cache_data.get('hosts', [])
+        # Punteggio per host (latenza media dei successi, fallimenti consecutivi), condiviso tramite lo store
+        self._host_scores: Dict[str, Dict[str, float]] = EXTRACTION_STORE.load_sync(self.STORE_NAMESPACE, 'host_scores') or {}
 
         # ✅ Configurazione server dinamica dal worker (usando TEMPLATE completi)
         # Tutti i valori provengono dal worker, i fallback sono solo per il primo avvio
@@ -71,7 +99,22 @@ class DLHDExtractor:
         logger.info(f"Base Domain: {self.base_domain}")
 
     def _load_cache(self) -> Dict[str, Any]:
-        """Carica la cache da un file codificato in Base64 all'avvio. Ritorna struttura completa."""
+        """Carica configurazione e host dallo store condiviso; al primo avvio migra la vecchia cache su file."""
+        if EXTRACTION_STORE.enabled:
+            config = EXTRACTION_STORE.load_sync(self.STORE_NAMESPACE, 'config')
+            if config is not None:
+                logger.info("💾 DLHD configuration loaded from extraction store")
+                return config
+        data = self._load_legacy_cache()
+        if EXTRACTION_STORE.enabled and (data.get('hosts') or data.get('streams')):
+            logger.info(f"💾 Migrating legacy cache file {self.cache_file} to extraction store")
+            EXTRACTION_STORE.put(self.STORE_NAMESPACE, 'config', {k: v for k, v in data.items() if k != 'streams'})
+            for channel_id, stream in data.get('streams', {}).items():
+                self._persist_stream(channel_id, stream)
+        return data
+
+    def _load_legacy_cache(self) -> Dict[str, Any]:
+        """Carica la cache da un file codificato in Base64 (formato precedente allo store). Ritorna struttura completa."""
         try:
             if os.path.exists(self.cache_file):
                 with open(self.cache_file, 'r', encoding='utf-8') as f:
@@ -105,14 +148,15 @@ class DLHDExtractor:
         return {'hosts': [], 'streams': {}}
 
     def _get_random_proxy(self):
-        """Restituisce un proxy casuale dalla lista."""
-        return random.choice(self.proxies) if self.proxies else None
+        """Restituisce un proxy dalla lista, preferendo quelli veloci e sani (vedi ProxyPool)."""
+        return PROXY_POOL.choose(self.proxies)
 
     async def _get_session(self):
         """✅ Sessione persistente con cookie jar automatico"""
         if self.session is None or self.session.closed:
             timeout = ClientTimeout(total=60, connect=30, sock_read=30)
             proxy = self._get_random_proxy()
+            self.session_proxy = proxy
             if proxy:
                 logger.info(f"🔗 Using proxy {proxy} for DLHD session.")
                 connector = ProxyConnector.from_url(proxy, ssl=False)
@@ -123,7 +167,8 @@ class DLHDExtractor:
                     keepalive_timeout=30,
                     enable_cleanup_closed=True,
                     force_close=False,
-                    use_dns_cache=True
+                    use_dns_cache=False,
+                    resolver=DNS_RESOLVER
                 )
                 logger.info("ℹ️ No specific proxy for DLHD, using direct connection.")
             # ✅ FONDAMENTALE: Cookie jar per mantenere sessione come browser reale
@@ -136,24 +181,25 @@ class DLHDExtractor:
         return self.session
 
     def _save_cache(self):
-        """Salva lo stato corrente della cache su un file, codificando il contenuto in Base64."""
-        try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                cache_data = {
-                    'hosts': self.iframe_hosts,
-                    'streams': self._stream_data_cache,
-                    'auth_url': self.auth_url,
-                    'stream_cdn_template': self.stream_cdn_template,
-                    'stream_other_template': self.stream_other_template,
-                    'server_lookup_url': self.server_lookup_url,
-                    'base_domain': self.base_domain
-                }
-                json_data = json.dumps(cache_data)
-                encoded_data = base64.b64encode(json_data.encode('utf-8')).decode('utf-8')
-                f.write(encoded_data)
-                logger.info(f"💾 Cache (stream + hosts) saved successfully.")
-        except IOError as e:
-            logger.error(f"❌ Error saving cache: {e}")
+        """Salva configurazione server e host nello store condiviso (scrittura in background, non blocca il loop)."""
+        EXTRACTION_STORE.put(self.STORE_NAMESPACE, 'config', {
+            'hosts': self.iframe_hosts,
+            'auth_url': self.auth_url,
+            'stream_cdn_template': self.stream_cdn_template,
+            'stream_other_template': self.stream_other_template,
+            'server_lookup_url': self.server_lookup_url,
+            'base_domain': self.base_domain
+        })
+
+    def _persist_stream(self, channel_id: str, stream: Dict[str, Any]):
+        # La riga scade con il token (expires_at); senza scadenza resta finché non viene invalidata
+        expires_at = stream.get('expires_at') or None
+        EXTRACTION_STORE.put(self.STREAMS_NAMESPACE, channel_id, stream, expires_at=expires_at)
+
+    def _forget_stream(self, channel_id: str):
+        self._stream_data_cache.pop(channel_id, None)
+        self._stale_streams.discard(channel_id)
+        EXTRACTION_STORE.delete(self.STREAMS_NAMESPACE, channel_id)
 
     @staticmethod
     def extract_channel_id(url: str) -> Optional[str]:
@@ -357,7 +403,8 @@ class DLHDExtractor:
                 logger.warning(f"⚠️ Connection error attempt {attempt + 1} for {url}: {str(e)}")
                 
                 # ✅ Solo in caso di errore critico, chiudi la sessione
-                if attempt == retries - 1:
+                # (mai durante la gara degli host: la sessione è condivisa con i tentativi ancora in corso)
+                if attempt == retries - 1 and not _HOST_RACE.get():
                     if self.session and not self.session.closed:
                         try:
                             await self.session.close()
@@ -382,193 +429,271 @@ class DLHDExtractor:
                     raise ExtractorError(f"Final error for {url}: {str(e)}")
         await asyncio.sleep(initial_delay)
 
-    async def extract(self, url: str, force_refresh: bool = False, **kwargs) -> Dict[str, Any]:
-        """Flusso di estrazione principale: estrae direttamente dall'iframe."""
+    def _rank_hosts(self, hosts: list) -> list:
+        """
+        Ordina gli host per il punteggio ricordato: prima quelli riusciti (per latenza media), poi quelli
+        mai provati (ordine del worker), in fondo quelli che falliscono (per fallimenti consecutivi).
+        """
+        def score(item):
+            position, host = item
+            stats = self._host_scores.get(host)
+            if stats is None:
+                return (1, 0, position)
+            if stats['failures']:
+                return (2, stats['failures'], position)
+            return (0, stats['latency'], position)
+        return [host for _, host in sorted(enumerate(hosts), key=score)]
+
+    def _record_host(self, host: str, success: bool, latency: float = 0.0):
+        stats = self._host_scores.setdefault(host, {'latency': latency, 'failures': 0})
+        if success:
+            stats['latency'] = latency if stats['failures'] else stats['latency'] * 0.7 + latency * 0.3
+            stats['failures'] = 0
+        else:
+            stats['failures'] += 1
+
+    def _save_host_scores(self):
+        EXTRACTION_STORE.put(self.STORE_NAMESPACE, 'host_scores', self._host_scores)
+
+    async def _get_stream_data_direct(self, channel_id: str, hosts_to_try: list) -> Dict[str, Any]:
+        """
+        Estrazione diretta dall'iframe senza passare per la pagina principale.
+
+        Gli host sono messi in gara stile happy eyeballs: si parte dal migliore per punteggio e ogni
+        HOST_RACE_STAGGER secondi (o subito, se un tentativo fallisce) parte il successivo, con al massimo
+        HOST_RACE_WIDTH tentativi in parallelo. Vince il primo stream valido, gli altri vengono cancellati.
+        """
+        candidates = self._rank_hosts(hosts_to_try)
+        if not candidates:
+            raise ExtractorError("No iframe hosts available")
+        queue = list(candidates)
+        attempts: Dict[asyncio.Task, tuple] = {}
+        last_error = None
+
+        def launch():
+            host = queue.pop(0)
+            task = asyncio.ensure_future(self._race_iframe_host(channel_id, host, is_primary=host == candidates[0]))
+            attempts[task] = (host, time.monotonic())
+
+        launch()
+        try:
+            while attempts:
+                can_launch = queue and len(attempts) < self.HOST_RACE_WIDTH
+                done, _ = await asyncio.wait(attempts, timeout=self.HOST_RACE_STAGGER if can_launch else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Nessuna risposta entro lo stagger: il prossimo host entra in gara
+                    launch()
+                    continue
+                failed = 0
+                for task in done:
+                    host, started = attempts.pop(task)
+                    if task.exception() is None:
+                        self._record_host(host, True, time.monotonic() - started)
+                        self._save_host_scores()
+                        logger.info(f"🏁 Iframe host {host} won in {(time.monotonic() - started) * 1000:.0f} ms")
+                        return task.result()
+                    last_error = task.exception()
+                    failed += 1
+                    self._record_host(host, False)
+                    logger.warning(f"⚠️ Error with {host}: {last_error}")
+                # Per ogni tentativo fallito il prossimo host parte subito
+                for _ in range(failed):
+                    if queue and len(attempts) < self.HOST_RACE_WIDTH:
+                        launch()
+        finally:
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+
+        self._save_host_scores()
+        raise ExtractorError(f"All iframe hosts failed. Last error: {last_error}")
+
+    async def _race_iframe_host(self, channel_id: str, iframe_host: str, is_primary: bool = False) -> Dict[str, Any]:
+        # Il flag vale solo nel contesto di questo task (ogni task ha la sua copia)
+        _HOST_RACE.set(True)
+        return await self._try_iframe_host(channel_id, iframe_host, is_primary)
+
+    async def _try_iframe_host(self, channel_id: str, iframe_host: str, is_primary: bool = False) -> Dict[str, Any]:
+        """Estrazione diretta da un singolo host iframe; solleva un'eccezione se l'host non fornisce uno stream."""
+        iframe_url = f'https://{iframe_host}/premiumtv/daddyhd.php?id={channel_id}'
+        logger.info(f"🔍 Attempting extraction from: {iframe_url}")
+        
+        embed_headers = {
+            'User-Agent': self.USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Referer': 'https://dlhd.dad/',
+            'sec-ch-ua': '"Chromium";v="136", "Google Chrome";v="136"',
+            'sec-ch-ua-mobile': '?0',
+            'sec-ch-ua-platform': '"macOS"',
+        }
         
-        async def get_stream_data_direct(channel_id: str, hosts_to_try: list) -> Dict[str, Any]:
-            """Estrazione diretta dall'iframe senza passare per la pagina principale."""
-            last_error = None
-            for iframe_host in hosts_to_try:
+        # Step 1: Fetch iframe page
+        resp = await self._make_robust_request(iframe_url, headers=embed_headers, retries=2)
+        js_content = await resp.text()
+        
+        # Check if it's lovecdn
+        if 'lovecdn.ru' in js_content:
+            logger.info("Detected lovecdn.ru content - using alternative extraction")
+            result = await self._extract_lovecdn_stream(iframe_url, js_content)
+            return result
+        
+        # Step 2: Extract auth params
+        params = {}
+        patterns = {
+            'channel_key': r'(?:const|var|let)\s+(?:CHANNEL_KEY|channelKey)\s*=\s*["\']([^"\']+)["\']',
+            'auth_token': r'(?:const|var|let)\s+AUTH_TOKEN\s*=\s*["\']([^"\']+)["\']',
+            'auth_country': r'(?:const|var|let)\s+AUTH_COUNTRY\s*=\s*["\']([^"\']+)["\']',
+            'auth_ts': r'(?:const|var|let)\s+AUTH_TS\s*=\s*["\']([^"\']+)["\']',
+            'auth_expiry': r'(?:const|var|let)\s+AUTH_EXPIRY\s*=\s*["\']([^"\']+)["\']',
+        }
+        for key, pattern in patterns.items():
+            match = re.search(pattern, js_content)
+            params[key] = match.group(1) if match else None
+        
+        missing_params = [k for k, v in params.items() if not v]
+        if missing_params:
+            logger.warning(f"⚠️ Missing parameters from {iframe_host}: {missing_params}. Attempting new heuristic flow...")
+            try:
+                # Se mancano i parametri standard, prova il nuovo flusso euristico/obfuscated
+                result = await self._extract_new_auth_flow(iframe_url, js_content)
+                return result
+            except Exception as e:
+                logger.warning(f"⚠️ Nuovo flusso fallito: {e}")
+                raise ExtractorError(f"Missing params: {missing_params} and New Flow failed")
+        
+        logger.info(f"✅ Parameters extracted: channel_key={params['channel_key']}")
+        
+        # Step 3: Auth POST
+        # ✅ DINAMICO: usa self.auth_url completo
+        auth_url = self.auth_url
+        logger.info(f"🔐 Using auth_url: {auth_url}")
+        iframe_origin = f"https://{iframe_host}"
+        
+        form_data = FormData()
+        form_data.add_field('channelKey', params['channel_key'])
+        form_data.add_field('country', params['auth_country'])
+        form_data.add_field('timestamp', params['auth_ts'])
+        form_data.add_field('expiry', params['auth_expiry'])
+        form_data.add_field('token', params['auth_token'])
+        
+        auth_headers = {
+            'User-Agent': self.USER_AGENT,
+            'Accept': '*/*',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Origin': iframe_origin,
+            'Referer': iframe_url,
+            'Sec-Fetch-Dest': 'empty',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'cross-site',
+            'sec-ch-ua': '"Chromium";v="136", "Google Chrome";v="136"',
+            'sec-ch-ua-mobile': '?0',
+            'sec-ch-ua-platform': '"macOS"',
+        }
+        
+        session = await self._get_session()
+        async with session.post(auth_url, data=form_data, headers=auth_headers, ssl=False) as auth_resp:
+            auth_text = await auth_resp.text()
+            logger.info(f"Auth response: {auth_resp.status} - {auth_text[:100]}")
+            
+            if auth_resp.status != 200 or 'Blocked' in auth_text or 'bad params' in auth_text.lower():
+                logger.warning(f"⚠️ Auth bloccato da {iframe_host}: {auth_text[:50]}")
+                
+                
+                # ✅ NUOVO: Se è il primo host e auth fallisce, prova a refreshare config
+                if is_primary and not getattr(self, '_config_refreshed', False):
+                    logger.info("🔄 Auth fallito, provo ad aggiornare config dal worker...")
+                    self._config_refreshed = True
+                    if await self._fetch_iframe_hosts():
+                        # Aggiorna auth_url per il prossimo tentativo
+                        auth_url = self.auth_url
+                        logger.info(f"✅ Config aggiornata, nuovo auth_url: {auth_url}")
+                
+                # ✅ TENTATIVO NUOVO FLUSSO se Auth fallisce (es. token invalidi)
+                logger.warning("⚠️ Auth fallito con metodo standard. Tento nuovo flusso euristico...")
                 try:
-                    iframe_url = f'https://{iframe_host}/premiumtv/daddyhd.php?id={channel_id}'
-                    logger.info(f"🔍 Attempting extraction from: {iframe_url}")
-                    
-                    embed_headers = {
-                        'User-Agent': self.USER_AGENT,
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Referer': 'https://dlhd.dad/',
-                        'sec-ch-ua': '"Chromium";v="136", "Google Chrome";v="136"',
-                        'sec-ch-ua-mobile': '?0',
-                        'sec-ch-ua-platform': '"macOS"',
-                    }
-                    
-                    # Step 1: Fetch iframe page
-                    resp = await self._make_robust_request(iframe_url, headers=embed_headers, retries=2)
-                    js_content = await resp.text()
-                    
-                    # Check if it's lovecdn
-                    if 'lovecdn.ru' in js_content:
-                        logger.info("Detected lovecdn.ru content - using alternative extraction")
-                        result = await self._extract_lovecdn_stream(iframe_url, js_content)
-                        return result
-                    
-                    # Step 2: Extract auth params
-                    params = {}
-                    patterns = {
-                        'channel_key': r'(?:const|var|let)\s+(?:CHANNEL_KEY|channelKey)\s*=\s*["\']([^"\']+)["\']',
-                        'auth_token': r'(?:const|var|let)\s+AUTH_TOKEN\s*=\s*["\']([^"\']+)["\']',
-                        'auth_country': r'(?:const|var|let)\s+AUTH_COUNTRY\s*=\s*["\']([^"\']+)["\']',
-                        'auth_ts': r'(?:const|var|let)\s+AUTH_TS\s*=\s*["\']([^"\']+)["\']',
-                        'auth_expiry': r'(?:const|var|let)\s+AUTH_EXPIRY\s*=\s*["\']([^"\']+)["\']',
-                    }
-                    for key, pattern in patterns.items():
-                        match = re.search(pattern, js_content)
-                        params[key] = match.group(1) if match else None
-                    
-                    missing_params = [k for k, v in params.items() if not v]
-                    if missing_params:
-                        logger.warning(f"⚠️ Missing parameters from {iframe_host}: {missing_params}. Attempting new heuristic flow...")
-                        try:
-                            # Se mancano i parametri standard, prova il nuovo flusso euristico/obfuscated
-                            result = await self._extract_new_auth_flow(iframe_url, js_content)
-                            return result
-                        except Exception as e:
-                            logger.warning(f"⚠️ Nuovo flusso fallito: {e}")
-                            last_error = ExtractorError(f"Missing params: {missing_params} and New Flow failed")
-                            continue
-                    
-                    logger.info(f"✅ Parameters extracted: channel_key={params['channel_key']}")
-                    
-                    # Step 3: Auth POST
-                    # ✅ DINAMICO: usa self.auth_url completo
-                    auth_url = self.auth_url
-                    logger.info(f"🔐 Using auth_url: {auth_url}")
-                    iframe_origin = f"https://{iframe_host}"
-                    
-                    form_data = FormData()
-                    form_data.add_field('channelKey', params['channel_key'])
-                    form_data.add_field('country', params['auth_country'])
-                    form_data.add_field('timestamp', params['auth_ts'])
-                    form_data.add_field('expiry', params['auth_expiry'])
-                    form_data.add_field('token', params['auth_token'])
-                    
-                    auth_headers = {
-                        'User-Agent': self.USER_AGENT,
-                        'Accept': '*/*',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'Origin': iframe_origin,
-                        'Referer': iframe_url,
-                        'Sec-Fetch-Dest': 'empty',
-                        'Sec-Fetch-Mode': 'cors',
-                        'Sec-Fetch-Site': 'cross-site',
-                        'sec-ch-ua': '"Chromium";v="136", "Google Chrome";v="136"',
-                        'sec-ch-ua-mobile': '?0',
-                        'sec-ch-ua-platform': '"macOS"',
-                    }
-                    
-                    session = await self._get_session()
-                    async with session.post(auth_url, data=form_data, headers=auth_headers, ssl=False) as auth_resp:
-                        auth_text = await auth_resp.text()
-                        logger.info(f"Auth response: {auth_resp.status} - {auth_text[:100]}")
-                        
-                        if auth_resp.status != 200 or 'Blocked' in auth_text or 'bad params' in auth_text.lower():
-                            logger.warning(f"⚠️ Auth bloccato da {iframe_host}: {auth_text[:50]}")
-                            
-                            
-                            # ✅ NUOVO: Se è il primo host e auth fallisce, prova a refreshare config
-                            if iframe_host == hosts_to_try[0] and not getattr(self, '_config_refreshed', False):
-                                logger.info("🔄 Auth fallito, provo ad aggiornare config dal worker...")
-                                self._config_refreshed = True
-                                if await self._fetch_iframe_hosts():
-                                    # Aggiorna auth_url per il prossimo tentativo
-                                    auth_url = self.auth_url
-                                    logger.info(f"✅ Config aggiornata, nuovo auth_url: {auth_url}")
-                            
-                            # ✅ TENTATIVO NUOVO FLUSSO se Auth fallisce (es. token invalidi)
-                            logger.warning("⚠️ Auth fallito con metodo standard. Tento nuovo flusso euristico...")
-                            try:
-                                result = await self._extract_new_auth_flow(iframe_url, js_content)
-                                return result
-                            except Exception as e:
-                                logger.warning(f"⚠️ Nuovo flusso (fallback) fallito: {e}")
-                                last_error = ExtractorError(f"Auth blocked: {auth_text} AND New Flow failed: {e}")
-                                continue
-                        
-                        try:
-                            auth_data = json.loads(auth_text)
-                            if not (auth_data.get('success') or auth_data.get('valid')):
-                                logger.warning(f"⚠️ Auth fallito: {auth_data}")
-                                last_error = ExtractorError(f"Auth failed: {auth_data}")
-                                continue
-                        except json.JSONDecodeError:
-                            last_error = ExtractorError(f"Auth response not JSON: {auth_text}")
-                            continue
-                    
-                    logger.info("✅ Auth successful!")
-                    
-                    # ✅ DEBUG: Log cookies e headers dalla risposta auth
-                    auth_cookies = auth_resp.cookies
-                    logger.info(f"🍪 Cookies dalla risposta auth: {dict(auth_cookies)}")
-                    logger.info(f"📋 Headers dalla risposta auth: {dict(auth_resp.headers)}")
-                    
-                    # Log tutti i cookies nella session dopo auth
-                    all_session_cookies = list(session.cookie_jar)
-                    logger.info(f"🍪 Tutti i cookies nella sessione dopo auth: {all_session_cookies}")
-                    
-                    # Step 4: Server Lookup
-                    server_key = await self._fetch_server_key(params['channel_key'], iframe_url)
-                    logger.info(f"✅ Server key: {server_key}")
-
-                    channel_key = params['channel_key']
-                    auth_token = params['auth_token']
-
-                    # Build final URL using helper method
-                    stream_url = self._build_stream_url(server_key, channel_key)
-                    logger.info(f"✅ Stream URL costruito: {stream_url}")
-
-                    # Build headers using helper method
-                    stream_headers = self._build_stream_headers(iframe_url, channel_key, auth_token)
-                    stream_headers['X-User-Agent'] = self.USER_AGENT  # Add for compatibility
-
-                    # ✅ Aggiungi cookies dalla sessione corrente
-                    if self.session:
-                        # Log all cookies for debugging
-                        all_cookies = list(self.session.cookie_jar)
-                        logger.info(f"🍪 All cookies in jar: {all_cookies}")
-                        
-                        cookies = self.session.cookie_jar.filter_cookies(stream_url)
-                        cookie_str = "; ".join([f"{k}={v.value}" for k, v in cookies.items()])
-                        if cookie_str:
-                            stream_headers['Cookie'] = cookie_str
-                            logger.info(f"🍪 Cookies added to headers: {cookie_str[:50]}...")
-
-                    expires_at = None
-                    try:
-                        if params.get('auth_expiry'):
-                            expires_at = float(params['auth_expiry'])
-                            logger.info(f"⏳ Auth Expiry: {expires_at} (Current time: {time.time()})")
-                    except (ValueError, TypeError):
-                        pass
-                    
-                    # ✅ Reset flag per permettere futuri refresh
-                    self._config_refreshed = False
-                    
-                    return {
-                        "destination_url": stream_url,
-                        "request_headers": stream_headers,
-                        "mediaflow_endpoint": self.mediaflow_endpoint,
-                        "expires_at": expires_at
-                    }
-                    
+                    result = await self._extract_new_auth_flow(iframe_url, js_content)
+                    return result
                 except Exception as e:
-                    logger.warning(f"⚠️ Error with {iframe_host}: {e}")
-                    last_error = e
-                    continue
+                    logger.warning(f"⚠️ Nuovo flusso (fallback) fallito: {e}")
+                    raise ExtractorError(f"Auth blocked: {auth_text} AND New Flow failed: {e}")
+            
+            try:
+                auth_data = json.loads(auth_text)
+                if not (auth_data.get('success') or auth_data.get('valid')):
+                    logger.warning(f"⚠️ Auth fallito: {auth_data}")
+                    raise ExtractorError(f"Auth failed: {auth_data}")
+            except json.JSONDecodeError:
+                raise ExtractorError(f"Auth response not JSON: {auth_text}")
+        
+        logger.info("✅ Auth successful!")
+        
+        # ✅ DEBUG: Log cookies e headers dalla risposta auth
+        auth_cookies = auth_resp.cookies
+        logger.info(f"🍪 Cookies dalla risposta auth: {dict(auth_cookies)}")
+        logger.info(f"📋 Headers dalla risposta auth: {dict(auth_resp.headers)}")
+        
+        # Log tutti i cookies nella session dopo auth
+        all_session_cookies = list(session.cookie_jar)
+        logger.info(f"🍪 Tutti i cookies nella sessione dopo auth: {all_session_cookies}")
+        
+        # Step 4: Server Lookup
+        server_key = await self._fetch_server_key(params['channel_key'], iframe_url)
+        logger.info(f"✅ Server key: {server_key}")
+
+        channel_key = params['channel_key']
+        auth_token = params['auth_token']
+
+        # Build final URL using helper method
+        stream_url = self._build_stream_url(server_key, channel_key)
+        logger.info(f"✅ Stream URL costruito: {stream_url}")
+
+        # Build headers using helper method
+        stream_headers = self._build_stream_headers(iframe_url, channel_key, auth_token)
+        stream_headers['X-User-Agent'] = self.USER_AGENT  # Add for compatibility
+
+        # ✅ Aggiungi cookies dalla sessione corrente
+        if self.session:
+            # Log all cookies for debugging
+            all_cookies = list(self.session.cookie_jar)
+            logger.info(f"🍪 All cookies in jar: {all_cookies}")
             
-            raise ExtractorError(f"All iframe hosts failed. Last error: {last_error}")
+            cookies = self.session.cookie_jar.filter_cookies(stream_url)
+            cookie_str = "; ".join([f"{k}={v.value}" for k, v in cookies.items()])
+            if cookie_str:
+                stream_headers['Cookie'] = cookie_str
+                logger.info(f"🍪 Cookies added to headers: {cookie_str[:50]}...")
+
+        expires_at = None
+        try:
+            if params.get('auth_expiry'):
+                expires_at = float(params['auth_expiry'])
+                logger.info(f"⏳ Auth Expiry: {expires_at} (Current time: {time.time()})")
+        except (ValueError, TypeError):
+            pass
+        
+        # ✅ Reset flag per permettere futuri refresh
+        self._config_refreshed = False
+        
+        return {
+            "destination_url": stream_url,
+            "request_headers": stream_headers,
+            "mediaflow_endpoint": self.mediaflow_endpoint,
+            "expires_at": expires_at
+        }
 
+
+    @staticmethod
+    def _is_expired(stream: Dict[str, Any], margin: float = 30) -> bool:
+        expires_at = stream.get("expires_at")
+        return bool(expires_at) and time.time() > expires_at - margin
+
+    async def extract(self, url: str, force_refresh: bool = False, **kwargs) -> Dict[str, Any]:
+        """Flusso di estrazione principale: estrae direttamente dall'iframe."""
+        
         try:
             channel_id = self.extract_channel_id(url)
             if not channel_id:
@@ -576,78 +701,34 @@ class DLHDExtractor:
 
             logger.info(f"📺 Extraction for channel ID: {channel_id}")
 
-            # Controlla la cache prima di procedere
+            # Miss in memoria: un altro worker (o il processo precedente) può averlo già estratto
+            if not force_refresh and channel_id not in self._stream_data_cache:
+                persisted = await EXTRACTION_STORE.get(self.STREAMS_NAMESPACE, channel_id)
+                if persisted:
+                    self._stream_data_cache[channel_id] = persisted
+
+            # Controlla la cache prima di procedere: la validità è verificata in background
+            # (_revalidate_loop), qui si scarta solo un token già scaduto
             if not force_refresh and channel_id in self._stream_data_cache:
-                logger.info(f"✅ Found cached data for channel ID: {channel_id}. Verifying validity...")
                 cached_data = self._stream_data_cache[channel_id]
-                stream_url = cached_data.get("destination_url")
-                stream_headers = cached_data.get("request_headers", {})
-                expires_at = cached_data.get("expires_at")
-
-                is_valid = False
-                
-                # ✅ Check expiry first (con buffer di 30 secondi)
-                if expires_at and time.time() > (expires_at - 30):
-                     logger.warning(f"⚠️ Cache expired for channel ID {channel_id} (expires_at: {expires_at}).")
-                     is_valid = False
-                elif stream_url:
-                    try:
-                        async with aiohttp.ClientSession(timeout=ClientTimeout(total=10)) as validation_session:
-                            async with validation_session.head(stream_url, headers=stream_headers, ssl=False) as response:
-                                if response.status == 200:
-                                    is_valid = True
-                                    logger.info(f"✅ Cache for channel ID {channel_id} is valid.")
-                                else:
-                                    logger.warning(f"⚠️ Cache for channel ID {channel_id} not valid. Status: {response.status}. Proceeding with extraction.")
-                    except Exception as e:
-                        logger.warning(f"⚠️ Error during cache validation for {channel_id}: {e}. Proceeding with extraction.")
-                
-                if not is_valid:
-                    if channel_id in self._stream_data_cache:
-                        del self._stream_data_cache[channel_id]
-                    self._save_cache()
-                    logger.info(f"🗑️ Cache invalidated for channel ID {channel_id}.")
+                if self._is_expired(cached_data):
+                    logger.warning(f"⚠️ Cache expired for channel ID {channel_id} (expires_at: {cached_data.get('expires_at')}).")
+                    self._forget_stream(channel_id)
                 else:
-                    return cached_data
-
-            # Usa un lock per prevenire estrazioni simultanee per lo stesso canale
-            if channel_id not in self._extraction_locks:
-                self._extraction_locks[channel_id] = asyncio.Lock()
-            
-            lock = self._extraction_locks[channel_id]
-            async with lock:
-                # Ricontrolla la cache dopo aver acquisito il lock
-                if not force_refresh and channel_id in self._stream_data_cache:
-                    cached_data = self._stream_data_cache[channel_id]
-                    expires_at = cached_data.get("expires_at")
-                    
-                    # Se è scaduta anche la nuova cache (improbabile ma possibile), procedi con estrazione
-                    if expires_at and time.time() > (expires_at - 30):
-                        logger.info(f"⚠️ Cache (rechecked) expired for {channel_id}, proceeding with new extraction.")
+                    self._last_access[channel_id] = time.monotonic()
+                    self._ensure_revalidator()
+                    if channel_id in self._stale_streams:
+                        # Validazione fallita: si serve la copia attuale mentre parte (o prosegue) il refresh
+                        logger.info(f"♻️ Serving stale cache for channel ID {channel_id} while refreshing.")
+                        self._schedule_refresh(channel_id)
                     else:
-                        logger.info(f"✅ Data for channel {channel_id} found in cache after waiting for lock.")
-                        return self._stream_data_cache[channel_id]
+                        logger.info(f"✅ Found cached data for channel ID: {channel_id}.")
+                    return cached_data
 
-                # Procedi con l'estrazione diretta
-                # Procedi con l'estrazione diretta
-                logger.info(f"⚙️ No valid cache for {channel_id}, starting direct extraction...")
-                
-                try:
-                    result = await get_stream_data_direct(channel_id, self.iframe_hosts)
-                except ExtractorError:
-                    # Se fallisce con gli host correnti, prova ad aggiornarli
-                    logger.warning("⚠️ All current hosts failed. Attempting to update host list...")
-                    if await self._fetch_iframe_hosts():
-                         logger.info(f"🔄 Retrying with new hosts: {self.iframe_hosts}")
-                         result = await get_stream_data_direct(channel_id, self.iframe_hosts)
-                    else:
-                        raise
-                
-                # Salva in cache
-                self._stream_data_cache[channel_id] = result
-                self._save_cache()
-                
-                return result
+            result = await self._extract_channel(channel_id, force_refresh)
+            self._last_access[channel_id] = time.monotonic()
+            self._ensure_revalidator()
+            return result
             
         except Exception as e:
             # Per errori 403, non loggare il traceback perché sono errori attesi (servizio temporaneamente non disponibile)
@@ -658,6 +739,103 @@ class DLHDExtractor:
                 logger.exception(f"DLHD extraction completely failed for URL {url}")
             raise ExtractorError(f"DLHD extraction completely failed: {str(e)}")
 
+    async def _extract_channel(self, channel_id: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """Estrazione con lock per canale (estrazioni simultanee dello stesso canale ne fanno una sola)."""
+        if channel_id not in self._extraction_locks:
+            self._extraction_locks[channel_id] = asyncio.Lock()
+        
+        lock = self._extraction_locks[channel_id]
+        async with lock:
+            # Ricontrolla la cache dopo aver acquisito il lock
+            if not force_refresh and channel_id in self._stream_data_cache and channel_id not in self._stale_streams:
+                cached_data = self._stream_data_cache[channel_id]
+                
+                # Se è scaduta anche la nuova cache (improbabile ma possibile), procedi con estrazione
+                if self._is_expired(cached_data):
+                    logger.info(f"⚠️ Cache (rechecked) expired for {channel_id}, proceeding with new extraction.")
+                else:
+                    logger.info(f"✅ Data for channel {channel_id} found in cache after waiting for lock.")
+                    return cached_data
+
+            # Procedi con l'estrazione diretta
+            logger.info(f"⚙️ No valid cache for {channel_id}, starting direct extraction...")
+            
+            try:
+                result = await self._get_stream_data_direct(channel_id, self.iframe_hosts)
+            except ExtractorError:
+                # Se fallisce con gli host correnti, prova ad aggiornarli
+                logger.warning("⚠️ All current hosts failed. Attempting to update host list...")
+                if await self._fetch_iframe_hosts():
+                     logger.info(f"🔄 Retrying with new hosts: {self.iframe_hosts}")
+                     result = await self._get_stream_data_direct(channel_id, self.iframe_hosts)
+                else:
+                    raise
+            
+            # Salva in cache
+            self._stream_data_cache[channel_id] = result
+            self._stale_streams.discard(channel_id)
+            self._persist_stream(channel_id, result)
+            
+            return result
+
+    def _ensure_revalidator(self):
+        if self._revalidator_task is None or self._revalidator_task.done():
+            self._revalidator_task = asyncio.ensure_future(self._revalidate_loop())
+
+    def _schedule_refresh(self, channel_id: str):
+        """Refresh-ahead: ri-estrae il canale in background (uno per canale alla volta)."""
+        if channel_id in self._refresh_tasks:
+            return
+        task = asyncio.ensure_future(self._refresh_channel(channel_id))
+        self._refresh_tasks[channel_id] = task
+        task.add_done_callback(lambda t, c=channel_id: self._refresh_tasks.pop(c, None))
+
+    async def _refresh_channel(self, channel_id: str):
+        try:
+            await self._extract_channel(channel_id, force_refresh=True)
+            logger.info(f"🔄 Channel ID {channel_id} refreshed in background.")
+        except Exception as e:
+            logger.warning(f"⚠️ Background refresh failed for channel ID {channel_id}: {e}")
+
+    async def _revalidate_loop(self):
+        """
+        Verifica periodica (HEAD sulla sessione condivisa) dei canali in cache usati di recente.
+        Una verifica fallita marca la voce come stale e avvia il refresh; la richiesta successiva
+        riceve comunque subito la copia in cache. Il task termina quando nessun canale è più in uso.
+        """
+        while self._last_access:
+            await asyncio.sleep(self.REVALIDATE_INTERVAL)
+            now = time.monotonic()
+            for channel_id in [c for c, seen in self._last_access.items() if now - seen > self.REVALIDATE_IDLE]:
+                del self._last_access[channel_id]
+            due = [c for c in self._last_access
+                   if c in self._stream_data_cache and c not in self._stale_streams and c not in self._refresh_tasks]
+            semaphore = asyncio.Semaphore(self.REVALIDATE_CONCURRENCY)
+            await asyncio.gather(*(self._revalidate(channel_id, semaphore) for channel_id in due))
+
+    async def _revalidate(self, channel_id: str, semaphore: asyncio.Semaphore):
+        cached_data = self._stream_data_cache.get(channel_id)
+        if not cached_data or not cached_data.get("destination_url"):
+            return
+        # Token vicino alla scadenza: refresh prima che le richieste lo trovino scaduto
+        if self._is_expired(cached_data, margin=self.REVALIDATE_INTERVAL + 30):
+            self._schedule_refresh(channel_id)
+            return
+        async with semaphore:
+            try:
+                session = await self._get_session()
+                async with session.head(cached_data["destination_url"], headers=cached_data.get("request_headers", {}),
+                                        ssl=False, timeout=ClientTimeout(total=10)) as response:
+                    if response.status == 200:
+                        return
+                    reason = f"status {response.status}"
+            except Exception as e:
+                reason = str(e) or type(e).__name__
+        if self._stream_data_cache.get(channel_id) is cached_data:
+            logger.warning(f"⚠️ Cache for channel ID {channel_id} not valid ({reason}), refreshing in background.")
+            self._stale_streams.add(channel_id)
+            self._schedule_refresh(channel_id)
+
     async def _extract_lovecdn_stream(self, iframe_url: str, iframe_content: str) -> Dict[str, Any]:
         """
         Estrattore alternativo per iframe lovecdn.ru che usa un formato diverso.
@@ -968,13 +1146,19 @@ class DLHDExtractor:
         Questa funzione viene chiamata da app.py quando rileva un errore (es. fallimento chiave AES).
         """
         channel_id = self.extract_channel_id(url)
-        if channel_id and channel_id in self._stream_data_cache:
-            del self._stream_data_cache[channel_id]
-            self._save_cache()
+        if channel_id:
+            self._forget_stream(channel_id)
             logger.info(f"🗑️ Cache for channel ID {channel_id} invalidated due to external error (e.g. AES key).")
 
     async def close(self):
         """Chiude definitivamente la sessione"""
+        background = list(self._refresh_tasks.values())
+        if self._revalidator_task is not None:
+            background.append(self._revalidator_task)
+            self._revalidator_task = None
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
         if self.session and not self.session.closed:
             try:
                 await self.session.close()
@@ -1,9 +1,10 @@
 import logging
-import random
 import re
 import time
 from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp_socks import ProxyConnector
+from services.proxy_pool import PROXY_POOL
+from services.dns_cache import DNS_RESOLVER
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +25,7 @@ class DoodStreamExtractor:
         self.base_url = "https://d000d.com"
 
     def _get_random_proxy(self):
-        return random.choice(self.proxies) if self.proxies else None
+        return PROXY_POOL.choose(self.proxies)
 
     async def _get_session(self):
         if self.session is None or self.session.closed:
@@ -33,7 +34,7 @@ class DoodStreamExtractor:
             if proxy:
                 connector = ProxyConnector.from_url(proxy)
             else:
-                connector = TCPConnector(limit=0, limit_per_host=0, keepalive_timeout=60, enable_cleanup_closed=True, force_close=False, use_dns_cache=True)
+                connector = TCPConnector(limit=0, limit_per_host=0, keepalive_timeout=60, enable_cleanup_closed=True, force_close=False, use_dns_cache=False, resolver=DNS_RESOLVER)
             self.session = ClientSession(timeout=timeout, connector=connector, headers={'User-Agent': self.base_headers["user-agent"]})
         return self.session
 
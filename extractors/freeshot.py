@@ -1,9 +1,11 @@
 import logging
 import re
 import asyncio
+import time
 import urllib.parse
 from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp_socks import ProxyConnector
+from services.dns_cache import DNS_RESOLVER
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +19,8 @@ class FreeshotExtractor:
     """
     MAX_RETRIES = 3
     RETRY_DELAYS = [1, 2, 4]  # Exponential backoff in seconds
+    # I token di planetary.lovecdn.ru scadono in ~20-30 secondi: expires_at permette il rinnovo in anticipo
+    TOKEN_LIFETIME = 25
     
     def __init__(self, request_headers, proxies=None):
         self.request_headers = request_headers
@@ -30,7 +34,7 @@ class FreeshotExtractor:
 
     async def _get_session(self):
         if self.session is None or self.session.closed:
-            connector = TCPConnector(ssl=False)
+            connector = TCPConnector(ssl=False, use_dns_cache=False, resolver=DNS_RESOLVER)
             # Se volessimo usare proxy per la richiesta iniziale (ma qui l'idea è usare l'IP del server MFP)
             # if self.proxies:
             #     proxy = self.proxies[0] # Simple logic
@@ -120,6 +124,7 @@ class FreeshotExtractor:
             token = match.group(1)
         
         # Nuovo formato URL m3u8: tracks-v1a1/mono.m3u8
+        issued_at = time.time()
         m3u8_url = f"https://planetary.lovecdn.ru/{channel_code}/tracks-v1a1/mono.m3u8?token={token}"
         
         logger.info(f"FreeshotExtractor: Risolto -> {m3u8_url}")
@@ -132,7 +137,8 @@ class FreeshotExtractor:
                 "Referer": "https://popcdn.day/",
                 "Origin": "https://popcdn.day"
             },
-            "mediaflow_endpoint": "hls_proxy"
+            "mediaflow_endpoint": "hls_proxy",
+            "expires_at": issued_at + self.TOKEN_LIFETIME
         }
 
     async def close(self):
@@ -1,10 +1,11 @@
-import random
 import logging
 import ssl
 import urllib.parse
 from urllib.parse import urlparse
 from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp_socks import ProxyConnector
+from services.proxy_pool import PROXY_POOL
+from services.dns_cache import DNS_RESOLVER
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +23,8 @@ class GenericHLSExtractor:
         self.proxies = proxies or []
 
     def _get_random_proxy(self):
-        """Restituisce un proxy casuale dalla lista."""
-        return random.choice(self.proxies) if self.proxies else None
+        """Restituisce un proxy dalla lista, preferendo quelli veloci e sani (vedi ProxyPool)."""
+        return PROXY_POOL.choose(self.proxies)
 
     async def _get_session(self):
         if self.session is None or self.session.closed:
@@ -40,7 +41,7 @@ class GenericHLSExtractor:
                 connector = TCPConnector(
                     limit=0, limit_per_host=0, 
                     keepalive_timeout=60, enable_cleanup_closed=True, 
-                    force_close=False, use_dns_cache=True,
+                    force_close=False, use_dns_cache=False, resolver=DNS_RESOLVER,
                     ssl=ssl_context
                 )
 
@@ -0,0 +1,243 @@
+import importlib
+import importlib.util
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_MEDIA_EXTENSIONS = (".mp4", ".m3u8", ".ts", ".mkv", ".avi", ".mpd")
+
+
+@dataclass
+class ExtractorSpec:
+    """Descrizione dichiarativa di un estrattore: come si seleziona e come si costruisce."""
+    name: str
+    module: str
+    class_name: str
+    # Valori accettati dal parametro ?host= (selezione manuale)
+    aliases: Tuple[str, ...] = ()
+    # Domini registrabili: corrisponde l'host stesso o qualsiasi suo sottodominio
+    domains: Tuple[str, ...] = ()
+    # Sottostringhe cercate nell'hostname (domini con molti TLD/mirror)
+    host_keywords: Tuple[str, ...] = ()
+    # Regex cercate sull'URL completo, indipendentemente dall'host
+    url_patterns: Tuple[str, ...] = ()
+    # Condizione aggiuntiva sull'URL completo, valutata dopo il match dell'host
+    predicate: Optional[Callable[[str], bool]] = None
+    # Dominio usato per scegliere il proxy da TRANSPORT_ROUTES (stringa o funzione dell'URL)
+    proxy_domain: Union[str, Callable[[str], str], None] = None
+    # TTL dei risultati nella cache delle estrazioni (None = EXTRACTION_CACHE_TTL, 0 = mai in cache)
+    cache_ttl: Optional[float] = None
+    _cls: Optional[type] = field(default=None, repr=False)
+    _load_error: Optional[Exception] = field(default=None, repr=False)
+
+    def proxy_domain_for(self, url: str) -> str:
+        if callable(self.proxy_domain):
+            return self.proxy_domain(url)
+        return self.proxy_domain or self.name
+
+    def load(self) -> type:
+        """
+        Importa (una sola volta, al primo URL che ci viene instradato) e restituisce la classe
+        dell'estrattore. Solleva ImportError/AttributeError se il modulo non è disponibile.
+        """
+        if self._cls is None:
+            if self._load_error is not None:
+                raise self._load_error
+            try:
+                module = importlib.import_module(self.module)
+                self._cls = getattr(module, self.class_name)
+                logger.info(f"✅ {self.class_name} module loaded.")
+            except (ImportError, AttributeError) as e:
+                self._load_error = e
+                logger.warning(f"⚠️ {self.class_name} module not found: {e}")
+                raise
+        return self._cls
+
+    def is_available(self) -> bool:
+        """Disponibilità del modulo senza importarlo (se già importato, riflette l'esito reale)."""
+        if self._cls is not None:
+            return True
+        if self._load_error is not None:
+            return False
+        try:
+            return importlib.util.find_spec(self.module) is not None
+        except (ImportError, ValueError):
+            return False
+
+
+# Ordine = priorità: se più estrattori corrispondono allo stesso URL vince il primo della lista
+EXTRACTOR_SPECS: List[ExtractorSpec] = [
+    ExtractorSpec("vavoo", "extractors.vavoo", "VavooExtractor",
+                  aliases=("vavoo",), domains=("vavoo.to",), proxy_domain="vavoo.to"),
+    ExtractorSpec("dlhd", "extractors.dlhd", "DLHDExtractor",
+                  aliases=("dlhd", "daddylive", "daddyhd"),
+                  domains=("dlstreams.top",), host_keywords=("daddylive", "dlhd", "daddyhd"),
+                  url_patterns=(r'watch\.php\?id=\d+',),
+                  proxy_domain=lambda url: 'dlstreams.top' if 'dlstreams.top' in url else 'dlhd.dad'),
+    ExtractorSpec("vixsrc", "extractors.vixsrc", "VixSrcExtractor",
+                  aliases=("vixsrc",), domains=("vixsrc.to",),
+                  predicate=lambda url: any(x in url for x in ('/movie/', '/tv/', '/iframe/')),
+                  proxy_domain="vixsrc.to"),
+    ExtractorSpec("sportsonline", "extractors.sportsonline", "SportsonlineExtractor",
+                  aliases=("sportsonline", "sportzonline", "sprtsonline", "sportsnline"),
+                  host_keywords=("sportzonline", "sportsonline", "sprtsonline", "sportsnline"),
+                  cache_ttl=120),
+    ExtractorSpec("mixdrop", "extractors.mixdrop", "MixdropExtractor",
+                  aliases=("mixdrop",), host_keywords=("mixdrop",)),
+    ExtractorSpec("voe", "extractors.voe", "VoeExtractor",
+                  aliases=("voe",), domains=("voe.sx", "voe.to", "voe.st", "voe.eu", "voe.la", "voe-network.net"),
+                  proxy_domain="voe.sx"),
+    ExtractorSpec("freeshot", "extractors.freeshot", "FreeshotExtractor",
+                  aliases=("freeshot",), domains=("popcdn.day",), proxy_domain="popcdn.day", cache_ttl=120),
+    ExtractorSpec("streamtape", "extractors.streamtape", "StreamtapeExtractor",
+                  aliases=("streamtape",), domains=("streamtape.com", "streamtape.to", "streamtape.net")),
+    ExtractorSpec("orion", "extractors.orion", "OrionExtractor",
+                  aliases=("orion",), domains=("orionoid.com",), proxy_domain="orionoid.com"),
+    ExtractorSpec("doodstream", "extractors.doodstream", "DoodStreamExtractor",
+                  aliases=("doodstream", "dood", "d000d"),
+                  domains=("d000d.com", "dood.wf", "dood.cx", "dood.la", "dood.so", "dood.pm"),
+                  host_keywords=("doodstream",)),
+    ExtractorSpec("fastream", "extractors.fastream", "FastreamExtractor",
+                  aliases=("fastream",), host_keywords=("fastream",)),
+    ExtractorSpec("filelions", "extractors.filelions", "FileLionsExtractor",
+                  aliases=("filelions",), host_keywords=("filelions",)),
+    ExtractorSpec("filemoon", "extractors.filemoon", "FileMoonExtractor",
+                  aliases=("filemoon",), host_keywords=("filemoon",)),
+    ExtractorSpec("lulustream", "extractors.lulustream", "LuluStreamExtractor",
+                  aliases=("lulustream",), host_keywords=("lulustream",)),
+    ExtractorSpec("maxstream", "extractors.maxstream", "MaxstreamExtractor",
+                  aliases=("maxstream",), domains=("uprot.net",), host_keywords=("maxstream",)),
+    ExtractorSpec("okru", "extractors.okru", "OkruExtractor",
+                  aliases=("okru", "ok.ru"), domains=("ok.ru",), host_keywords=("odnoklassniki",),
+                  proxy_domain="ok.ru"),
+    ExtractorSpec("streamwish", "extractors.streamwish", "StreamWishExtractor",
+                  aliases=("streamwish",),
+                  host_keywords=("streamwish", "swish", "wishfast", "embedwish", "wishembed")),
+    ExtractorSpec("supervideo", "extractors.supervideo", "SupervideoExtractor",
+                  aliases=("supervideo",), host_keywords=("supervideo",)),
+    # Solo le pagine embed (es. uqload.is/abc123.html), non gli URL video del CDN (m80.uqload.is/.../v.mp4)
+    ExtractorSpec("uqload", "extractors.uqload", "UqloadExtractor",
+                  aliases=("uqload",), host_keywords=("uqload",),
+                  predicate=lambda url: not any(url.endswith(ext) or f"{ext}?" in url for ext in _MEDIA_EXTENSIONS)),
+    ExtractorSpec("vidmoly", "extractors.vidmoly", "VidmolyExtractor",
+                  aliases=("vidmoly",), host_keywords=("vidmoly",)),
+    ExtractorSpec("vidoza", "extractors.vidoza", "VidozaExtractor",
+                  aliases=("vidoza", "videzz"), host_keywords=("vidoza", "videzz")),
+    ExtractorSpec("turbovidplay", "extractors.turbovidplay", "TurboVidPlayExtractor",
+                  aliases=("turbovidplay", "turboviplay", "emturbovid"),
+                  host_keywords=("turboviplay", "emturbovid", "tuborstb", "javggvideo", "stbturbo", "turbovidhls")),
+    # LiveTV si seleziona solo manualmente (?host=livetv)
+    ExtractorSpec("livetv", "extractors.livetv", "LiveTVExtractor", aliases=("livetv",), cache_ttl=120),
+    ExtractorSpec("f16px", "extractors.f16px", "F16PxExtractor",
+                  aliases=("f16px",), host_keywords=("f16px", "embedme", "embedsb", "playersb"),
+                  predicate=lambda url: "/e/" in url),
+]
+
+
+# Authority di un URL (con o senza schema): più veloce di urlparse nel percorso caldo
+# Lo schema conta solo se seguito da '//': "host:443/x" ha host "host", non schema "host:"
+_AUTHORITY_RE = re.compile(r'^(?:(?:[A-Za-z][A-Za-z0-9+.-]*:)?//)?([^/?#]*)')
+
+
+def _hostname(url: str) -> str:
+    authority = _AUTHORITY_RE.match(url).group(1)
+    if '@' in authority:
+        authority = authority.rpartition('@')[2]
+    if authority.startswith('['):
+        return authority[1:authority.find(']')].lower()
+    return authority.partition(':')[0].lower()
+
+
+class ExtractorRegistry:
+    """
+    Dispatch URL -> estrattore a partire da EXTRACTOR_SPECS.
+
+    - Alias ?host=: dict
+    - Domini: dict suffisso -> spec, controllato per ogni suffisso dell'hostname (O(numero di label))
+    - Keyword nell'host e pattern sull'URL: una sola regex combinata ciascuno
+    - Risultato per hostname memorizzato in un LRU: per gli URL successivi dello stesso host
+      restano solo i predicate sull'URL
+    """
+
+    def __init__(self, specs: List[ExtractorSpec], memo_size: int = 4096):
+        self.specs = specs
+        self.memo_size = memo_size
+        self._priority = {spec.name: i for i, spec in enumerate(specs)}
+        self._by_alias: Dict[str, ExtractorSpec] = {}
+        self._by_domain: Dict[str, ExtractorSpec] = {}
+        for spec in specs:
+            for alias in spec.aliases:
+                self._by_alias.setdefault(alias, spec)
+            for domain in spec.domains:
+                self._by_domain.setdefault(domain, spec)
+
+        self._keyword_re = self._combine(
+            {i: [re.escape(k) for k in spec.host_keywords] for i, spec in enumerate(specs)})
+        self._url_re = self._combine({i: list(spec.url_patterns) for i, spec in enumerate(specs)})
+        self._url_pattern_specs = [spec for spec in specs if spec.url_patterns]
+        self._host_memo: "OrderedDict[str, Tuple[ExtractorSpec, ...]]" = OrderedDict()
+
+    @staticmethod
+    def _combine(patterns_by_index: Dict[int, List[str]]):
+        groups = [f"(?P<s{i}>{'|'.join(patterns)})" for i, patterns in patterns_by_index.items() if patterns]
+        return re.compile("|".join(groups)) if groups else None
+
+    def _spec_at(self, group_name: str) -> ExtractorSpec:
+        return self.specs[int(group_name[1:])]
+
+    def by_alias(self, host: str) -> Optional[ExtractorSpec]:
+        return self._by_alias.get(host.lower())
+
+    def get(self, name: str) -> Optional[ExtractorSpec]:
+        return self.specs[self._priority[name]] if name in self._priority else None
+
+    def is_instance(self, obj, name: str) -> bool:
+        """isinstance() senza forzare l'import: se la classe non è mai stata caricata, obj non può esserne un'istanza."""
+        spec = self.get(name)
+        return spec is not None and spec._cls is not None and isinstance(obj, spec._cls)
+
+    def availability(self) -> Dict[str, bool]:
+        return {spec.name: spec.is_available() for spec in self.specs}
+
+    def _host_candidates(self, hostname: str) -> Tuple[ExtractorSpec, ...]:
+        cached = self._host_memo.get(hostname)
+        if cached is not None:
+            self._host_memo.move_to_end(hostname)
+            return cached
+
+        found = {}
+        labels = hostname.split('.')
+        for i in range(len(labels) - 1):
+            spec = self._by_domain.get('.'.join(labels[i:]))
+            if spec is not None:
+                found[spec.name] = spec
+        if self._keyword_re is not None and hostname:
+            for match in self._keyword_re.finditer(hostname):
+                spec = self._spec_at(match.lastgroup)
+                found[spec.name] = spec
+
+        candidates = tuple(sorted(found.values(), key=lambda s: self._priority[s.name]))
+        self._host_memo[hostname] = candidates
+        if len(self._host_memo) > self.memo_size:
+            self._host_memo.popitem(last=False)
+        return candidates
+
+    def match(self, url: str) -> Optional[ExtractorSpec]:
+        """Restituisce lo spec dell'estrattore per l'URL, o None (-> GenericHLSExtractor)."""
+        candidates = self._host_candidates(_hostname(url))
+        if self._url_re is not None and self._url_re.search(url):
+            extra = [spec for spec in self._url_pattern_specs
+                     if spec not in candidates and any(re.search(p, url) for p in spec.url_patterns)]
+            if extra:
+                candidates = tuple(sorted(candidates + tuple(extra), key=lambda s: self._priority[s.name]))
+        for spec in candidates:
+            if spec.predicate is None or spec.predicate(url):
+                return spec
+        return None
+
+
+EXTRACTOR_REGISTRY = ExtractorRegistry(EXTRACTOR_SPECS)
@@ -6,11 +6,12 @@ from urllib.parse import urlparse
 from typing import Dict, Any
 import gzip
 import zlib
-import random
 import aiohttp
 from aiohttp import ClientSession, ClientTimeout, TCPConnector
 import zstandard # Importa la libreria zstandard
 from aiohttp_socks import ProxyConnector
+from services.proxy_pool import PROXY_POOL
+from services.dns_cache import DNS_RESOLVER
 
 logger = logging.getLogger(__name__)
 
@@ -64,7 +65,7 @@ class SportsonlineExtractor:
         self.proxies = proxies or []
 
     def _get_random_proxy(self):
-        return random.choice(self.proxies) if self.proxies else None
+        return PROXY_POOL.choose(self.proxies)
 
     async def _get_session(self):
         if self.session is None or self.session.closed:
@@ -74,7 +75,7 @@ class SportsonlineExtractor:
                 logger.info(f"Using proxy {proxy} for Sportsonline session.")
                 connector = ProxyConnector.from_url(proxy)
             else:
-                connector = TCPConnector(limit=0, limit_per_host=0)
+                connector = TCPConnector(limit=0, limit_per_host=0, use_dns_cache=False, resolver=DNS_RESOLVER)
 
             self.session = ClientSession(
                 timeout=timeout,
@@ -6,9 +6,11 @@ import hashlib
 import aiohttp
 from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp_socks import ProxyConnector
-from typing import Optional, Dict, Any
-from urllib.parse import quote_plus
-import random
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from urllib.parse import quote_plus, urlsplit, parse_qsl
+from services.proxy_pool import PROXY_POOL
+from services.dns_cache import DNS_RESOLVER
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +27,22 @@ class ExtractorError(Exception):
 
 
 class VavooExtractor:
-    """Vavoo URL extractor — resolves vavoo.to play URLs to clean HLS via lokke.app auth."""
+    """
+    Vavoo URL extractor — resolves vavoo.to play URLs to clean HLS via lokke.app auth.
+
+    La firma lokke.app viene rinnovata in background prima della scadenza finché l'estrattore è in uso,
+    e gli URL risolti sono in cache per canale (fino alla scadenza indicata nell'URL, se presente):
+    l'avvio di un canale costa al più una richiesta upstream (mediahubmx-resolve).
+    """
+
+    # Validità della firma e anticipo del rinnovo in background (secondi)
+    SIGNATURE_TTL = 300
+    SIGNATURE_RENEW_AHEAD = 60
+    # Senza estrazioni per questo tempo il rinnovo si ferma (la prossima richiesta la riottiene)
+    SIGNATURE_IDLE = 1800
+    # Validità degli URL risolti quando l'URL non riporta una scadenza; canali in cache
+    RESOLVE_TTL = 300
+    RESOLVE_CACHE_SIZE = 4096
     
     def __init__(self, request_headers: dict, proxies: list = None):
         self.request_headers = request_headers
@@ -33,19 +50,28 @@ class VavooExtractor:
             "user-agent": "okhttp/4.11.0"
         }
         self.session = None
+        # Proxy della sessione corrente: HLSProxy ci lega lo stream estratto (token legati all'IP)
+        self.session_proxy = None
         self.mediaflow_endpoint = "proxy_stream_endpoint"
         self.proxies = proxies or []
         self._cached_sig = None
         self._cached_sig_ts = 0
+        self._sig_task: Optional[asyncio.Task] = None
+        self._renewer_task: Optional[asyncio.Task] = None
+        self._last_used = 0.0
+        # URL play -> (URL risolto, scadenza epoch)
+        self._resolved: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._resolving: Dict[str, asyncio.Task] = {}
 
     def _get_random_proxy(self):
-        """Restituisce un proxy casuale dalla lista."""
-        return random.choice(self.proxies) if self.proxies else None
+        """Restituisce un proxy dalla lista, preferendo quelli veloci e sani (vedi ProxyPool)."""
+        return PROXY_POOL.choose(self.proxies)
         
     async def _get_session(self):
         if self.session is None or self.session.closed:
             timeout = ClientTimeout(total=60, connect=30, sock_read=30)
             proxy = self._get_random_proxy()
+            self.session_proxy = proxy
             if proxy:
                 logger.info(f"Using proxy for Vavoo session.")
                 connector = ProxyConnector.from_url(proxy)
@@ -56,7 +82,8 @@ class VavooExtractor:
                     keepalive_timeout=60,
                     enable_cleanup_closed=True,
                     force_close=False,
-                    use_dns_cache=True,
+                    use_dns_cache=False,
+                    resolver=DNS_RESOLVER,
                     family=socket.AF_INET
                 )
 
@@ -68,11 +95,34 @@ class VavooExtractor:
         return self.session
 
     async def _get_auth_signature(self) -> Optional[str]:
-        """Get addon signature from lokke.app (aligned with plugin.video.vavooto)."""
-        # Cache signature for 5 minutes
-        if self._cached_sig and (time.time() - self._cached_sig_ts) < 300:
+        """Firma in cache (rinnovata in background); se manca o è scaduta, una sola richiesta per tutti."""
+        self._last_used = time.time()
+        self._ensure_renewer()
+        if self._cached_sig and (time.time() - self._cached_sig_ts) < self.SIGNATURE_TTL:
             return self._cached_sig
+        if self._sig_task is None or self._sig_task.done():
+            self._sig_task = asyncio.ensure_future(self._fetch_auth_signature())
+        return await asyncio.shield(self._sig_task)
+
+    def _ensure_renewer(self):
+        if self._renewer_task is None or self._renewer_task.done():
+            self._renewer_task = asyncio.ensure_future(self._renew_signature_loop())
 
+    async def _renew_signature_loop(self):
+        """Rinnova la firma SIGNATURE_RENEW_AHEAD secondi prima della scadenza, fuori dalle richieste dei viewer."""
+        while time.time() - self._last_used < self.SIGNATURE_IDLE:
+            if self._cached_sig:
+                renew_at = self._cached_sig_ts + self.SIGNATURE_TTL - self.SIGNATURE_RENEW_AHEAD
+            else:
+                renew_at = time.time()
+            await asyncio.sleep(max(renew_at - time.time(), 5))
+            if self._sig_task is None or self._sig_task.done():
+                self._sig_task = asyncio.ensure_future(self._fetch_auth_signature())
+            if await asyncio.shield(self._sig_task):
+                logger.debug("Vavoo auth signature renewed in background")
+
+    async def _fetch_auth_signature(self) -> Optional[str]:
+        """Get addon signature from lokke.app (aligned with plugin.video.vavooto)."""
         session = await self._get_session()
         unique_id = hashlib.md5(str(time.time()).encode()).hexdigest()[:16]
         now_ms = int(time.time() * 1000)
@@ -186,6 +236,52 @@ class VavooExtractor:
             logger.warning(f"Resolve exception: {e}")
             return None
 
+    @staticmethod
+    def _url_expiry(url: str) -> Optional[float]:
+        """Scadenza (epoch) letta dai parametri dell'URL risolto (e=, exp=, expires=...), se presente."""
+        now = time.time()
+        for name, value in parse_qsl(urlsplit(url).query):
+            if name.lower() in ('e', 'exp', 'expires', 'expiry', 'expires_at') and value.isdigit():
+                expires_at = float(value)
+                if expires_at > 1e12:
+                    expires_at /= 1000
+                if now < expires_at < now + 86400:
+                    return expires_at
+        return None
+
+    def _cached_resolution(self, url: str) -> Optional[str]:
+        entry = self._resolved.get(url)
+        if entry is None:
+            return None
+        resolved_url, expires_at = entry
+        # Margine per non dare un URL che scade mentre il player si collega
+        if time.time() > expires_at - 30:
+            del self._resolved[url]
+            return None
+        self._resolved.move_to_end(url)
+        return resolved_url
+
+    async def _resolve(self, url: str, signature: str) -> Optional[str]:
+        """Risoluzione per canale con cache e una sola richiesta in corso per URL."""
+        cached = self._cached_resolution(url)
+        if cached:
+            return cached
+        task = self._resolving.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve_via_mediahubmx(url, signature))
+            self._resolving[url] = task
+            task.add_done_callback(lambda t, u=url: self._on_resolved(u, t))
+        return await asyncio.shield(task)
+
+    def _on_resolved(self, url: str, task: asyncio.Task):
+        self._resolving.pop(url, None)
+        if task.cancelled() or task.exception() is not None or not task.result():
+            return
+        self._resolved[url] = (task.result(), self._url_expiry(task.result()) or time.time() + self.RESOLVE_TTL)
+        self._resolved.move_to_end(url)
+        while len(self._resolved) > self.RESOLVE_CACHE_SIZE:
+            self._resolved.popitem(last=False)
+
     def _build_ts_fallback_url(self, play_url: str, ts_sig: str) -> Optional[str]:
         """Convert vavoo play URL to live2 TS URL with vavoo_auth."""
         import re
@@ -195,17 +291,19 @@ class VavooExtractor:
         token = m.group(1)
         return f"https://www2.vavoo.to/live2/{token}.ts?n=1&b=5&vavoo_auth={quote_plus(ts_sig)}"
 
-    async def extract(self, url: str, **kwargs) -> Dict[str, Any]:
+    async def extract(self, url: str, force_refresh: bool = False, **kwargs) -> Dict[str, Any]:
         if "vavoo.to" not in url:
             raise ExtractorError("Not a valid Vavoo URL")
         
         resolved_url = None
         stream_headers = {}
+        if force_refresh:
+            self._resolved.pop(url, None)
 
         # Step 1: Try resolve via lokke.app signature + mediahubmx
         sig = await self._get_auth_signature()
         if sig:
-            resolved_url = await self._resolve_via_mediahubmx(url, sig)
+            resolved_url = await self._resolve(url, sig)
             if resolved_url:
                 logger.info(f"Resolved via mediahubmx: {resolved_url[:80]}...")
                 stream_headers = {
@@ -235,12 +333,20 @@ class VavooExtractor:
                 "referer": "https://vavoo.to/",
             }
 
-        return {
+        result = {
             "destination_url": resolved_url,
             "request_headers": stream_headers,
             "mediaflow_endpoint": self.mediaflow_endpoint,
         }
+        expires_at = self._url_expiry(resolved_url)
+        if expires_at:
+            result["expires_at"] = expires_at
+        return result
 
     async def close(self):
+        tasks = [t for t in (self._renewer_task, self._sig_task) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         if self.session and not self.session.closed:
             await self.session.close()
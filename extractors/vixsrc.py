@@ -4,10 +4,11 @@ import re
 import json
 from urllib.parse import urlparse
 from typing import Dict, Any
-import random
 import aiohttp
 from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp_socks import ProxyConnector
+from services.proxy_pool import PROXY_POOL
+from services.dns_cache import DNS_RESOLVER
 
 logger = logging.getLogger(__name__)
 
@@ -34,8 +35,8 @@ class VixSrcExtractor:
         self.is_vixsrc = True # Flag per identificare questo estrattore
 
     def _get_random_proxy(self):
-        """Restituisce un proxy casuale dalla lista."""
-        return random.choice(self.proxies) if self.proxies else None
+        """Restituisce un proxy dalla lista, preferendo quelli veloci e sani (vedi ProxyPool)."""
+        return PROXY_POOL.choose(self.proxies)
 
     async def _get_session(self):
         """Ottiene una sessione HTTP persistente."""
@@ -52,7 +53,8 @@ class VixSrcExtractor:
                     keepalive_timeout=30,
                     enable_cleanup_closed=True,
                     force_close=False,
-                    use_dns_cache=True
+                    use_dns_cache=False,
+                    resolver=DNS_RESOLVER
                 )
             self.session = ClientSession(
                 timeout=timeout,
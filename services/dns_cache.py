@@ -0,0 +1,411 @@
+import asyncio
+import ipaddress
+import logging
+import random
+import socket
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiohttp.abc import AbstractResolver
+from aiohttp_socks import ProxyConnector
+
+logger = logging.getLogger(__name__)
+
+_QTYPES = {socket.AF_INET: (1,), socket.AF_INET6: (28,), socket.AF_UNSPEC: (1, 28)}
+_QTYPE_FAMILY = {1: socket.AF_INET, 28: socket.AF_INET6}
+_NUMERIC_FLAGS = socket.AI_NUMERICHOST | socket.AI_NUMERICSERV
+
+
+class _DNSError(Exception):
+    pass
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def _read_nameservers(path: str = "/etc/resolv.conf") -> List[Tuple[str, int]]:
+    servers = []
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver" and _is_ip(parts[1].split('%')[0]):
+                    servers.append((parts[1].split('%')[0], 53))
+    except OSError:
+        pass
+    return servers
+
+
+def parse_nameservers(value: str) -> List[Tuple[str, int]]:
+    """DNS_SERVERS: "1.1.1.1, 127.0.0.1:5353" -> [("1.1.1.1", 53), ("127.0.0.1", 5353)]"""
+    servers = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(':') if item.count(':') == 1 else (item, '', '')
+        servers.append((host or item, int(port) if port else 53))
+    return servers
+
+
+def _read_hosts_file(path: str = "/etc/hosts") -> Dict[str, List[str]]:
+    hosts: Dict[str, List[str]] = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split('#', 1)[0].split()
+                if len(parts) >= 2 and _is_ip(parts[0]):
+                    for name in parts[1:]:
+                        hosts.setdefault(name.lower(), []).append(parts[0])
+    except OSError:
+        pass
+    return hosts
+
+
+# --- Client DNS minimale su UDP (serve per avere i TTL, che getaddrinfo non espone) ---
+
+def _build_query(qid: int, name: str, qtype: int) -> bytes:
+    labels = name.rstrip('.').encode('idna').split(b'.')
+    qname = b''.join(bytes([len(label)]) + label for label in labels) + b'\x00'
+    return struct.pack('!HHHHHH', qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack('!HH', qtype, 1)
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+
+
+def _parse_response(data: bytes, qid: int, qtype: int):
+    """-> (rcode, [(indirizzo, ttl)], ttl negativo dal SOA o None)"""
+    rid, flags, qdcount, ancount, nscount, _ = struct.unpack_from('!HHHHHH', data)
+    if rid != qid:
+        raise _DNSError("mismatched DNS response id")
+    if flags & 0x0200:
+        raise _DNSError("truncated DNS response")
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+
+    records = []
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, rclass, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+        offset += 10
+        if rtype == qtype and rclass == 1:
+            records.append((socket.inet_ntop(_QTYPE_FAMILY[qtype], data[offset:offset + rdlength]), ttl))
+        offset += rdlength
+
+    negative_ttl = None
+    for _ in range(nscount):
+        offset = _skip_name(data, offset)
+        rtype, _, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+        offset += 10
+        if rtype == 6 and rdlength >= 4:
+            # SOA: TTL negativo = min(TTL del record, campo MINIMUM)
+            negative_ttl = min(ttl, struct.unpack_from('!I', data, offset + rdlength - 4)[0])
+        offset += rdlength
+    return flags & 0x000F, records, negative_ttl
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, qid: int, future: asyncio.Future):
+        self.qid = qid
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done() and len(data) >= 12 and struct.unpack_from('!H', data)[0] == self.qid:
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class _Entry:
+    __slots__ = ("addresses", "expires_at", "error", "last_used", "ttl")
+
+    def __init__(self, addresses: List[Tuple[str, int]], ttl: float, error: Optional[str] = None):
+        self.addresses = addresses  # [(ip, family)]
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+        self.error = error
+        self.last_used = time.monotonic()
+
+
+class CachingResolver(AbstractResolver):
+    """
+    Resolver DNS asincrono condiviso da tutte le sessioni aiohttp del processo.
+
+    - Rispetta il TTL dei record (limitato a [min_ttl, max_ttl]) interrogando direttamente i
+      nameserver di /etc/resolv.conf (o DNS_SERVERS); prima si consulta /etc/hosts, e per nomi
+      senza punto o nameserver irraggiungibili si ripiega su getaddrinfo
+    - Cache negativa: NXDOMAIN/nessun record vengono ricordati per il TTL del SOA (o negative_ttl)
+    - Una sola risoluzione in volo per hostname (single-flight)
+    - Gli hostname usati negli ultimi `hot_window` secondi vengono ririsolti in background prima
+      della scadenza: sul percorso della richiesta non c'è mai un lookup DNS per un host "caldo"
+    - Se il DNS fallisce si continua a servire l'ultima risposta valida per `stale_grace` secondi
+    """
+
+    def __init__(self, nameservers: Optional[List[Tuple[str, int]]] = None, min_ttl: float = 5.0,
+                 max_ttl: float = 300.0, negative_ttl: float = 30.0, default_ttl: float = 60.0,
+                 hot_window: float = 600.0, refresh_ahead: float = 0.2, query_timeout: float = 2.0,
+                 stale_grace: float = 300.0, max_entries: int = 4096):
+        self.nameservers = nameservers
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.default_ttl = default_ttl
+        self.hot_window = hot_window
+        self.refresh_ahead = refresh_ahead
+        self.query_timeout = query_timeout
+        self.stale_grace = stale_grace
+        self.max_entries = max_entries
+        self._hosts: Optional[Dict[str, List[str]]] = None
+        self._entries: Dict[Tuple[str, int], _Entry] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Contatori esposti via /api/info
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.stale_served = 0
+        self.refreshes = 0
+        self.queries = 0
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Unknown CachingResolver setting: {name}")
+            setattr(self, name, value)
+
+    def _results(self, host: str, port: int, addresses) -> List[dict]:
+        return [
+            {"hostname": host, "host": address, "port": port, "family": family, "proto": 0, "flags": _NUMERIC_FLAGS}
+            for address, family in addresses
+        ]
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET) -> List[dict]:
+        if _is_ip(host):
+            return self._results(host, port, [(host, socket.AF_INET6 if ':' in host else socket.AF_INET)])
+
+        key = (host.lower().rstrip('.'), int(family))
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        self._ensure_refresher()
+        if entry is not None:
+            entry.last_used = now
+            if now < entry.expires_at:
+                if entry.error:
+                    self.negative_hits += 1
+                    raise OSError(None, entry.error)
+                self.hits += 1
+                return self._results(host, port, entry.addresses)
+
+        self.misses += 1
+        try:
+            fresh = await self._lookup(key)
+            if fresh.error:
+                raise OSError(None, fresh.error)
+        except Exception as e:
+            if entry is not None and not entry.error and now - entry.expires_at < self.stale_grace:
+                self.stale_served += 1
+                logger.warning(f"⚠️ DNS lookup failed for {host} ({e}), serving stale addresses")
+                return self._results(host, port, entry.addresses)
+            raise
+        return self._results(host, port, fresh.addresses)
+
+    def prefetch(self, hosts: Iterable[str], family: socket.AddressFamily = socket.AF_INET):
+        """Risolve in background gli host indicati (es. i CDN dei segmenti appena visti nel manifest)."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        now = time.monotonic()
+        for host in hosts:
+            if not host or _is_ip(host):
+                continue
+            key = (host.lower().rstrip('.'), int(family))
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = now
+                if now < entry.expires_at:
+                    continue
+            if key not in self._inflight:
+                task = self._lookup(key)
+                task.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def _lookup(self, key) -> asyncio.Future:
+        """Single-flight: un solo task di risoluzione per chiave, il risultato va in cache."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._query(*key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda f, key=key: self._on_lookup_done(key, f))
+        return asyncio.shield(task)
+
+    def _on_lookup_done(self, key, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        entry = task.result()
+        previous = self._entries.get(key)
+        if previous is not None:
+            entry.last_used = previous.last_used
+            # Un errore transitorio non sovrascrive un indirizzo ancora valido
+            if entry.error and not previous.error and time.monotonic() - previous.expires_at < self.stale_grace:
+                return
+        self._entries[key] = entry
+        if len(self._entries) > self.max_entries:
+            self._prune()
+
+    def _prune(self):
+        oldest = sorted(self._entries.items(), key=lambda item: item[1].last_used)
+        for key, _ in oldest[:len(self._entries) - self.max_entries]:
+            del self._entries[key]
+
+    def _clamp(self, ttl: float) -> float:
+        return max(self.min_ttl, min(self.max_ttl, ttl))
+
+    async def _query(self, host: str, family: int) -> _Entry:
+        if self._hosts is None:
+            self._hosts = _read_hosts_file()
+        if host in self._hosts:
+            addresses = [(ip, socket.AF_INET6 if ':' in ip else socket.AF_INET) for ip in self._hosts[host]]
+            addresses = [a for a in addresses if family == socket.AF_UNSPEC or a[1] == family]
+            if addresses:
+                return _Entry(addresses, self.max_ttl)
+
+        if self.nameservers is None:
+            self.nameservers = _read_nameservers()
+
+        negative_ttl = None
+        if self.nameservers and '.' in host:
+            addresses, ttls = [], []
+            try:
+                for qtype in _QTYPES.get(family, (1,)):
+                    rcode, records, soa_ttl = await self._udp_query(host, qtype)
+                    if rcode == 3:
+                        negative_ttl = soa_ttl if soa_ttl is not None else self.negative_ttl
+                        break
+                    if rcode == 0 and not records and soa_ttl is not None:
+                        negative_ttl = soa_ttl
+                    addresses.extend((address, _QTYPE_FAMILY[qtype]) for address, _ in records)
+                    ttls.extend(ttl for _, ttl in records)
+            except (OSError, asyncio.TimeoutError, _DNSError, struct.error, IndexError) as e:
+                logger.debug(f"DNS query for {host} failed ({e}), falling back to getaddrinfo")
+            if addresses:
+                return _Entry(addresses, self._clamp(min(ttls)))
+            if negative_ttl is not None:
+                return _Entry([], self._clamp(negative_ttl), error=f"Cannot resolve {host}: no such host")
+
+        # Nomi senza punto (search domain), mDNS, nameserver irraggiungibili: decide il resolver di sistema
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, family=family, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            return _Entry([], self._clamp(self.negative_ttl), error=f"Cannot resolve {host}: {e.strerror or e}")
+        addresses = []
+        for info_family, _, _, _, sockaddr in infos:
+            if (sockaddr[0], info_family) not in addresses:
+                addresses.append((sockaddr[0], info_family))
+        return _Entry(addresses, self._clamp(self.default_ttl))
+
+    async def _udp_query(self, host: str, qtype: int):
+        loop = asyncio.get_running_loop()
+        last_error: Exception = _DNSError("no nameserver answered")
+        for server, port in self.nameservers:
+            qid = random.randrange(0, 65536)
+            future = loop.create_future()
+            self.queries += 1
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _QueryProtocol(qid, future), remote_addr=(server, port)
+            )
+            try:
+                transport.sendto(_build_query(qid, host, qtype))
+                data = await asyncio.wait_for(future, self.query_timeout)
+                rcode, records, soa_ttl = _parse_response(data, qid, qtype)
+                if rcode in (0, 3):
+                    return rcode, records, soa_ttl
+                last_error = _DNSError(f"rcode {rcode} from {server}")
+            except (OSError, asyncio.TimeoutError, _DNSError) as e:
+                last_error = e
+            finally:
+                transport.close()
+        raise last_error
+
+    def _ensure_refresher(self):
+        if self.hot_window <= 0 or (self._refresh_task is not None and not self._refresh_task.done()):
+            return
+        self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for key, entry in list(self._entries.items()):
+                if now - entry.last_used > self.hot_window:
+                    # Host non più usato: lo si lascia scadere
+                    if now > entry.expires_at + self.stale_grace:
+                        del self._entries[key]
+                    continue
+                if entry.error or key in self._inflight:
+                    continue
+                if entry.expires_at - now <= max(1.0, entry.ttl * self.refresh_ahead):
+                    self.refreshes += 1
+                    self._lookup(key).add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def close(self):
+        # Condiviso tra i connector (che non ne sono proprietari): si ferma solo con stop()
+        pass
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+        for task in list(self._inflight.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "entries": len(self._entries),
+            "hot": sum(1 for e in self._entries.values() if now - e.last_used <= self.hot_window),
+            "negative": sum(1 for e in self._entries.values() if e.error),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "stale_served": self.stale_served,
+            "background_refreshes": self.refreshes,
+            "queries": self.queries,
+            "nameservers": [f"{host}:{port}" for host, port in self.nameservers or []],
+        }
+
+
+class CachedDNSProxyConnector(ProxyConnector):
+    """ProxyConnector che risolve l'hostname del proxy con il resolver condiviso (la destinazione la risolve il proxy)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._proxy_hostname = self._proxy_host
+
+    async def _connect_via_proxy(self, host, port, ssl=None, timeout=None):
+        if self._proxy_ssl is None and not _is_ip(self._proxy_hostname):
+            infos = await DNS_RESOLVER.resolve(self._proxy_hostname, self._proxy_port, socket.AF_INET)
+            self._proxy_host = infos[0]["host"]
+        return await super()._connect_via_proxy(host, port, ssl=ssl, timeout=timeout)
+
+
+# Istanza condivisa da tutte le sessioni (HLSProxy, sessioni proxy, estrattori)
+DNS_RESOLVER = CachingResolver()
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from services.extraction_store import ExtractionStore
+
+logger = logging.getLogger(__name__)
+
+# Margine prima di expires_at: un token in scadenza non va più servito né dato come stale
+# (per i token da pochi secondi al massimo un quarto della durata residua)
+_EXPIRY_MARGIN = 30.0
+
+
+def parse_ttl_overrides(value: str) -> Dict[str, float]:
+    """"vavoo=300, dlhd=600" -> {"vavoo": 300.0, "dlhd": 600.0} (voci malformate ignorate)."""
+    overrides = {}
+    for item in (value or "").split(","):
+        name, _, ttl = item.partition("=")
+        try:
+            overrides[name.strip().lower()] = float(ttl)
+        except ValueError:
+            if item.strip():
+                logger.warning(f"⚠️ Invalid extraction cache TTL ignored: {item.strip()}")
+    return overrides
+
+
+class _CachedExtraction:
+    __slots__ = ("result", "fresh_until", "stale_until")
+
+    def __init__(self, result: dict, fresh_until: float, stale_until: float):
+        self.result = result
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class _ExtractorStats:
+    __slots__ = ("hits", "stale_hits", "store_hits", "misses", "coalesced", "errors", "latency_ewma", "latency_max")
+
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.latency_ewma: Optional[float] = None
+        self.latency_max = 0.0
+
+    def record_latency(self, seconds: float):
+        self.latency_ewma = seconds if self.latency_ewma is None else self.latency_ewma + 0.2 * (seconds - self.latency_ewma)
+        self.latency_max = max(self.latency_max, seconds)
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "hit_ratio": round((self.hits + self.stale_hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "avg_resolution_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "max_resolution_ms": round(self.latency_max * 1000, 1),
+        }
+
+
+class ExtractionCache:
+    """
+    Cache dei risultati di extractor.extract(), condivisa da tutte le richieste.
+
+    - Chiave: (nome estrattore, URL); TTL per estrattore (ttl_for(nome)), 0 = nessuna cache
+    - Se il risultato contiene `expires_at` (epoch, secondi) la validità non supera la scadenza
+      del token meno un margine, e la copia non viene più servita dopo quel momento
+    - Estrazioni concorrenti dello stesso URL condividono un solo task
+    - Stale-while-revalidate: scaduto il TTL, per `stale_window` secondi si serve il risultato
+      precedente e parte un solo refresh in background
+    - Con uno `store` su disco i risultati sopravvivono ai riavvii e sono condivisi tra i worker:
+      in caso di miss (non forzato) si legge lo store prima di estrarre
+    """
+
+    def __init__(self, default_ttl: float = 300.0, stale_window: float = 120.0,
+                 ttl_overrides: Optional[Dict[str, float]] = None, max_entries: int = 2048,
+                 store: Optional[ExtractionStore] = None):
+        self.default_ttl = default_ttl
+        self.stale_window = stale_window
+        self.ttl_overrides = ttl_overrides or {}
+        self.max_entries = max_entries
+        self.store = store
+        self._entries: "OrderedDict[Tuple[str, str], _CachedExtraction]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        # Estrazioni in corso avviate con force (refresh forzato dell'estrattore)
+        self._forced = set()
+        self._stats: Dict[str, _ExtractorStats] = {}
+
+    def ttl_for(self, name: str, spec_ttl: Optional[float] = None) -> float:
+        if name in self.ttl_overrides:
+            return self.ttl_overrides[name]
+        return spec_ttl if spec_ttl is not None else self.default_ttl
+
+    def _stats_for(self, name: str) -> _ExtractorStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = _ExtractorStats()
+        return stats
+
+    @staticmethod
+    def _copy(result: dict) -> dict:
+        # I chiamanti modificano request_headers (h_ params): mai restituire l'oggetto in cache
+        copy = dict(result)
+        if isinstance(copy.get("request_headers"), dict):
+            copy["request_headers"] = dict(copy["request_headers"])
+        return copy
+
+    @staticmethod
+    def _namespace(name: str) -> str:
+        return f"extraction:{name}"
+
+    def invalidate(self, name: str, url: str):
+        self._entries.pop((name, url), None)
+        if self.store is not None:
+            self.store.delete(self._namespace(name), url)
+
+    def _store(self, key: Tuple[str, str], result: dict, ttl: float, persist: bool = True):
+        now = time.monotonic()
+        fresh_until = now + ttl
+        stale_until = fresh_until + self.stale_window
+        expires_at = result.get("expires_at")
+        if expires_at:
+            remaining = float(expires_at) - time.time()
+            remaining -= min(_EXPIRY_MARGIN, remaining / 4)
+            fresh_until = min(fresh_until, now + remaining)
+            stale_until = min(stale_until, now + remaining)
+        if fresh_until <= now:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = _CachedExtraction(result, fresh_until, stale_until)
+        if persist and self.store is not None:
+            # Nello store si conserva solo il periodo "fresco", in tempo assoluto (valido tra processi)
+            fresh_at = time.time() + (fresh_until - now)
+            self.store.put(self._namespace(key[0]), key[1], {"result": result, "fresh_until": fresh_at}, expires_at=fresh_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _start(self, key: Tuple[str, str], extract: Callable[[], Awaitable[dict]], ttl: float, force: bool = False) -> asyncio.Future:
+        stats = self._stats_for(key[0])
+
+        async def run():
+            if not force and self.store is not None:
+                persisted = await self.store.get(self._namespace(key[0]), key[1])
+                if persisted:
+                    stats.store_hits += 1
+                    return persisted["result"], persisted["fresh_until"] - time.time()
+            start = time.monotonic()
+            try:
+                result = await extract()
+            except Exception:
+                stats.errors += 1
+                raise
+            stats.record_latency(time.monotonic() - start)
+            return result, None
+
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        if force:
+            self._forced.add(task)
+        task.add_done_callback(lambda t, k=key: self._on_done(k, t, ttl))
+        return task
+
+    def _on_done(self, key: Tuple[str, str], task: asyncio.Future, ttl: float):
+        self._forced.discard(task)
+        if self._inflight.get(key) is not task:
+            # Superata da un'estrazione forzata più recente: il suo risultato non va sovrascritto
+            return
+        del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.debug(f"Extraction failed for {key[1]}: {task.exception()}")
+            return
+        result, remaining = task.result()
+        if remaining is not None:
+            # Letto dallo store (altro worker o processo precedente): vale per il tempo rimasto, non va riscritto
+            self._store(key, result, min(ttl, remaining), persist=False)
+        else:
+            self._store(key, result, ttl)
+
+    async def get_or_extract(self, name: str, url: str, extract: Callable[[], Awaitable[dict]],
+                             ttl: Optional[float] = None, force: bool = False) -> Tuple[dict, str]:
+        """
+        Restituisce (risultato, stato) con stato in 'hit', 'stale', 'coalesced', 'miss', 'bypass'.
+        force=True ignora la copia in cache e si aggancia solo a un'altra estrazione forzata.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        stats = self._stats_for(name)
+        key = (name, url)
+
+        if ttl <= 0:
+            start = time.monotonic()
+            try:
+                result = await extract()
+            except Exception:
+                stats.errors += 1
+                raise
+            stats.misses += 1
+            stats.record_latency(time.monotonic() - start)
+            return result, 'bypass'
+
+        if force:
+            self._entries.pop(key, None)
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = time.monotonic()
+            if now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                stats.hits += 1
+                return self._copy(entry.result), 'hit'
+            if now < entry.stale_until:
+                if key not in self._inflight:
+                    self._start(key, extract, ttl)
+                stats.stale_hits += 1
+                return self._copy(entry.result), 'stale'
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None and (not force or task in self._forced):
+            stats.coalesced += 1
+            state = 'coalesced'
+        else:
+            stats.misses += 1
+            task = self._start(key, extract, ttl, force)
+            state = 'miss'
+        # shield: se il client se ne va l'estrazione continua per gli altri (e finisce in cache)
+        result, _ = await asyncio.shield(task)
+        return self._copy(result), state
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "default_ttl": self.default_ttl,
+            "stale_window": self.stale_window,
+            "per_extractor": {name: stats.as_dict() for name, stats in sorted(self._stats.items())},
+        }
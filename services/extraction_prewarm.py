@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PrewarmJob:
+    """Pre-risoluzione dei canali di una playlist generata (progresso visibile in /api/prewarm)."""
+
+    def __init__(self, job_id: int, urls: List[str], total_channels: int):
+        self.id = job_id
+        self.urls = urls
+        self.total_channels = total_channels
+        self.state = "queued"
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("queued", "running")
+
+    def as_dict(self) -> dict:
+        processed = self.done + self.failed + self.skipped
+        return {
+            "id": self.id,
+            "state": self.state,
+            "channels_in_playlist": self.total_channels,
+            "scheduled": len(self.urls),
+            "done": self.done,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "progress": round(processed / len(self.urls), 3) if self.urls else 1.0,
+            "created_at": self.created_at,
+            "elapsed_s": round((self.finished_at or time.time()) - self.started_at, 1) if self.started_at else 0.0,
+        }
+
+
+class PrewarmCandidates:
+    """Canali di una playlist letta in streaming: tiene solo i `limit` più richiesti (memoria costante)."""
+
+    def __init__(self, popularity: Dict[str, int], limit: int):
+        self._popularity = popularity
+        self.limit = limit
+        self.total = 0
+        self._heap: List[tuple] = []
+        self._queued = set()
+
+    def add(self, url: str):
+        self.total += 1
+        if self.limit <= 0 or url in self._queued:
+            return
+        # A parità di popolarità vince l'ordine della playlist
+        entry = (self._popularity.get(url, 0), -self.total, url)
+        if len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            self._queued.discard(heapq.heapreplace(self._heap, entry)[2])
+        else:
+            return
+        self._queued.add(url)
+
+    def urls(self) -> List[str]:
+        return [url for _, _, url in sorted(self._heap, reverse=True)]
+
+
+class ExtractionPrewarmer:
+    """
+    Estrazione anticipata dei canali delle playlist generate, dentro la cache delle estrazioni.
+
+    - Ogni /playlist genera un job con i canali della lista, ordinati per popolarità (richieste
+      /proxy registrate con record_request) e limitati a `max_channels`
+    - I job girano uno alla volta; ogni job avvia al massimo `rate` estrazioni al secondo con
+      `concurrency` in parallelo, così una lista da migliaia di canali non satura le connessioni
+    - `extract(url)` restituisce False se l'URL non ha un estrattore da pre-riscaldare (contato come skipped)
+    - I job possono essere cancellati (cancel) e restano visibili fino a `max_jobs`
+    """
+
+    def __init__(self, extract: Callable[[str], Awaitable[bool]], max_channels: int = 200, concurrency: int = 4,
+                 rate: float = 5.0, max_jobs: int = 20, max_tracked: int = 10000):
+        self.extract = extract
+        self.max_channels = max_channels
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_jobs = max_jobs
+        self.max_tracked = max_tracked
+        self._popularity: Dict[str, int] = {}
+        self._jobs: "OrderedDict[int, PrewarmJob]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._runner: Optional[asyncio.Task] = None
+        self._current: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_channels > 0 and self.concurrency > 0
+
+    def record_request(self, url: str):
+        """Una richiesta client per il canale: usata per scegliere i canali più richiesti."""
+        self._popularity[url] = self._popularity.get(url, 0) + 1
+        if len(self._popularity) > self.max_tracked:
+            # Decadimento: si dimezzano i contatori e spariscono i canali visti una volta sola
+            self._popularity = {u: c // 2 for u, c in self._popularity.items() if c > 1}
+
+    def candidates(self) -> PrewarmCandidates:
+        """Raccoglitore per on_stream_url: evita di tenere in memoria tutti i canali di liste enormi."""
+        return PrewarmCandidates(self._popularity, self.max_channels)
+
+    def submit(self, urls: Iterable[str], total_channels: Optional[int] = None) -> Optional[PrewarmJob]:
+        if not self.enabled:
+            return None
+        channels = list(dict.fromkeys(urls))
+        # Canali già in un job attivo non vengono ripetuti
+        scheduled = set()
+        for job in self._jobs.values():
+            if job.active:
+                scheduled.update(job.urls)
+        candidates = [url for url in channels if url not in scheduled]
+        candidates.sort(key=lambda url: -self._popularity.get(url, 0))
+        candidates = candidates[:self.max_channels]
+        if not candidates:
+            return None
+
+        job = PrewarmJob(next(self._ids), candidates, total_channels if total_channels is not None else len(channels))
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest = next((j for j in self._jobs.values() if not j.active), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest.id]
+        logger.info(f"🔥 Prewarm job {job.id} queued: {len(candidates)}/{job.total_channels} channels")
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.ensure_future(self._run_jobs())
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        was_running = job.state == "running"
+        job.state = "cancelled"
+        job.finished_at = time.time()
+        if was_running and self._current is not None:
+            self._current.cancel()
+        logger.info(f"🛑 Prewarm job {job_id} cancelled")
+        return True
+
+    async def _run_jobs(self):
+        while True:
+            job = next((j for j in self._jobs.values() if j.state == "queued"), None)
+            if job is None:
+                return
+            job.state = "running"
+            job.started_at = time.time()
+            self._current = asyncio.ensure_future(self._run(job))
+            try:
+                await self._current
+            except asyncio.CancelledError:
+                if job.state != "cancelled":
+                    raise
+            finally:
+                self._current = None
+            if job.state == "running":
+                job.state = "done"
+                job.finished_at = time.time()
+                logger.info(f"🔥 Prewarm job {job.id} finished: {job.done} done, {job.failed} failed, {job.skipped} skipped")
+
+    async def _run(self, job: PrewarmJob):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        tasks = []
+
+        async def warm(url: str):
+            try:
+                if await self.extract(url):
+                    job.done += 1
+                else:
+                    job.skipped += 1
+            except Exception as e:
+                job.failed += 1
+                logger.debug(f"Prewarm failed for {url}: {e}")
+            finally:
+                semaphore.release()
+
+        try:
+            for url in job.urls:
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(warm(url)))
+                if interval:
+                    await asyncio.sleep(interval)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stop(self):
+        for job in self._jobs.values():
+            if job.active:
+                job.state = "cancelled"
+                job.finished_at = time.time()
+        tasks = [t for t in (self._current, self._runner) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get(self, job_id: int) -> Optional[PrewarmJob]:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_channels": self.max_channels,
+            "concurrency": self.concurrency,
+            "rate_per_s": self.rate,
+            "tracked_channels": len(self._popularity),
+            "jobs": [job.as_dict() for job in reversed(self._jobs.values())],
+        }
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+_UPSERT = """
+INSERT INTO extractions (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(namespace, key) DO UPDATE SET
+    value = excluded.value, expires_at = excluded.expires_at, updated_at = excluded.updated_at
+"""
+
+# Marcatore nella coda di scrittura: la chiave va cancellata
+_DELETE = object()
+
+
+class ExtractionStore:
+    """
+    Store su disco (SQLite in modalità WAL) per i risultati delle estrazioni, condiviso tra i worker.
+
+    - Letture: query per chiave primaria su un thread dedicato (il loop non tocca mai il disco);
+      le scritture ancora in coda sono visibili subito al worker che le ha fatte
+    - Scritture write-behind: put()/delete() non bloccano, un task le raccoglie e le applica in
+      un'unica transazione ogni `flush_interval` secondi (upsert atomico per chiave)
+    - TTL: ogni riga ha un expires_at (epoch); le righe scadute non vengono restituite e sono
+      rimosse periodicamente
+    - WAL + busy_timeout: più processi (worker gunicorn) leggono e scrivono lo stesso file
+    """
+
+    def __init__(self, path: Optional[str] = None, flush_interval: float = 0.5, busy_timeout: float = 5.0,
+                 purge_interval: float = 300.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.busy_timeout = busy_timeout
+        self.purge_interval = purge_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[Tuple[str, str], Any] = {}
+        self._writer_task: Optional[asyncio.Task] = None
+        # Flush in corso: non viene mai cancellato (stop() lo attende)
+        self._flushing: Optional[asyncio.Future] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+        self._disabled = False
+
+        # Contatori esposti via /api/info
+        self.reads = 0
+        self.read_hits = 0
+        self.writes = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Unknown ExtractionStore setting: {name}")
+            setattr(self, name, value)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and not self._disabled
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and self.enabled:
+            try:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(_SCHEMA)
+                self._conn = conn
+                logger.info(f"💾 Extraction store opened: {self.path}")
+            except sqlite3.Error as e:
+                # Disco non scrivibile o file corrotto: si prosegue senza persistenza
+                self._disabled = True
+                logger.error(f"❌ Extraction store disabled ({self.path}): {e}")
+        return self._conn
+
+    def _run(self, fn, *args):
+        with self._conn_lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                return fn(conn, *args)
+            except sqlite3.Error as e:
+                self.errors += 1
+                logger.warning(f"⚠️ Extraction store error: {e}")
+                return None
+
+    @staticmethod
+    def _select(conn: sqlite3.Connection, namespace: str, key: str) -> Optional[Any]:
+        row = conn.execute(
+            "SELECT value FROM extractions WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: Dict[Tuple[str, str], Any]):
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (namespace, key), item in batch.items():
+                if item is _DELETE:
+                    conn.execute("DELETE FROM extractions WHERE namespace = ? AND key = ?", (namespace, key))
+                else:
+                    value, expires_at = item
+                    conn.execute(_UPSERT, (namespace, key, value, expires_at, now))
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                conn.execute("DELETE FROM extractions WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _write(self, batch: Dict[Tuple[str, str], Any]) -> bool:
+        if not self._run(self._write_batch, batch):
+            return False
+        self.writes += len(batch)
+        self.flushes += 1
+        return True
+
+    def _requeue(self, batch: Dict[Tuple[str, str], Any]):
+        """Batch non scritto (es. "database is locked"): torna in coda per il prossimo flush."""
+        if not self.enabled:
+            return
+        # Le scritture arrivate nel frattempo sono più recenti e hanno la precedenza
+        for key, item in batch.items():
+            self._pending.setdefault(key, item)
+
+    def _pending_value(self, namespace: str, key: str) -> Tuple[bool, Optional[Any]]:
+        item = self._pending.get((namespace, key))
+        if item is None:
+            return False, None
+        if item is _DELETE:
+            return True, None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            return True, None
+        return True, json.loads(value)
+
+    def load_sync(self, namespace: str, key: str) -> Optional[Any]:
+        """Lettura bloccante, solo per l'inizializzazione (costruttori chiamati fuori dal percorso caldo)."""
+        if not self.enabled:
+            return None
+        found, value = self._pending_value(namespace, key)
+        if found:
+            return value
+        return self._run(self._select, namespace, key)
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        self.reads += 1
+        found, value = self._pending_value(namespace, key)
+        if not found:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraction-store")
+            value = await asyncio.get_running_loop().run_in_executor(self._executor, self._run, self._select, namespace, key)
+        if value is not None:
+            self.read_hits += 1
+        return value
+
+    def put(self, namespace: str, key: str, value: Any, expires_at: Optional[float] = None):
+        """Accoda l'upsert di `value` (serializzabile in JSON) con scadenza `expires_at` (epoch, None = mai)."""
+        if not self.enabled:
+            return
+        try:
+            encoded = json.dumps(value)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Extraction store: value for {namespace}/{key} not serializable: {e}")
+            return
+        self._pending[(namespace, key)] = (encoded, expires_at)
+        self._schedule_flush()
+
+    def delete(self, namespace: str, key: str):
+        if not self.enabled:
+            return
+        self._pending[(namespace, key)] = _DELETE
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Fuori dal loop (avvio/test): scrittura immediata
+            self._flush_now()
+            return
+        if self._writer_task is None or self._writer_task.done():
+            self._wakeup = asyncio.Event()
+            self._writer_task = asyncio.ensure_future(self._writer_loop())
+        self._wakeup.set()
+
+    def _flush_now(self):
+        batch, self._pending = self._pending, {}
+        if batch and not self._write(batch):
+            self._requeue(batch)
+
+    async def _writer_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Raccoglie le scritture arrivate nel frattempo in un'unica transazione
+            await asyncio.sleep(self.flush_interval)
+            # shield: cancellare il writer (stop()) non interrompe un batch già tolto da _pending
+            self._flushing = asyncio.ensure_future(self._flush())
+            if not await asyncio.shield(self._flushing):
+                # Batch tornato in coda: nuovo tentativo al prossimo giro
+                self._wakeup.set()
+            self._flushing = None
+
+    async def _flush(self) -> bool:
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return True
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraction-store")
+        if await asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch):
+            return True
+        self._requeue(batch)
+        return False
+
+    async def stop(self, attempts: int = 3):
+        """Scrive le modifiche ancora in coda e chiude il database."""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+            self._flushing = None
+        for _ in range(attempts):
+            if await self._flush():
+                break
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "enabled": self.enabled,
+            "reads": self.reads,
+            "read_hits": self.read_hits,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "pending": len(self._pending),
+            "errors": self.errors,
+        }
+
+
+# Istanza condivisa (configurata da HLSProxy con EXTRACTION_STORE_PATH)
+EXTRACTION_STORE = ExtractionStore()
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class HostLatency:
+    """Finestra scorrevole dei tempi di fetch (secondi) di un host upstream, con percentili e budget di hedge."""
+
+    __slots__ = ("samples", "requests", "hedges", "hedge_wins", "last_used", "_sorted")
+
+    def __init__(self, window: int):
+        self.samples: "deque[float]" = deque(maxlen=window)
+        self.requests = 0.0
+        self.hedges = 0.0
+        self.hedge_wins = 0
+        self.last_used = time.monotonic()
+        self._sorted = None
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        index = min(len(self._sorted) - 1, max(0, math.ceil(p / 100 * len(self._sorted)) - 1))
+        return self._sorted[index]
+
+    def decay(self):
+        # Contatori "recenti": il rapporto hedge/richieste segue il traffico degli ultimi minuti
+        self.requests *= 0.5
+        self.hedges *= 0.5
+
+
+class HedgedFetcher:
+    """
+    Richieste "hedged" verso l'upstream guidate dai percentili di latenza per host.
+
+    Se un fetch non è finito dopo il p`percentile` dei tempi recenti dell'host (es. p95), parte una
+    seconda richiesta identica su un'altra connessione del pool: vince la prima che risponde, l'altra
+    viene cancellata (e la sua connessione chiusa). Se un tentativo fallisce prima dell'hedge, il
+    secondo parte subito. Gli hedge sono limitati a `max_ratio` delle richieste per host, così un host
+    lento non raddoppia il carico; servono almeno `min_samples` misure prima di attivarli.
+    """
+
+    def __init__(self, percentile: float = 95.0, max_ratio: float = 0.1, min_samples: int = 20,
+                 min_delay: float = 0.2, window: int = 200, max_hosts: int = 1024):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self.max_hosts = max_hosts
+        self._hosts: Dict[str, HostLatency] = {}
+        self._last_decay = time.monotonic()
+
+    def _host_for(self, url: str) -> HostLatency:
+        host = (urlparse(url).hostname or "").lower()
+        stats = self._hosts.get(host)
+        if stats is None:
+            if len(self._hosts) >= self.max_hosts:
+                oldest = min(self._hosts, key=lambda h: self._hosts[h].last_used)
+                del self._hosts[oldest]
+            stats = self._hosts[host] = HostLatency(self.window)
+        stats.last_used = time.monotonic()
+        return stats
+
+    def hedge_delay(self, stats: HostLatency, deadline: float) -> Optional[float]:
+        """Dopo quanti secondi lanciare il secondo tentativo (None = niente hedge)."""
+        if self.percentile <= 0 or len(stats.samples) < self.min_samples:
+            return None
+        if stats.requests and stats.hedges / stats.requests >= self.max_ratio:
+            return None
+        delay = max(self.min_delay, stats.percentile(self.percentile))
+        # Il secondo tentativo deve avere almeno metà del tempo rimasto per finire
+        return delay if delay < deadline / 2 else None
+
+    async def fetch(self, url: str, attempt: Callable[[float], Awaitable[T]], deadline: float,
+                    record: Callable[[T], bool] = lambda result: True, hedge: bool = True) -> T:
+        """
+        Esegue attempt(timeout) con hedging. `deadline` è il tempo massimo complessivo (secondi);
+        `record(result)` dice se la durata del tentativo vincente va registrata nelle statistiche.
+        Con hedge=False (es. prefetch) la latenza viene solo misurata.
+        """
+        stats = self._host_for(url)
+        now = time.monotonic()
+        if now - self._last_decay > 60:
+            self._last_decay = now
+            for host_stats in self._hosts.values():
+                host_stats.decay()
+        stats.requests += 1
+
+        start = now
+        end = start + deadline
+        delay = self.hedge_delay(stats, deadline) if hedge else None
+        tasks = {asyncio.ensure_future(attempt(deadline)): start}
+        last_error: Optional[BaseException] = None
+        hedged = False
+        try:
+            while tasks:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"Upstream deadline of {deadline:.1f}s exceeded")
+                wait_for = remaining
+                if not hedged and delay is not None:
+                    wait_for = max(0.0, min(remaining, start + delay - time.monotonic()))
+                done, _ = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    attempt_start = tasks.pop(task)
+                    if task.cancelled():
+                        # Tentativo cancellato dallo scheduler (preemption): si rinuncia all'intero fetch
+                        raise asyncio.CancelledError()
+                    if task.exception() is None:
+                        result = task.result()
+                        if hedged and attempt_start != start:
+                            stats.hedge_wins += 1
+                        if record(result):
+                            stats.add(time.monotonic() - attempt_start)
+                        return result
+                    last_error = task.exception()
+
+                remaining = end - time.monotonic()
+                fire = hedge and not hedged and remaining > 0 and (
+                    (not tasks and last_error is not None)  # il primo tentativo è fallito: riprova subito
+                    or (not done and delay is not None and time.monotonic() - start >= delay)
+                )
+                if fire:
+                    hedged = True
+                    stats.hedges += 1
+                    logger.debug(f"🪝 Hedging request to {urlparse(url).hostname} after {time.monotonic() - start:.2f}s")
+                    hedge_start = time.monotonic()
+                    tasks[asyncio.ensure_future(attempt(remaining))] = hedge_start
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        busiest = sorted(self._hosts.items(), key=lambda item: len(item[1].samples), reverse=True)[:20]
+        return {
+            "percentile": self.percentile,
+            "max_ratio": self.max_ratio,
+            "per_host": {
+                host: {
+                    "p50_ms": round(s.percentile(50) * 1000, 1) if s.samples else None,
+                    "p95_ms": round(s.percentile(95) * 1000, 1) if s.samples else None,
+                    "samples": len(s.samples),
+                    "hedges_recent": round(s.hedges, 1),
+                    "hedge_wins": s.hedge_wins,
+                }
+                for host, s in busiest
+            },
+        }
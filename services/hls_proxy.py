@@ -17,10 +17,27 @@ import time
 import aiohttp
 from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, ClientPayloadError, ServerDisconnectedError, ClientConnectionError
 from aiohttp_socks import ProxyConnector
+from multidict import CIMultiDict
 
-from config import GLOBAL_PROXIES, TRANSPORT_ROUTES, get_proxy_for_url, get_ssl_setting_for_url, API_PASSWORD, check_password, MPD_MODE
+from config import GLOBAL_PROXIES, TRANSPORT_ROUTES, get_proxy_for_url, get_ssl_setting_for_url, API_PASSWORD, check_password, MPD_MODE, SEGMENT_CACHE_MAX_MB, SEGMENT_CACHE_TTL, MANIFEST_CACHE_TTL_FRACTION, LIVE_POLLER_IDLE_TIMEOUT, SEGMENT_PREFETCH_MAX_AHEAD, HOST_MAX_CONCURRENCY, HOST_QUEUE_SIZE, HOST_QUEUE_TIMEOUT, get_max_conn_for_url, PROXY_PROBE_INTERVAL, PROXY_PROBE_URL, PROXY_FAILURE_THRESHOLD, PROXY_DOWN_COOLDOWN, PROXY_AFFINITY_TTL, DNS_SERVERS, DNS_CACHE_MIN_TTL, DNS_CACHE_MAX_TTL, DNS_CACHE_NEGATIVE_TTL, DNS_PREFETCH_WINDOW, SEGMENT_DEADLINE_FACTOR, SEGMENT_DEADLINE_MIN, SEGMENT_HEDGE_PERCENTILE, SEGMENT_HEDGE_MAX_RATIO, EXTRACTION_CACHE_TTL, EXTRACTION_CACHE_STALE, EXTRACTION_CACHE_TTLS, EXTRACTION_STORE_PATH, TOKEN_REFRESH_FRACTION, TOKEN_REFRESH_MAX_LEAD, TOKEN_VIEWER_IDLE, PREWARM_MAX_CHANNELS, PREWARM_CONCURRENCY, PREWARM_RATE, PLAYLIST_SOURCE_TIMEOUT, PLAYLIST_CACHE_DIR, PLAYLIST_CACHE_MIN_REFRESH, PLAYLIST_CACHE_MAX_MB
 from extractors.generic import GenericHLSExtractor, ExtractorError
+from extractors.registry import EXTRACTOR_REGISTRY
 from services.manifest_rewriter import ManifestRewriter
+from services.segment_cache import SegmentCache, CachedSegment
+from services.manifest_cache import ManifestCache, CachedManifest, parse_media_playlist
+from services.live_poller import LivePlaylistPoller
+from services.segment_prefetcher import SegmentPrefetcher
+from services.hedging import HedgedFetcher
+from services.request_priority import Priority, is_speculative, run_speculative
+from services.token_recovery import AUTH_FAILURE_STATUSES, TokenRecovery, merge_headers
+from services.token_lifecycle import TokenLifecycle
+from services.extraction_cache import ExtractionCache, parse_ttl_overrides
+from services.extraction_store import EXTRACTION_STORE
+from services.extraction_prewarm import ExtractionPrewarmer
+from services.playlist_source_cache import PlaylistSourceCache
+from services.host_limiter import HostConcurrencyGovernor, HostBusyError
+from services.proxy_pool import PROXY_POOL, is_proxy_error
+from services.dns_cache import DNS_RESOLVER, CachedDNSProxyConnector, parse_nameservers
 
 # Legacy MPD converter (used when MPD_MODE=legacy)
 MPDToHLSConverter = None
@@ -36,177 +53,55 @@ if MPD_MODE == "legacy":
         logger.warning(f"⚠️ MPD_MODE=legacy but modules not found: {e}")
 
 # --- Moduli Esterni ---
-VavooExtractor, DLHDExtractor, VixSrcExtractor, PlaylistBuilder, SportsonlineExtractor = None, None, None, None, None
-MixdropExtractor, VoeExtractor, StreamtapeExtractor, OrionExtractor, FreeshotExtractor = None, None, None, None, None
-# New extractors
-DoodStreamExtractor, FastreamExtractor, FileLionsExtractor, FileMoonExtractor, LuluStreamExtractor = None, None, None, None, None
-MaxstreamExtractor, OkruExtractor, StreamWishExtractor, SupervideoExtractor, UqloadExtractor = None, None, None, None, None
-VidmolyExtractor, VidozaExtractor, TurboVidPlayExtractor, LiveTVExtractor, F16PxExtractor = None, None, None, None, None
+# Gli estrattori vengono importati su richiesta da extractors/registry.py al primo URL instradato verso di loro
+PlaylistBuilder = None
 
 logger = logging.getLogger(__name__)
 
-# Importazione condizionale degli estrattori
-try:
-    from extractors.freeshot import FreeshotExtractor
-    logger.info("✅ FreeshotExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ FreeshotExtractor module not found.")
-
-try:
-    from extractors.vavoo import VavooExtractor
-    logger.info("✅ VavooExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ VavooExtractor module not found. Vavoo functionality disabled.")
-
-try:
-    from extractors.dlhd import DLHDExtractor
-    logger.info("✅ DLHDExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ DLHDExtractor module not found. DLHD functionality disabled.")
-
 try:
     from routes.playlist_builder import PlaylistBuilder
     logger.info("✅ PlaylistBuilder module loaded.")
 except ImportError:
     logger.warning("⚠️ PlaylistBuilder module not found. PlaylistBuilder functionality disabled.")
-    
-try:
-    from extractors.vixsrc import VixSrcExtractor
-    logger.info("✅ VixSrcExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ VixSrcExtractor module not found. VixSrc functionality disabled.")
-
-try:
-    from extractors.sportsonline import SportsonlineExtractor
-    logger.info("✅ SportsonlineExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ SportsonlineExtractor module not found. Sportsonline functionality disabled.")
-
-try:
-    from extractors.mixdrop import MixdropExtractor
-    logger.info("✅ MixdropExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ MixdropExtractor module not found.")
-
-try:
-    from extractors.voe import VoeExtractor
-    logger.info("✅ VoeExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ VoeExtractor module not found.")
-
-try:
-    from extractors.streamtape import StreamtapeExtractor
-    logger.info("✅ StreamtapeExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ StreamtapeExtractor module not found.")
-
-try:
-    from extractors.orion import OrionExtractor
-    logger.info("✅ OrionExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ OrionExtractor module not found.")
-
-# --- New Extractors ---
-try:
-    from extractors.doodstream import DoodStreamExtractor
-    logger.info("✅ DoodStreamExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ DoodStreamExtractor module not found.")
-
-try:
-    from extractors.fastream import FastreamExtractor
-    logger.info("✅ FastreamExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ FastreamExtractor module not found.")
-
-try:
-    from extractors.filelions import FileLionsExtractor
-    logger.info("✅ FileLionsExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ FileLionsExtractor module not found.")
-
-try:
-    from extractors.filemoon import FileMoonExtractor
-    logger.info("✅ FileMoonExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ FileMoonExtractor module not found.")
-
-try:
-    from extractors.lulustream import LuluStreamExtractor
-    logger.info("✅ LuluStreamExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ LuluStreamExtractor module not found.")
-
-try:
-    from extractors.maxstream import MaxstreamExtractor
-    logger.info("✅ MaxstreamExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ MaxstreamExtractor module not found.")
-
-try:
-    from extractors.okru import OkruExtractor
-    logger.info("✅ OkruExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ OkruExtractor module not found.")
-
-try:
-    from extractors.streamwish import StreamWishExtractor
-    logger.info("✅ StreamWishExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ StreamWishExtractor module not found.")
-
-try:
-    from extractors.supervideo import SupervideoExtractor
-    logger.info("✅ SupervideoExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ SupervideoExtractor module not found.")
-
-try:
-    from extractors.uqload import UqloadExtractor
-    logger.info("✅ UqloadExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ UqloadExtractor module not found.")
-
-try:
-    from extractors.vidmoly import VidmolyExtractor
-    logger.info("✅ VidmolyExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ VidmolyExtractor module not found.")
-
-try:
-    from extractors.vidoza import VidozaExtractor
-    logger.info("✅ VidozaExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ VidozaExtractor module not found.")
-
-try:
-    from extractors.turbovidplay import TurboVidPlayExtractor
-    logger.info("✅ TurboVidPlayExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ TurboVidPlayExtractor module not found.")
-
-try:
-    from extractors.livetv import LiveTVExtractor
-    logger.info("✅ LiveTVExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ LiveTVExtractor module not found.")
-
-try:
-    from extractors.f16px import F16PxExtractor
-    logger.info("✅ F16PxExtractor module loaded.")
-except ImportError:
-    logger.warning("⚠️ F16PxExtractor module not found.")
 
 class HLSProxy:
     """Proxy HLS per gestire stream Vavoo, DLHD, HLS generici e playlist builder con supporto AES-128"""
     
     def __init__(self, ffmpeg_manager=None):
         self.extractors = {}
+        # id(istanza estrattore) -> nome nel registry (chiave della cache delle estrazioni)
+        self._extractor_names = {}
+        
+        # Store su disco condiviso tra i worker (estrazioni, cache DLHD); configurato prima di caricare gli estrattori
+        EXTRACTION_STORE.configure(path=EXTRACTION_STORE_PATH or None)
+
+        # Cache dei risultati di extract(): TTL per estrattore, single-flight, stale-while-revalidate
+        self.extraction_cache = ExtractionCache(
+            default_ttl=EXTRACTION_CACHE_TTL,
+            stale_window=EXTRACTION_CACHE_STALE,
+            ttl_overrides=parse_ttl_overrides(EXTRACTION_CACHE_TTLS),
+            store=EXTRACTION_STORE
+        )
+        
+        # Pre-warm delle estrazioni per i canali delle playlist generate (/api/prewarm per progresso e cancellazione)
+        self.prewarmer = ExtractionPrewarmer(
+            self._prewarm_channel,
+            max_channels=PREWARM_MAX_CHANNELS,
+            concurrency=PREWARM_CONCURRENCY,
+            rate=PREWARM_RATE
+        )
         self.ffmpeg_manager = ffmpeg_manager
         
         # Inizializza il playlist_builder se il modulo è disponibile
         if PlaylistBuilder:
-            self.playlist_builder = PlaylistBuilder()
+            self.playlist_builder = PlaylistBuilder(
+                source_timeout=PLAYLIST_SOURCE_TIMEOUT,
+                source_cache=PlaylistSourceCache(
+                    PLAYLIST_CACHE_DIR or None,
+                    min_refresh=PLAYLIST_CACHE_MIN_REFRESH,
+                    max_bytes=PLAYLIST_CACHE_MAX_MB * 1024 * 1024
+                )
+            )
             logger.info("✅ PlaylistBuilder inizializzato")
         else:
             self.playlist_builder = None
@@ -214,11 +109,67 @@ class HLSProxy:
         # Cache per segmenti di inizializzazione (URL -> content)
         self.init_cache = {}
         
-        # Cache per segmenti decriptati (URL -> (content, timestamp))
-        self.segment_cache = {}
-        self.segment_cache_ttl = 30  # Seconds
+        # Cache condivisa per segmenti (passthrough, /segment e decriptati) con fetch single-flight
+        self.segment_cache = SegmentCache(
+            max_bytes=SEGMENT_CACHE_MAX_MB * 1024 * 1024,
+            ttl=SEGMENT_CACHE_TTL
+        )
+        
+        # Cache breve dei manifest HLS riscritti (polling live di più viewer sullo stesso canale)
+        self.manifest_cache = ManifestCache(ttl_fraction=MANIFEST_CACHE_TTL_FRACTION)
+        
+        # Poller live-edge per canale: mantiene aggiornato il manifest in cache finché ci sono viewer
+        self.live_poller = LivePlaylistPoller(self.manifest_cache, idle_timeout=LIVE_POLLER_IDLE_TIMEOUT)
+        
+        # Prefetch look-ahead dei segmenti HLS basato sulla lista reale del playlist
+        self.segment_prefetcher = SegmentPrefetcher(self.segment_cache, max_ahead=SEGMENT_PREFETCH_MAX_AHEAD)
+        self.live_poller.add_listener(self.segment_prefetcher.on_new_segments)
+        
+        # Fetch dei segmenti con deadline dal target duration e richiesta "hedged" oltre il p95 dell'host
+        self.segment_hedger = HedgedFetcher(percentile=SEGMENT_HEDGE_PERCENTILE, max_ratio=SEGMENT_HEDGE_MAX_RATIO)
+        
+        # Token scaduti a metà stream (401/403/410): ri-estrazione single-flight del canale e retry trasparente
+        self.token_recovery = TokenRecovery(self._reextract_channel)
+        
+        # Token con scadenza nota: rinnovo in anticipo mentre il canale ha viewer, URL sempre sul token più recente
+        self.token_lifecycle = TokenLifecycle(
+            self._reextract_channel,
+            self.token_recovery,
+            refresh_fraction=TOKEN_REFRESH_FRACTION,
+            max_lead=TOKEN_REFRESH_MAX_LEAD,
+            idle_timeout=TOKEN_VIEWER_IDLE
+        )
+        
+        # Limite di concorrenza AIMD per host upstream (coda limitata + backpressure)
+        self.host_governor = HostConcurrencyGovernor(
+            default_ceiling=HOST_MAX_CONCURRENCY,
+            max_queue=HOST_QUEUE_SIZE,
+            queue_timeout=HOST_QUEUE_TIMEOUT,
+            ceiling_for_url=lambda url: get_max_conn_for_url(url, TRANSPORT_ROUTES),
+            on_release=self._record_proxy_outcome
+        )
+        
+        # Selezione dei proxy globali pesata per latenza/errori (condivisa con gli estrattori)
+        PROXY_POOL.configure(
+            probe_interval=PROXY_PROBE_INTERVAL,
+            probe_url=PROXY_PROBE_URL,
+            failure_threshold=PROXY_FAILURE_THRESHOLD,
+            down_cooldown=PROXY_DOWN_COOLDOWN,
+            affinity_ttl=PROXY_AFFINITY_TTL
+        )
+        PROXY_POOL.register(GLOBAL_PROXIES)
+        
+        # Cache DNS condivisa da tutte le sessioni (TTL, cache negativa, ri-risoluzione degli host caldi)
+        DNS_RESOLVER.configure(
+            min_ttl=DNS_CACHE_MIN_TTL,
+            max_ttl=DNS_CACHE_MAX_TTL,
+            negative_ttl=DNS_CACHE_NEGATIVE_TTL,
+            hot_window=DNS_PREFETCH_WINDOW
+        )
+        if DNS_SERVERS:
+            DNS_RESOLVER.configure(nameservers=parse_nameservers(DNS_SERVERS))
         
-        # Prefetch queue for background downloading
+        # Task di prefetch in background (riferimenti mantenuti per evitare la garbage collection)
         self.prefetch_tasks = set()
         
         # Sessione condivisa per il proxy (no proxy)
@@ -304,7 +255,9 @@ class HLSProxy:
                 limit_per_host=0,  # Unlimited per host
                 keepalive_timeout=60,  # Keep connections alive longer
                 enable_cleanup_closed=True,
-                family=socket.AF_INET  # Force IPv4 to avoid IPv6 issues (e.g. Vavoo promo)
+                family=socket.AF_INET,  # Force IPv4 to avoid IPv6 issues (e.g. Vavoo promo)
+                resolver=DNS_RESOLVER,  # Shared DNS cache (honors record TTLs)
+                use_dns_cache=False
             )
             self.session = aiohttp.ClientSession(
                 timeout=ClientTimeout(total=30),
@@ -312,16 +265,34 @@ class HLSProxy:
             )
         return self.session
 
-    async def _get_proxy_session(self, url: str):
+    @staticmethod
+    def _record_proxy_outcome(slot, error):
+        """
+        Riporta al ProxyPool l'esito di una richiesta upstream passata da un proxy.
+        Contano come guasti del proxy solo errori di connessione/proxy e timeout: gli status HTTP
+        (es. 502/503 di un CDN) sono dell'host upstream e restano al suo HostLimiter.
+        """
+        if not slot.proxy:
+            return
+        latency = slot.latency if slot.latency is not None else time.monotonic() - slot.started_at
+        if error is not None and is_proxy_error(error):
+            PROXY_POOL.record(slot.proxy, latency, ok=False)
+        elif error is None or slot.latency is not None:
+            # Risposta arrivata attraverso il proxy (anche se con errore HTTP o body troncato)
+            PROXY_POOL.record(slot.proxy, latency, ok=True)
+
+    async def _get_proxy_session(self, url: str, affinity_key: str = None):
         """Get a session with proxy support for the given URL.
 
         Sessions are cached and reused for the same proxy to improve performance.
+        With affinity_key (the original channel URL) every request of the same stream
+        goes out through the same global proxy until that proxy fails.
 
         Returns: (session, proxy_url) tuple
         - session: The aiohttp ClientSession to use
         - proxy_url: The proxy URL being used, or None for direct connection
         """
-        proxy = get_proxy_for_url(url, TRANSPORT_ROUTES, GLOBAL_PROXIES)
+        proxy = get_proxy_for_url(url, TRANSPORT_ROUTES, GLOBAL_PROXIES, affinity_key)
 
         if proxy:
             # Check if we have a cached session for this proxy
@@ -338,7 +309,7 @@ class HLSProxy:
             logger.info(f"🌍 Creating proxy session: {proxy}")
             try:
                 # Unlimited connections for maximum speed
-                connector = ProxyConnector.from_url(
+                connector = CachedDNSProxyConnector.from_url(
                     proxy,
                     limit=0,  # Unlimited connections
                     limit_per_host=0,  # Unlimited per host
@@ -350,6 +321,7 @@ class HLSProxy:
                 self.proxy_sessions[proxy] = session  # Cache the session
                 return session, proxy  # Return proxy URL for logging
             except Exception as e:
+                PROXY_POOL.record(proxy, None, ok=False)
                 logger.warning(f"⚠️ Failed to create proxy connector: {e}, falling back to direct")
 
         # Fallback to shared non-proxy session
@@ -358,293 +330,70 @@ class HLSProxy:
 
 
     async def get_extractor(self, url: str, request_headers: dict, host: str = None):
-        """Ottiene l'estrattore appropriato per l'URL"""
+        """Ottiene l'estrattore appropriato per l'URL (vedi extractors/registry.py)"""
         try:
             # 1. Selezione Manuale tramite parametro 'host'
-            if host:
-                host = host.lower()
-                key = host
-
-                if host == "vavoo":
-                    if key not in self.extractors:
-                        self.extractors[key] = VavooExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host in ["dlhd", "daddylive", "daddyhd"]:
-                    key = "dlhd"
-                    if key not in self.extractors:
-                        self.extractors[key] = DLHDExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "vixsrc":
-                    if key not in self.extractors:
-                        self.extractors[key] = VixSrcExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host in ["sportsonline", "sportzonline", "sprtsonline", "sportsnline"]:
-                    key = "sportsonline"
-                    if key not in self.extractors:
-                        self.extractors[key] = SportsonlineExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "mixdrop":
-                    if key not in self.extractors:
-                        self.extractors[key] = MixdropExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "voe":
-                    if key not in self.extractors:
-                        self.extractors[key] = VoeExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "streamtape":
-                    if key not in self.extractors:
-                        self.extractors[key] = StreamtapeExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "orion":
-                    if key not in self.extractors:
-                        self.extractors[key] = OrionExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "freeshot":
-                    if key not in self.extractors:
-                        self.extractors[key] = FreeshotExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                # --- New Extractors (host selection) ---
-                elif host in ["doodstream", "dood", "d000d"]:
-                    key = "doodstream"
-                    if key not in self.extractors:
-                        self.extractors[key] = DoodStreamExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "fastream":
-                    if key not in self.extractors:
-                        self.extractors[key] = FastreamExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "filelions":
-                    if key not in self.extractors:
-                        self.extractors[key] = FileLionsExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "filemoon":
-                    if key not in self.extractors:
-                        self.extractors[key] = FileMoonExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "lulustream":
-                    if key not in self.extractors:
-                        self.extractors[key] = LuluStreamExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "maxstream":
-                    if key not in self.extractors:
-                        self.extractors[key] = MaxstreamExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host in ["okru", "ok.ru"]:
-                    key = "okru"
-                    if key not in self.extractors:
-                        self.extractors[key] = OkruExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "streamwish":
-                    if key not in self.extractors:
-                        self.extractors[key] = StreamWishExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "supervideo":
-                    if key not in self.extractors:
-                        self.extractors[key] = SupervideoExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "uqload":
-                    if key not in self.extractors:
-                        self.extractors[key] = UqloadExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "vidmoly":
-                    if key not in self.extractors:
-                        self.extractors[key] = VidmolyExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host in ["vidoza", "videzz"]:
-                    key = "vidoza"
-                    if key not in self.extractors:
-                        self.extractors[key] = VidozaExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host in ["turbovidplay", "turboviplay", "emturbovid"]:
-                    key = "turbovidplay"
-                    if key not in self.extractors:
-                        self.extractors[key] = TurboVidPlayExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "livetv":
-                    if key not in self.extractors:
-                        self.extractors[key] = LiveTVExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                    return self.extractors[key]
-                elif host == "f16px":
+            spec = EXTRACTOR_REGISTRY.by_alias(host) if host else None
+            if spec is not None:
+                proxy_list = GLOBAL_PROXIES
+            else:
+                # 2. Auto-detection basata sull'URL
+                spec = EXTRACTOR_REGISTRY.match(url)
+                if spec is None:
+                    # ✅ MODIFICATO: Fallback al GenericHLSExtractor per qualsiasi altro URL.
+                    # Questo permette di gestire estensioni sconosciute o URL senza estensione.
+                    key = "hls_generic"
                     if key not in self.extractors:
-                        self.extractors[key] = F16PxExtractor(request_headers, proxies=GLOBAL_PROXIES)
+                        self.extractors[key] = GenericHLSExtractor(request_headers, proxies=GLOBAL_PROXIES)
+                        self._extractor_names[id(self.extractors[key])] = key
                     return self.extractors[key]
-
-            # 2. Auto-detection basata sull'URL
-            if "vavoo.to" in url:
-                key = "vavoo"
-                proxy = get_proxy_for_url('vavoo.to', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = VavooExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif any(domain in url for domain in ["daddylive", "dlhd", "daddyhd", "dlstreams.top"]) or re.search(r'watch\.php\?id=\d+', url):
-                key = "dlhd"
-                # ✅ Support for new domain 'dlstreams.top' and improved proxy selection
-                domain_to_check = 'dlstreams.top' if 'dlstreams.top' in url else 'dlhd.dad'
-                proxy = get_proxy_for_url(domain_to_check, TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = DLHDExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif 'vixsrc.to/' in url.lower() and any(x in url for x in ['/movie/', '/tv/', '/iframe/']):
-                key = "vixsrc"
-                proxy = get_proxy_for_url('vixsrc.to', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = VixSrcExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif any(domain in url for domain in ["sportzonline", "sportsonline", "sprtsonline", "sportsnline"]):
-                key = "sportsonline"
-                proxy = get_proxy_for_url('sportsonline', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = SportsonlineExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "mixdrop" in url:
-                key = "mixdrop"
-                proxy = get_proxy_for_url('mixdrop', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = MixdropExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif any(d in url for d in ["voe.sx", "voe.to", "voe.st", "voe.eu", "voe.la", "voe-network.net"]):
-                key = "voe"
-                proxy = get_proxy_for_url('voe.sx', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = VoeExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "popcdn.day" in url:
-                key = "freeshot"
-                proxy = get_proxy_for_url('popcdn.day', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = FreeshotExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "streamtape.com" in url or "streamtape.to" in url or "streamtape.net" in url:
-                key = "streamtape"
-                proxy = get_proxy_for_url('streamtape', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = StreamtapeExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "orionoid.com" in url:
-                key = "orion"
-                proxy = get_proxy_for_url('orionoid.com', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = OrionExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            # --- New Extractors (URL auto-detection) ---
-            elif any(d in url for d in ["doodstream", "d000d.com", "dood.wf", "dood.cx", "dood.la", "dood.so", "dood.pm"]):
-                key = "doodstream"
-                proxy = get_proxy_for_url('doodstream', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = DoodStreamExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "fastream" in url:
-                key = "fastream"
-                proxy = get_proxy_for_url('fastream', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = FastreamExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "filelions" in url:
-                key = "filelions"
-                proxy = get_proxy_for_url('filelions', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = FileLionsExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "filemoon" in url:
-                key = "filemoon"
-                proxy = get_proxy_for_url('filemoon', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = FileMoonExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "lulustream" in url:
-                key = "lulustream"
-                proxy = get_proxy_for_url('lulustream', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = LuluStreamExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "maxstream" in url or "uprot.net" in url:
-                key = "maxstream"
-                proxy = get_proxy_for_url('maxstream', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = MaxstreamExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "ok.ru" in url or "odnoklassniki" in url:
-                key = "okru"
-                proxy = get_proxy_for_url('ok.ru', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = OkruExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif any(d in url for d in ["streamwish", "swish", "wishfast", "embedwish", "wishembed"]):
-                key = "streamwish"
-                proxy = get_proxy_for_url('streamwish', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = StreamWishExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "supervideo" in url:
-                key = "supervideo"
-                proxy = get_proxy_for_url('supervideo', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = SupervideoExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "uqload" in url and not any(url.endswith(ext) or f"{ext}?" in url for ext in (".mp4", ".m3u8", ".ts", ".mkv", ".avi", ".mpd")):
-                # Only match embed pages (e.g. uqload.is/abc123.html), not CDN video URLs (m80.uqload.is/.../v.mp4)
-                key = "uqload"
-                proxy = get_proxy_for_url('uqload', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = UqloadExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "vidmoly" in url:
-                key = "vidmoly"
-                proxy = get_proxy_for_url('vidmoly', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = VidmolyExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "vidoza" in url or "videzz" in url:
-                key = "vidoza"
-                proxy = get_proxy_for_url('vidoza', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = VidozaExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif any(d in url for d in ["turboviplay", "emturbovid", "tuborstb", "javggvideo", "stbturbo", "turbovidhls"]):
-                key = "turbovidplay"
-                proxy = get_proxy_for_url('turbovidplay', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = TurboVidPlayExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            elif "/e/" in url and any(d in url for d in ["f16px", "embedme", "embedsb", "playersb"]):
-                key = "f16px"
-                proxy = get_proxy_for_url('f16px', TRANSPORT_ROUTES, GLOBAL_PROXIES)
-                proxy_list = [proxy] if proxy else []
-                if key not in self.extractors:
-                    self.extractors[key] = F16PxExtractor(request_headers, proxies=proxy_list)
-                return self.extractors[key]
-            else:
-                # ✅ MODIFICATO: Fallback al GenericHLSExtractor per qualsiasi altro URL.
-                # Questo permette di gestire estensioni sconosciute o URL senza estensione.
-                key = "hls_generic"
-                if key not in self.extractors:
-                    self.extractors[key] = GenericHLSExtractor(request_headers, proxies=GLOBAL_PROXIES)
-                return self.extractors[key]
-        except (NameError, TypeError) as e:
+                proxy_list = None
+
+            key = spec.name
+            if key not in self.extractors:
+                if proxy_list is None:
+                    proxy = get_proxy_for_url(spec.proxy_domain_for(url), TRANSPORT_ROUTES, GLOBAL_PROXIES)
+                    proxy_list = [proxy] if proxy else []
+                self.extractors[key] = spec.load()(request_headers, proxies=proxy_list)
+                self._extractor_names[id(self.extractors[key])] = key
+            return self.extractors[key]
+        except (ImportError, AttributeError, TypeError) as e:
             raise ExtractorError(f"Extractor not available - module missing: {e}")
 
+    async def _extract(self, extractor, url: str, force_refresh: bool = False) -> dict:
+        """extractor.extract() passando dalla cache delle estrazioni (force_refresh la scavalca)."""
+        name = self._extractor_names.get(id(extractor), type(extractor).__name__)
+        spec = EXTRACTOR_REGISTRY.get(name)
+        # GenericHLSExtractor non fa richieste e dipende dagli header della singola richiesta: niente cache
+        ttl = self.extraction_cache.ttl_for(name, spec.cache_ttl if spec is not None else 0)
+        result, _ = await self.extraction_cache.get_or_extract(
+            name, url, lambda: extractor.extract(url, force_refresh=force_refresh), ttl=ttl, force=force_refresh
+        )
+        # Token legati all'IP: manifest, chiavi e segmenti del canale escono dal proxy usato per l'estrazione
+        PROXY_POOL.bind(url, getattr(extractor, 'session_proxy', None))
+        return result
+
+    def _invalidate_extraction(self, extractor, url: str):
+        self.extraction_cache.invalidate(self._extractor_names.get(id(extractor), type(extractor).__name__), url)
+
+    async def _prewarm_channel(self, url: str) -> bool:
+        """Estrazione anticipata di un canale nella cache delle estrazioni (False se non c'è nulla da estrarre)."""
+        extractor = await self.get_extractor(url, {})
+        name = self._extractor_names.get(id(extractor))
+        spec = EXTRACTOR_REGISTRY.get(name)
+        if spec is None or self.extraction_cache.ttl_for(name, spec.cache_ttl) <= 0:
+            return False
+        # Priorità BACKGROUND: le estrazioni anticipate non tolgono slot verso l'host alle richieste dei client
+        await run_speculative(Priority.BACKGROUND, lambda: self._extract(extractor, url))
+        return True
+
+    async def _reextract_channel(self, channel_url: str) -> dict:
+        """Estrazione forzata di un canale (usata da TokenRecovery quando un token scade)."""
+        extractor = await self.get_extractor(channel_url, {})
+        if hasattr(extractor, 'invalidate_cache_for_url'):
+            await extractor.invalidate_cache_for_url(channel_url)
+        return await self._extract(extractor, channel_url, force_refresh=True)
+
     async def handle_proxy_request(self, request):
         """Gestisce le richieste proxy principali"""
         if not check_password(request):
@@ -666,6 +415,16 @@ class HLSProxy:
             except:
                 pass
             
+            # Sub-manifest di un canale: richiesto con il token più recente (rinnovato in anticipo)
+            channel_url = request.query.get('original_channel_url')
+            # Chiave di affinità del proxy: tutte le richieste dello stream escono dallo stesso proxy
+            stream_key = channel_url or target_url
+            if channel_url and channel_url != target_url:
+                self.token_lifecycle.touch(channel_url)
+                target_url = self.token_lifecycle.fresh_url(channel_url, target_url)
+            else:
+                self.prewarmer.record_request(target_url)
+            
             # ✅ FIX: Extract h_ headers from query params BEFORE calling get_extractor
             # This ensures GenericHLSExtractor receives the correct Referer/Origin from h_ params
             # instead of generating them based on the segment's domain.
@@ -676,21 +435,22 @@ class HLSProxy:
                     combined_headers[header_name] = param_value
             
             # DEBUG LOGGING    
-            print(f"🔍 [DEBUG] Processing URL: {target_url}")
-            print(f"   Headers: {dict(request.headers)}")
+            logger.debug(f"🔍 Processing URL: {target_url}")
+            logger.debug(f"   Headers: {dict(request.headers)}")
             
             extractor = await self.get_extractor(target_url, combined_headers)
             
-            print(f"   Extractor: {type(extractor).__name__}")
+            logger.debug(f"   Extractor: {type(extractor).__name__}")
             
             try:
                 # Passa il flag force_refresh all'estrattore
-                result = await extractor.extract(target_url, force_refresh=force_refresh)
+                result = await self._extract(extractor, target_url, force_refresh=force_refresh)
                 stream_url = result["destination_url"]
                 stream_headers = result.get("request_headers", {})
+                self.token_lifecycle.track(target_url, result)
 
-                print(f"   Resolved Stream URL: {stream_url}")
-                print(f"   Stream Headers: {stream_headers}")
+                logger.debug(f"   Resolved Stream URL: {stream_url}")
+                logger.debug(f"   Stream Headers: {stream_headers}")
                 
                 # Se redirect_stream è False, restituisci il JSON con i dettagli (stile MediaFlow)
                 if not redirect_stream:
@@ -828,7 +588,7 @@ class HLSProxy:
                             ssl_context = False
                         
                         # Use helper to get proxy-enabled session
-                        mpd_session, mpd_proxy = await self._get_proxy_session(stream_url)
+                        mpd_session, mpd_proxy = await self._get_proxy_session(stream_url, stream_key)
                         if mpd_proxy:
                             logger.info(f"📡 [MPD] Using session via proxy: {mpd_proxy}")
                         final_mpd_url = stream_url  # Will be updated if redirected
@@ -864,6 +624,9 @@ class HLSProxy:
                         if api_password:
                             params += f"&api_password={api_password}"
                         
+                        # Playlist, segmenti e decrypt restano legati al proxy dello stream
+                        params += f"&original_channel_url={urllib.parse.quote(stream_key, safe='')}"
+                        
                         # Get ClearKey param
                         clearkey_param = request.query.get('clearkey')
                         if not clearkey_param:
@@ -931,9 +694,10 @@ class HLSProxy:
                 return await self._proxy_stream(request, stream_url, stream_headers)
             except ExtractorError as e:
                 logger.warning(f"Extraction failed, retrying with forced refresh: {e}")
-                result = await extractor.extract(target_url, force_refresh=True) # Forza sempre il refresh al secondo tentativo
+                result = await self._extract(extractor, target_url, force_refresh=True) # Forza sempre il refresh al secondo tentativo
                 stream_url = result["destination_url"]
                 stream_headers = result.get("request_headers", {})
+                self.token_lifecycle.track(target_url, result)
                 # Stream URL resolved after refresh
                 return await self._proxy_stream(request, stream_url, stream_headers)
             
@@ -943,9 +707,9 @@ class HLSProxy:
             is_temporary_error = any(x in error_msg for x in ['403', 'forbidden', '502', 'bad gateway', 'timeout', 'connection', 'temporarily unavailable'])
             
             extractor_name = "unknown"
-            if DLHDExtractor and isinstance(extractor, DLHDExtractor):
+            if EXTRACTOR_REGISTRY.is_instance(extractor, "dlhd"):
                 extractor_name = "DLHDExtractor"
-            elif VavooExtractor and isinstance(extractor, VavooExtractor):
+            elif EXTRACTOR_REGISTRY.is_instance(extractor, "vavoo"):
                 extractor_name = "VavooExtractor"
 
             # Se è un errore temporaneo (sito offline), logga solo un WARNING senza traceback
@@ -1028,7 +792,7 @@ class HLSProxy:
             logger.info(f"🔍 Extracting: {url} (Host: {host_param}, Redirect: {redirect_stream})")
 
             extractor = await self.get_extractor(url, dict(request.headers), host=host_param)
-            result = await extractor.extract(url)
+            result = await self._extract(extractor, url)
             
             stream_url = result["destination_url"]
             stream_headers = result.get("request_headers", {})
@@ -1161,7 +925,7 @@ class HLSProxy:
             logger.info(f"🔐 Proxying License Request to: {license_url}")
 
             # ✅ Use pooled session for better performance
-            session, _ = await self._get_proxy_session(license_url)
+            session, _ = await self._get_proxy_session(license_url, request.query.get('original_channel_url'))
             async with session.request(
                     request.method,
                     license_url,
@@ -1235,63 +999,87 @@ class HLSProxy:
             logger.info(f"🔑 Fetching AES key from: {key_url}")
             logger.info(f"   -> with headers: {headers}")
 
-            # ✅ Use pooled session for better performance
-            # The session already has the proxy configured in its connector
-            session, proxy_used = await self._get_proxy_session(key_url)
-            if proxy_used:
-                logger.info(f"Using pooled session with proxy: {proxy_used}")
+            channel_url = request.query.get('original_channel_url')
+            self.token_lifecycle.touch(channel_url)
+            key_url = self.token_lifecycle.fresh_url(channel_url, key_url)
             secret_key = headers.pop('X-Secret-Key', None)
+            recovered = False
+
+            # Secondo giro solo se il token è scaduto: URL e header vengono dalla ri-estrazione del canale
+            for attempt in range(2):
+                # ✅ Use pooled session for better performance
+                # The session already has the proxy configured in its connector
+                session, proxy_used = await self._get_proxy_session(key_url, channel_url)
+                if proxy_used:
+                    logger.info(f"Using pooled session with proxy: {proxy_used}")
+
+                # Calcola X-Key-Timestamp, X-Key-Nonce, X-Fingerprint, e X-Key-Path se abbiamo la secret_key
+                if secret_key and '/key/' in key_url:
+                    # Get user agent from X-User-Agent header or fall back to User-Agent
+                    user_agent = headers.get('X-User-Agent') or headers.get('User-Agent') or headers.get('user-agent')
+                    nonce_result = self._compute_key_headers(key_url, secret_key, user_agent)
+                    if nonce_result:
+                        ts, nonce, fingerprint, key_path = nonce_result
+                        headers['X-Key-Timestamp'] = str(ts)
+                        headers['X-Key-Nonce'] = str(nonce)
+                        headers['X-Fingerprint'] = fingerprint
+                        headers['X-Key-Path'] = key_path
+                        logger.info(f"🔐 Computed key headers: ts={ts}, nonce={nonce}, fingerprint={fingerprint}, key_path={key_path}")
+                    else:
+                        logger.warning(f"⚠️ Could not compute key headers for {key_url}")
+
+                # Caso 'auth' - URL che contengono 'auth' richiedono headers speciali
+                if 'auth' in key_url.lower():
+                    logger.info(f"🔐 Detected 'auth' key URL, ensuring special headers are present")
+                    if 'X-User-Agent' not in headers:
+                        headers['X-User-Agent'] = headers.get('User-Agent', headers.get('user-agent', 'Mozilla/5.0'))
+                    logger.info(f"🔐 Auth key headers: Authorization={'***' if headers.get('Authorization') else 'missing'}, X-Channel-Key={headers.get('X-Channel-Key', 'missing')}, X-User-Agent={headers.get('X-User-Agent', 'missing')}")
+
+                async with self.host_governor.slot(key_url, proxy_used, Priority.KEY) as slot:
+                    async with session.get(key_url, headers=headers) as resp:
+                        slot.record_status(resp.status)
+                        if resp.status == 200 or resp.status == 206:
+                            key_data = await resp.read()
+                            logger.info(f"✅ AES key fetched successfully: {len(key_data)} bytes")
 
-            # Calcola X-Key-Timestamp, X-Key-Nonce, X-Fingerprint, e X-Key-Path se abbiamo la secret_key
-            if secret_key and '/key/' in key_url:
-                # Get user agent from X-User-Agent header or fall back to User-Agent
-                user_agent = headers.get('X-User-Agent') or headers.get('User-Agent') or headers.get('user-agent')
-                nonce_result = self._compute_key_headers(key_url, secret_key, user_agent)
-                if nonce_result:
-                    ts, nonce, fingerprint, key_path = nonce_result
-                    headers['X-Key-Timestamp'] = str(ts)
-                    headers['X-Key-Nonce'] = str(nonce)
-                    headers['X-Fingerprint'] = fingerprint
-                    headers['X-Key-Path'] = key_path
-                    logger.info(f"🔐 Computed key headers: ts={ts}, nonce={nonce}, fingerprint={fingerprint}, key_path={key_path}")
-                else:
-                    logger.warning(f"⚠️ Could not compute key headers for {key_url}")
-
-            # Caso 'auth' - URL che contengono 'auth' richiedono headers speciali
-            if 'auth' in key_url.lower():
-                logger.info(f"🔐 Detected 'auth' key URL, ensuring special headers are present")
-                if 'X-User-Agent' not in headers:
-                    headers['X-User-Agent'] = headers.get('User-Agent', headers.get('user-agent', 'Mozilla/5.0'))
-                logger.info(f"🔐 Auth key headers: Authorization={'***' if headers.get('Authorization') else 'missing'}, X-Channel-Key={headers.get('X-Channel-Key', 'missing')}, X-User-Agent={headers.get('X-User-Agent', 'missing')}")
-
-            async with session.get(key_url, headers=headers) as resp:
-                if resp.status == 200 or resp.status == 206:
-                    key_data = await resp.read()
-                    logger.info(f"✅ AES key fetched successfully: {len(key_data)} bytes")
-                    
-                    return web.Response(
-                        body=key_data,
-                        content_type="application/octet-stream",
-                        headers={
-                            "Access-Control-Allow-Origin": "*",
-                            "Access-Control-Allow-Headers": "*",
-                            "Cache-Control": "no-cache, no-store, must-revalidate"
-                        }
-                    )
-                else:
-                    logger.error(f"❌ Key fetch failed with status: {resp.status}")
-                    # --- LOGICA DI INVALIDAZIONE AUTOMATICA ---
-                    try:
-                        url_param = request.query.get('original_channel_url')
-                        if url_param:
-                            extractor = await self.get_extractor(url_param, {})
-                            if hasattr(extractor, 'invalidate_cache_for_url'):
-                                await extractor.invalidate_cache_for_url(url_param)
-                    except Exception as cache_e:
-                        logger.error(f"⚠️ Error during automatic cache invalidation: {cache_e}")
-                    # --- FINE LOGICA ---
-                    return web.Response(text=f"Key fetch failed: {resp.status}", status=resp.status)
-                        
+                            return web.Response(
+                                body=key_data,
+                                content_type="application/octet-stream",
+                                headers={
+                                    "Access-Control-Allow-Origin": "*",
+                                    "Access-Control-Allow-Headers": "*",
+                                    "Cache-Control": "no-cache, no-store, must-revalidate"
+                                }
+                            )
+                        key_status = resp.status
+
+                if attempt or key_status not in AUTH_FAILURE_STATUSES or not channel_url:
+                    break
+                refreshed = await self.token_recovery.recover(channel_url, key_url)
+                if refreshed is None:
+                    break
+                recovered = True
+                logger.info(f"🔄 Key token expired ({key_status}), retrying with refreshed URL")
+                key_url, fresh_headers = refreshed
+                merge_headers(headers, fresh_headers)
+                secret_key = headers.pop('X-Secret-Key', secret_key)
+
+            logger.error(f"❌ Key fetch failed with status: {key_status}")
+            # --- LOGICA DI INVALIDAZIONE AUTOMATICA ---
+            try:
+                if channel_url and not recovered:
+                    extractor = await self.get_extractor(channel_url, {})
+                    self._invalidate_extraction(extractor, channel_url)
+                    if hasattr(extractor, 'invalidate_cache_for_url'):
+                        await extractor.invalidate_cache_for_url(channel_url)
+            except Exception as cache_e:
+                logger.error(f"⚠️ Error during automatic cache invalidation: {cache_e}")
+            # --- FINE LOGICA ---
+            return web.Response(text=f"Key fetch failed: {key_status}", status=key_status)
+
+        except HostBusyError as e:
+            logger.warning(f"🚦 {e}")
+            return web.Response(text=str(e), status=503, headers={'Retry-After': '1', 'Access-Control-Allow-Origin': '*'})
         except Exception as e:
             logger.error(f"❌ Error fetching AES key: {str(e)}")
             return web.Response(text=f"Key error: {str(e)}", status=500)
@@ -1322,13 +1110,196 @@ class HLSProxy:
             return await self._proxy_segment(request, segment_url, {
                 "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
                 "referer": base_url
-            }, segment_name)
+            }, segment_name, request.query.get('original_channel_url'))
             
         except Exception as e:
             logger.error(f"Error in .ts segment proxy: {str(e)}")
             return web.Response(text=f"Segment error: {str(e)}", status=500)
 
-    async def _proxy_segment(self, request, segment_url, stream_headers, segment_name):
+    async def handle_segment_request(self, request):
+        """
+        Fast path per /proxy/hls/segment.{ts,m4s,mp4}.
+
+        I segmenti non hanno bisogno di estrazione: decodifica `d` e gli h_ params una sola
+        volta e va direttamente alla sessione upstream in pool (passando per la segment cache).
+        """
+        if not check_password(request):
+            return web.Response(status=401, text="Unauthorized: Invalid API Password")
+
+        segment_url = request.query.get('d') or request.query.get('url')
+        if not segment_url:
+            return web.Response(text="Missing 'url' or 'd' parameter", status=400)
+        segment_url = urllib.parse.unquote(segment_url)
+
+        headers = self._build_segment_headers(request, segment_url)
+        force_ts = request.path.endswith('.ts') or segment_url.endswith('.ts')
+
+        channel_url = request.query.get('original_channel_url')
+        # Token a breve scadenza: il segmento viene chiesto con il token più recente del canale
+        self.token_lifecycle.touch(channel_url)
+        segment_url = self.token_lifecycle.fresh_url(channel_url, segment_url)
+        try:
+            disable_ssl = get_ssl_setting_for_url(segment_url, TRANSPORT_ROUTES)
+            session, proxy = await self._get_proxy_session(segment_url, channel_url)
+
+            if not any(h in headers for h in self._CONDITIONAL_HEADERS):
+                segment, from_cache = await self.segment_cache.get_or_fetch(
+                    segment_url, lambda: self._fetch_segment(session, segment_url, headers, ssl=not disable_ssl, proxy=proxy)
+                )
+                if segment.status in AUTH_FAILURE_STATUSES and channel_url:
+                    # Token scaduto: URL riscritto sulla nuova estrazione del canale, il player non se ne accorge
+                    recovered = await self.token_recovery.recover(channel_url, segment_url)
+                    if recovered is not None:
+                        logger.info(f"🔄 Segment token expired ({segment.status}), retrying with refreshed URL")
+                        segment_url, fresh_headers = recovered
+                        merge_headers(headers, fresh_headers)
+                        disable_ssl = get_ssl_setting_for_url(segment_url, TRANSPORT_ROUTES)
+                        session, proxy = await self._get_proxy_session(segment_url, channel_url)
+                        segment, from_cache = await self.segment_cache.get_or_fetch(
+                            segment_url, lambda: self._fetch_segment(session, segment_url, headers, ssl=not disable_ssl, proxy=proxy)
+                        )
+                if segment.status == 200 and SEGMENT_PREFETCH_MAX_AHEAD > 0:
+                    self.segment_prefetcher.after_segment(
+                        segment_url, lambda u: (lambda: self._fetch_segment(session, u, headers, ssl=not disable_ssl, proxy=proxy))
+                    )
+                if not segment.oversized:
+                    extra_headers = {}
+                    if force_ts and 'video/mp2t' not in segment.headers.get('content-type', '').lower():
+                        extra_headers['Content-Type'] = 'video/MP2T'
+                    return self._cached_segment_response(segment, from_cache, extra_headers)
+
+            # Range/conditional o corpo troppo grande per la cache: streaming diretto
+            return await self._stream_segment(request, session, segment_url, headers, not disable_ssl, force_ts)
+
+        except HostBusyError as e:
+            logger.warning(f"🚦 {e}")
+            return web.Response(text=str(e), status=503, headers={'Retry-After': '1', 'Access-Control-Allow-Origin': '*'})
+        except (ClientPayloadError, ConnectionResetError) as e:
+            logger.info(f"ℹ️ Client disconnected from segment: {segment_url} ({str(e)})")
+            return web.Response(text="Client disconnected", status=499)
+        except (ServerDisconnectedError, ClientConnectionError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ Connection lost with source: {segment_url} ({str(e)})")
+            return web.Response(text=f"Upstream connection lost: {str(e)}", status=502)
+        except Exception as e:
+            logger.error(f"❌ Generic error in segment proxy: {str(e)}")
+            return web.Response(text=f"Segment error: {str(e)}", status=500)
+
+    # Header del client che rendono la risposta specifica per la singola richiesta (no cache condivisa)
+    _CONDITIONAL_HEADERS = ('Range', 'If-None-Match', 'If-Modified-Since')
+
+    def _build_segment_headers(self, request, segment_url: str) -> CIMultiDict:
+        """
+        Header upstream per un segmento: stessa semantica di GenericHLSExtractor + _proxy_stream
+        (User-Agent di default, Referer/Origin dal dominio se mancanti, h_ params con priorità).
+        Lo User-Agent (h_user-agent, altrimenti quello del client) sostituisce il default solo se è
+        di un browser (Chrome/AppleWebKit): quello di un player (es. "Player (Linux; Android 13)") no.
+        """
+        headers = CIMultiDict()
+        headers['User-Agent'] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+
+        # Header sicuri inoltrati dal client (mai quelli che rivelano l'IP)
+        for header in ('Authorization', 'X-Api-Key', 'X-Auth-Token', 'Cookie', 'Referer', 'Origin', 'X-Channel-Key'):
+            value = request.headers.get(header)
+            if value is not None:
+                headers[header] = value
+
+        user_agent = request.headers.get('User-Agent')
+        for param_name, param_value in request.query.items():
+            if param_name.startswith('h_'):
+                if param_name[2:].lower() == 'user-agent':
+                    user_agent = param_value
+                    continue
+                headers[param_name[2:]] = param_value
+        if user_agent and ('chrome' in user_agent.lower() or 'applewebkit' in user_agent.lower()):
+            headers['User-Agent'] = user_agent
+
+        if 'Referer' not in headers or 'Origin' not in headers:
+            parsed_url = urlparse(segment_url)
+            origin = f"{parsed_url.scheme}://{parsed_url.netloc}"
+            headers.setdefault('Referer', origin)
+            headers.setdefault('Origin', origin)
+
+        for header in self._CONDITIONAL_HEADERS:
+            value = request.headers.get(header)
+            if value is not None:
+                headers[header] = value
+
+        return headers
+
+    async def _stream_segment(self, request, session, segment_url: str, headers, ssl, force_ts: bool):
+        """Streaming diretto di un segmento senza passare dalla cache (Range, conditional, file grandi)."""
+        async with session.get(segment_url, headers=headers, ssl=ssl) as resp:
+            response_headers = CIMultiDict()
+            for header in ['content-type', 'content-length', 'content-range',
+                           'accept-ranges', 'last-modified', 'etag']:
+                if header in resp.headers:
+                    response_headers[header] = resp.headers[header]
+
+            if force_ts and 'video/mp2t' not in response_headers.get('content-type', '').lower():
+                response_headers['Content-Type'] = 'video/MP2T'
+            response_headers['Access-Control-Allow-Origin'] = '*'
+            response_headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
+            response_headers['Access-Control-Allow-Headers'] = 'Range, Content-Type'
+
+            response = web.StreamResponse(status=resp.status, headers=response_headers)
+            await response.prepare(request)
+
+            async for chunk in resp.content.iter_chunked(65536):
+                await response.write(chunk)
+
+            await response.write_eof()
+            return response
+
+    def _segment_deadline(self, url: str) -> float:
+        """Tempo massimo per scaricare un segmento: proporzionale al target duration del suo playlist."""
+        target_duration = self.segment_prefetcher.target_duration_for(url)
+        if target_duration is None:
+            return 30.0
+        return min(30.0, max(SEGMENT_DEADLINE_MIN, SEGMENT_DEADLINE_FACTOR * target_duration))
+
+    async def _fetch_segment(self, session, url: str, headers: dict, ssl=None, proxy: str = None) -> CachedSegment:
+        """Scarica un segmento completo dall'upstream (usato come fetcher della segment cache)."""
+        return await self.segment_hedger.fetch(
+            url,
+            lambda timeout: self._fetch_segment_once(session, url, headers, ssl, proxy, timeout),
+            self._segment_deadline(url),
+            record=lambda segment: segment.status == 200 and not segment.oversized,
+            hedge=not is_speculative()
+        )
+
+    async def _fetch_segment_once(self, session, url: str, headers: dict, ssl, proxy: str, timeout: float) -> CachedSegment:
+        """Un singolo tentativo di fetch (l'hedging ne può avere due in volo su connessioni diverse)."""
+        start = time.monotonic()
+        async with self.host_governor.slot(url, proxy) as slot:
+            async with session.get(url, headers=headers, ssl=ssl, timeout=ClientTimeout(total=timeout)) as resp:
+                slot.record_status(resp.status)
+                kept_headers = {}
+                for header in ['content-type', 'last-modified', 'etag']:
+                    if header in resp.headers:
+                        kept_headers[header] = resp.headers[header]
+
+                # Corpo troppo grande per la cache: non leggerlo, il chiamante farà streaming
+                if resp.status == 200 and (resp.content_length or 0) > self.segment_cache.max_entry_bytes:
+                    return CachedSegment(b"", status=resp.status, headers=kept_headers, oversized=True)
+
+                body = await resp.read()
+                if resp.status == 200:
+                    self.segment_prefetcher.record_fetch(url, time.monotonic() - start)
+                return CachedSegment(body, status=resp.status, headers=kept_headers)
+
+    def _cached_segment_response(self, segment: CachedSegment, from_cache: bool, extra_headers: dict = None) -> web.Response:
+        """Costruisce la risposta al client per un segmento servito dalla segment cache."""
+        response_headers = CIMultiDict(segment.headers)
+        if extra_headers:
+            for header, value in extra_headers.items():
+                response_headers[header] = value
+        response_headers['Access-Control-Allow-Origin'] = '*'
+        response_headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
+        response_headers['Access-Control-Allow-Headers'] = 'Range, Content-Type'
+        response_headers['X-Cache'] = 'HIT' if from_cache else 'MISS'
+        return web.Response(body=segment.body, status=segment.status, headers=response_headers)
+
+    async def _proxy_segment(self, request, segment_url, stream_headers, segment_name, affinity_key=None):
         """✅ NUOVO: Proxy dedicato per segmenti .ts con Content-Disposition"""
         try:
             headers = dict(stream_headers)
@@ -1339,7 +1310,19 @@ class HLSProxy:
                     headers[header] = request.headers[header]
             
             # ✅ Use pooled session for better performance
-            session, _ = await self._get_proxy_session(segment_url)
+            session, proxy = await self._get_proxy_session(segment_url, affinity_key)
+
+            # Richieste complete (senza Range/conditional) passano dalla segment cache condivisa
+            if not any(h.lower() in headers for h in self._CONDITIONAL_HEADERS):
+                segment, from_cache = await self.segment_cache.get_or_fetch(
+                    segment_url, lambda: self._fetch_segment(session, segment_url, headers, proxy=proxy)
+                )
+                if not segment.oversized:
+                    return self._cached_segment_response(segment, from_cache, {
+                        'Content-Type': 'video/MP2T',
+                        'Content-Disposition': f'attachment; filename="{segment_name}"'
+                    })
+
             async with session.get(segment_url, headers=headers) as resp:
                     response_headers = {}
                     
@@ -1368,10 +1351,83 @@ class HLSProxy:
                     await response.write_eof()
                     return response
                     
+        except HostBusyError as e:
+            # Coda dell'host piena: il player deve riprovare tra poco, non trattarlo come errore fatale
+            logger.warning(f"🚦 {e}")
+            return web.Response(text=str(e), status=503, headers={'Retry-After': '1', 'Access-Control-Allow-Origin': '*'})
         except Exception as e:
             logger.error(f"Error in segment proxy: {str(e)}")
             return web.Response(text=f"Segment error: {str(e)}", status=500)
 
+    @staticmethod
+    def _is_hls_manifest_response(stream_url: str, content_type: str) -> bool:
+        return ('mpegurl' in content_type or stream_url.endswith('.m3u8')
+                or stream_url.endswith('.css') or stream_url.endswith('.csv'))
+
+    async def _rewrite_hls_response(self, resp, content_bytes, stream_url, content_type, headers, proxy_base, original_channel_url, api_password, no_bypass) -> CachedManifest:
+        """Riscrive verso il proxy un manifest HLS già letto (come bytes) dalla risposta upstream."""
+        try:
+            manifest_content = content_bytes.decode('utf-8')
+        except UnicodeDecodeError:
+            # SE FALLISCE: È binario mascherato (es. segmento .ts in un .css)
+            logger.warning(f"⚠️ Binary detected in {stream_url} (masked as {content_type}). Serving as binary.")
+            return CachedManifest(content_bytes, status=resp.status, content_type='video/MP2T', cacheable=False)
+
+        # Per file mascherati (.css/.csv), verifica che siano effettivamente manifest HLS
+        is_hls_manifest = 'mpegurl' in content_type or stream_url.endswith('.m3u8')
+        if not is_hls_manifest and not manifest_content.strip().startswith('#EXTM3U'):
+            return CachedManifest(content_bytes, status=resp.status, content_type=content_type or 'text/plain', cacheable=False)
+
+        # Use the final URL after redirects as the base for rewriting relative paths
+        final_stream_url = str(resp.url)
+        try:
+            rewritten_manifest = await ManifestRewriter.rewrite_manifest_urls(
+                manifest_content, final_stream_url, proxy_base, headers, original_channel_url, api_password, self.get_extractor, no_bypass
+            )
+            target_duration, segments, ended = parse_media_playlist(manifest_content, final_stream_url)
+        except Exception as e:
+            # Fallback: meglio il manifest originale (non riscritto, non in cache) che un errore al player
+            logger.error(f"Error processing manifest {stream_url}: {e}")
+            return CachedManifest(content_bytes, status=resp.status, content_type=content_type or 'application/vnd.apple.mpegurl', cacheable=False)
+        if segments:
+            # Il player chiederà subito i segmenti: risolvi ora gli host del CDN
+            DNS_RESOLVER.prefetch({urlparse(url).hostname for url in segments[-3:]})
+        return CachedManifest(
+            rewritten_manifest.encode('utf-8'), status=resp.status, ttl=self.manifest_cache.ttl_for(rewritten_manifest),
+            target_duration=target_duration, segments=segments, ended=ended
+        )
+
+    async def _fetch_hls_manifest(self, stream_url, headers, ssl, proxy_base, original_channel_url, api_password, no_bypass) -> CachedManifest:
+        """Fetch + riscrittura di un manifest HLS (eseguito una sola volta per chiave dalla ManifestCache)."""
+        session, session_proxy = await self._get_proxy_session(stream_url, original_channel_url or None)
+        logger.info(f"📡 [Proxy Manifest] Using session{f' via proxy {session_proxy}' if session_proxy else ' (direct)'} for: {stream_url}")
+
+        async with self.host_governor.slot(stream_url, session_proxy, Priority.MANIFEST) as slot:
+            async with session.get(stream_url, headers=headers, ssl=ssl) as resp:
+                slot.record_status(resp.status)
+                content_type = resp.headers.get('content-type', '')
+                if resp.status not in (200, 206):
+                    error_body = await resp.read()
+                    logger.warning(f"⚠️ Upstream returned error {resp.status} for {stream_url}")
+                    return CachedManifest(error_body, status=resp.status, content_type=content_type, cacheable=False)
+                content_bytes = await resp.read()
+        return await self._rewrite_hls_response(
+            resp, content_bytes, stream_url, content_type, headers, proxy_base, original_channel_url, api_password, no_bypass
+        )
+
+    @staticmethod
+    def _manifest_response(manifest: CachedManifest, cache_state: str = None) -> web.Response:
+        headers = {
+            'Content-Type': manifest.content_type,
+            'Access-Control-Allow-Origin': '*'
+        }
+        if manifest.cacheable:
+            headers['Content-Disposition'] = 'attachment; filename="stream.m3u8"'
+            headers['Cache-Control'] = 'no-cache'
+        if cache_state:
+            headers['X-Cache'] = {'miss': 'MISS', 'stale': 'STALE'}.get(cache_state, 'HIT')
+        return web.Response(body=manifest.body, status=manifest.status, headers=headers)
+
     async def _proxy_stream(self, request, stream_url, stream_headers):
         """Effettua il proxy dello stream con gestione manifest e AES-128"""
         try:
@@ -1410,13 +1466,39 @@ class HLSProxy:
             # ✅ NUOVO: Determina se disabilitare SSL per questo dominio
             disable_ssl = get_ssl_setting_for_url(stream_url, TRANSPORT_ROUTES)
 
+            # ✅ CORREZIONE: Rileva lo schema e l'host corretti quando dietro un reverse proxy
+            scheme = request.headers.get('X-Forwarded-Proto', request.scheme)
+            host = request.headers.get('X-Forwarded-Host', request.host)
+            proxy_base = f"{scheme}://{host}"
+            # Sub-manifest e segmenti riscritti portano original_channel_url: lo stream resta legato al canale
+            original_channel_url = request.query.get('original_channel_url') or request.query.get('url', '')
+            api_password = request.query.get('api_password')
+            no_bypass = request.query.get('no_bypass') == '1'
+
+            # Manifest HLS: fetch single-flight + cache breve dell'output riscritto
+            if (MANIFEST_CACHE_TTL_FRACTION > 0
+                    and urlparse(stream_url).path.endswith('.m3u8')
+                    and not any(h in headers for h in ('range', 'if-none-match', 'if-modified-since'))):
+                cache_key = (stream_url, proxy_base, frozenset(headers.items()), api_password, original_channel_url, no_bypass)
+                async def fetcher():
+                    fetched = await self._fetch_hls_manifest(stream_url, headers, not disable_ssl, proxy_base, original_channel_url, api_password, no_bypass)
+                    self.segment_prefetcher.update_playlist(cache_key, fetched)
+                    return fetched
+
+                manifest, state = await self.manifest_cache.get_or_fetch(cache_key, fetcher)
+                self.segment_prefetcher.touch(cache_key)
+                if LIVE_POLLER_IDLE_TIMEOUT > 0 and manifest.status == 200:
+                    self.live_poller.touch(cache_key, manifest, fetcher)
+                return self._manifest_response(manifest, state)
+
             # ✅ Use pooled session for better performance
-            session, session_proxy = await self._get_proxy_session(stream_url)
+            session, session_proxy = await self._get_proxy_session(stream_url, original_channel_url or None)
             logger.info(f"📡 [Proxy Stream] Using session{f' via proxy {session_proxy}' if session_proxy else ' (direct)'} for: {stream_url}")
+
             async with session.get(stream_url, headers=headers, ssl=not disable_ssl) as resp:
                     content_type = resp.headers.get('content-type', '')
                     
-                    print(f"   Upstream Response: {resp.status} [{content_type}]")
+                    logger.debug(f"   Upstream Response: {resp.status} [{content_type}]")
 
                     # ✅ FIX: Se la risposta non è OK, restituisci direttamente l'errore senza processare
                     if resp.status not in [200, 206]:
@@ -1424,9 +1506,9 @@ class HLSProxy:
                         logger.warning(f"⚠️ Upstream returned error {resp.status} for {stream_url}")
                         # ✅ DEBUG: Log error body to understand what CDN is complaining about
                         try:
-                            print(f"   ❌ Error Body: {error_body.decode('utf-8')[:500]}")
+                            logger.debug(f"   ❌ Error Body: {error_body.decode('utf-8')[:500]}")
                         except:
-                            print(f"   ❌ Error Body (bytes): {error_body[:200]}")
+                            logger.debug(f"   ❌ Error Body (bytes): {error_body[:200]}")
                         return web.Response(
                             body=error_body,
                             status=resp.status,
@@ -1437,70 +1519,13 @@ class HLSProxy:
                         )
                     
                     # Gestione special per manifest HLS
-                    # ✅ Gestisce manifest HLS standard
                     # Nota: Il supporto per manifest mascherati da .css (DLHD vecchio stile) o .csv è mantenuto per compatibilità
-                    is_hls_manifest = 'mpegurl' in content_type or stream_url.endswith('.m3u8')
-                    is_css_file = stream_url.endswith('mono.css') or stream_url.endswith('.css')
-                    is_csv_file = stream_url.endswith('.csv')
-                    
-                    if is_hls_manifest or is_css_file or is_csv_file:
-                        try:
-                            # Leggi come bytes prima per evitare crash su decode
-                            content_bytes = await resp.read()
-                            
-                            try:
-                                # Tenta la decodifica testo
-                                manifest_content = content_bytes.decode('utf-8')
-                            except UnicodeDecodeError:
-                                # SE FALLISCE: È binario mascherato (es. segmento .ts in un .css)
-                                logger.warning(f"⚠️ Binary detected in {stream_url} (masked as {content_type}). Serving as binary.")
-                                return web.Response(
-                                    body=content_bytes,
-                                    status=resp.status,
-                                    headers={
-                                        'Content-Type': 'video/MP2T', # Forza TS se è binario camuffato
-                                        'Access-Control-Allow-Origin': '*'
-                                    }
-                                )
-
-                            # Per file mascherati, verifica che siano effettivamente manifest HLS
-                            if (is_css_file or is_csv_file) and not manifest_content.strip().startswith('#EXTM3U'):
-                                # Non è un manifest HLS, restituisci come file normale
-                                return web.Response(
-                                    text=manifest_content,
-                                    content_type=content_type or 'text/plain',
-                                    headers={'Access-Control-Allow-Origin': '*'}
-                                )
-                        except Exception as e:
-                             logger.error(f"Error processing manifest/css/csv: {e}")
-                             # Fallback to binary proxy
-                             return web.Response(body=await resp.read(), status=resp.status, headers={'Access-Control-Allow-Origin': '*'})
-                        
-                        # ✅ CORREZIONE: Rileva lo schema e l'host corretti quando dietro un reverse proxy
-                        scheme = request.headers.get('X-Forwarded-Proto', request.scheme)
-                        host = request.headers.get('X-Forwarded-Host', request.host)
-                        proxy_base = f"{scheme}://{host}"
-                        original_channel_url = request.query.get('url', '')
-                        
-                        api_password = request.query.get('api_password')
-                        no_bypass = request.query.get('no_bypass') == '1'
-                        
-                        # Use the final URL after redirects as the base for rewriting relative paths
-                        final_stream_url = str(resp.url)
-                        
-                        rewritten_manifest = await ManifestRewriter.rewrite_manifest_urls(
-                            manifest_content, final_stream_url, proxy_base, headers, original_channel_url, api_password, self.get_extractor, no_bypass
-                        )
-                        
-                        return web.Response(
-                            text=rewritten_manifest,
-                            headers={
-                                'Content-Type': 'application/vnd.apple.mpegurl',
-                                'Content-Disposition': 'attachment; filename="stream.m3u8"',
-                                'Access-Control-Allow-Origin': '*',
-                                'Cache-Control': 'no-cache'
-                            }
+                    if self._is_hls_manifest_response(stream_url, content_type):
+                        # Leggi come bytes prima per evitare crash su decode
+                        manifest = await self._rewrite_hls_response(
+                            resp, await resp.read(), stream_url, content_type, headers, proxy_base, original_channel_url, api_password, no_bypass
                         )
+                        return self._manifest_response(manifest)
                     
                     # ✅ AGGIORNATO: Gestione per manifest MPD (DASH)
                     elif 'dash+xml' in content_type or stream_url.endswith('.mpd'):
@@ -1546,20 +1571,25 @@ class HLSProxy:
                             try:
                                 converter = MPDToHLSConverter()
                                 
+                                # Playlist, segmenti e decrypt restano legati al proxy dello stream
+                                converter_params = request.query_string
+                                if original_channel_url and 'original_channel_url' not in request.query:
+                                    converter_params += f"&original_channel_url={urllib.parse.quote(original_channel_url, safe='')}"
+                                
                                 # Check if requesting a Media Playlist (Variant)
                                 rep_id = request.query.get('rep_id')
                                 
                                 if rep_id:
                                     # Generate Media Playlist (Segments)
                                     hls_playlist = converter.convert_media_playlist(
-                                        manifest_content, rep_id, proxy_base, stream_url, request.query_string, clearkey_param
+                                        manifest_content, rep_id, proxy_base, stream_url, converter_params, clearkey_param
                                     )
                                     # Log first few lines for debugging
                                     logger.info(f"📜 Generated Media Playlist for {rep_id} (first 10 lines):\n{chr(10).join(hls_playlist.splitlines()[:10])}")
                                 else:
                                     # Generate Master Playlist
                                     hls_playlist = converter.convert_master_playlist(
-                                        manifest_content, proxy_base, stream_url, request.query_string
+                                        manifest_content, proxy_base, stream_url, converter_params
                                     )
                                     logger.info(f"📜 Generated Master Playlist (first 5 lines):\n{chr(10).join(hls_playlist.splitlines()[:5])}")
                                 
@@ -1582,7 +1612,7 @@ class HLSProxy:
                         rep_id = request.query.get('rep_id')
 
                         api_password = request.query.get('api_password')
-                        rewritten_manifest = ManifestRewriter.rewrite_mpd_manifest(manifest_content, stream_url, proxy_base, headers, clearkey_param, api_password)
+                        rewritten_manifest = ManifestRewriter.rewrite_mpd_manifest(manifest_content, stream_url, proxy_base, headers, clearkey_param, api_password, original_channel_url)
                         
                         return web.Response(
                             text=rewritten_manifest,
@@ -1622,6 +1652,10 @@ class HLSProxy:
                     await response.write_eof()
                     return response
                     
+        except HostBusyError as e:
+            logger.warning(f"🚦 {e}")
+            return web.Response(text=str(e), status=503, headers={'Retry-After': '1', 'Access-Control-Allow-Origin': '*'})
+
         except (ClientPayloadError, ConnectionResetError, OSError) as e:
             # Errori tipici di disconnessione del client
             logger.info(f"ℹ️ Client disconnected from stream: {stream_url} ({str(e)})")
@@ -1662,12 +1696,9 @@ class HLSProxy:
             # ✅ FIX: Passa api_password al builder se presente
             api_password = request.query.get('api_password')
             
-            async def generate_response():
-                async for line in self.playlist_builder.async_generate_combined_playlist(
-                    playlist_definitions, base_url, api_password=api_password
-                ):
-                    yield line.encode('utf-8')
-            
+            # Canali della playlist: estratti in anticipo in background (i più richiesti per primi)
+            prewarm_candidates = self.prewarmer.candidates()
+
             response = web.StreamResponse(
                 status=200,
                 headers={
@@ -1679,16 +1710,56 @@ class HLSProxy:
             
             await response.prepare(request)
             
-            async for chunk in generate_response():
-                await response.write(chunk)
+            # Righe raggruppate in blocchi da ~64KB (o ogni 100ms); il builder segnala con una riga vuota
+            # (FLUSH) quando sta per attendere le sorgenti: il buffer parte subito, nulla resta fermo
+            buffer = []
+            buffered = 0
+            last_flush = 0.0
+            async for line in self.playlist_builder.async_generate_combined_playlist(
+                playlist_definitions, base_url, api_password=api_password, on_stream_url=prewarm_candidates.add
+            ):
+                if not line:
+                    if buffer:
+                        await response.write(''.join(buffer).encode('utf-8'))
+                        buffer, buffered, last_flush = [], 0, time.monotonic()
+                    continue
+                buffer.append(line)
+                buffered += len(line)
+                now = time.monotonic()
+                if buffered >= 65536 or now - last_flush >= 0.1:
+                    await response.write(''.join(buffer).encode('utf-8'))
+                    buffer, buffered, last_flush = [], 0, now
+            if buffer:
+                await response.write(''.join(buffer).encode('utf-8'))
             
             await response.write_eof()
+            self.prewarmer.submit(prewarm_candidates.urls(), prewarm_candidates.total)
             return response
             
         except Exception as e:
             logger.error(f"General error in playlist handler: {str(e)}")
             return web.Response(text=f"Error: {str(e)}", status=500)
 
+    async def handle_prewarm_status(self, request):
+        """Stato dei job di pre-warm delle estrazioni."""
+        if not check_password(request):
+            return web.Response(status=401, text="Unauthorized: Invalid API Password")
+        return web.json_response(self.prewarmer.stats())
+
+    async def handle_prewarm_cancel(self, request):
+        """Cancella un job di pre-warm (POST/DELETE /api/prewarm/{id})."""
+        if not check_password(request):
+            return web.Response(status=401, text="Unauthorized: Invalid API Password")
+        try:
+            job_id = int(request.match_info['id'])
+        except ValueError:
+            return web.json_response({"error": "Invalid job id"}, status=400)
+        job = self.prewarmer.get(job_id)
+        if job is None:
+            return web.json_response({"error": "Job not found"}, status=404)
+        self.prewarmer.cancel(job_id)
+        return web.json_response(job.as_dict())
+
     def _read_template(self, filename: str) -> str:
         """Funzione helper per leggere un file di template."""
         # Nota: assume che i template siano nella directory 'templates' nella root del progetto
@@ -1758,20 +1829,30 @@ class HLSProxy:
                 "✅ CORS enabled"
             ],
             "extractors_loaded": list(self.extractors.keys()),
+            "segment_cache": self.segment_cache.stats(),
+            "manifest_cache": self.manifest_cache.stats(),
+            "live_poller": self.live_poller.stats(),
+            "segment_prefetch": self.segment_prefetcher.stats(),
+            "segment_hedging": self.segment_hedger.stats(),
+            "token_recovery": self.token_recovery.stats(),
+            "token_lifecycle": self.token_lifecycle.stats(),
+            "extraction_prewarm": self.prewarmer.stats(),
+            "playlist_source_cache": self.playlist_builder.source_cache.stats() if self.playlist_builder else None,
+            "extraction_cache": self.extraction_cache.stats(),
+            "extraction_store": EXTRACTION_STORE.stats(),
+            "upstream_concurrency": self.host_governor.stats(),
+            "proxy_pool": PROXY_POOL.stats(),
+            "dns_cache": DNS_RESOLVER.stats(),
             "modules": {
                 "playlist_builder": PlaylistBuilder is not None,
-                "vavoo_extractor": VavooExtractor is not None,
-                "dlhd_extractor": DLHDExtractor is not None,
-                "vixsrc_extractor": VixSrcExtractor is not None,
-                "sportsonline_extractor": SportsonlineExtractor is not None,
-                "mixdrop_extractor": MixdropExtractor is not None,
-                "voe_extractor": VoeExtractor is not None,
-                "streamtape_extractor": StreamtapeExtractor is not None,
+                # Disponibilità senza importare i moduli (vengono caricati al primo utilizzo)
+                **{f"{name}_extractor": available for name, available in EXTRACTOR_REGISTRY.availability().items()},
             },
             "proxy_config": {
                 "global_proxies": f"{len(GLOBAL_PROXIES)} proxies loaded",
                 "transport_routes": f"{len(TRANSPORT_ROUTES)} routing rules configured",
-                "routes": [{"url": route['url'], "has_proxy": route['proxy'] is not None} for route in TRANSPORT_ROUTES]
+                "routes": [{"url": route['url'], "has_proxy": route['proxy'] is not None, "max_conn": route.get('max_conn')} for route in TRANSPORT_ROUTES],
+                "route_matcher": TRANSPORT_ROUTES.stats()
             },
             "endpoints": {
                 "/proxy/hls/manifest.m3u8": "Proxy HLS (compatibilità MFP) - ?d=<URL>",
@@ -1795,7 +1876,7 @@ class HLSProxy:
         }
         return web.json_response(info)
 
-    def _prefetch_next_segments(self, current_url, init_url, key, key_id, headers):
+    def _prefetch_next_segments(self, current_url, init_url, key, key_id, headers, skip_decrypt=False, affinity_key=None):
         """Identifica i prossimi segmenti e avvia il download in background."""
         try:
             parsed = urllib.parse.urlparse(current_url)
@@ -1821,66 +1902,104 @@ class HLSProxy:
                 # Reconstruct URL
                 next_url = urllib.parse.urlunparse(parsed._replace(path=new_path))
                 
-                cache_key = f"{next_url}:{key_id}"
-                
-                if (cache_key not in self.segment_cache and 
-                    cache_key not in self.prefetch_tasks):
-                    
-                    self.prefetch_tasks.add(cache_key)
-                    asyncio.create_task(
-                        self._fetch_and_cache_segment(next_url, init_url, key, key_id, headers, cache_key)
-                    )
+                # Stessa chiave usata da handle_decrypt_segment, così il prefetch viene riutilizzato
+                cache_key = f"{next_url}:{key_id}:ts"
+                if self.segment_cache.is_pending(cache_key):
+                    continue
+
+                task = asyncio.create_task(run_speculative(Priority.PREFETCH, lambda k=cache_key, u=next_url: self.segment_cache.get_or_fetch(
+                    k,
+                    lambda: self._build_decrypted_segment(u, init_url, key, key_id, headers, skip_decrypt, affinity_key)
+                )))
+                self.prefetch_tasks.add(task)
+                task.add_done_callback(self._on_prefetch_done)
 
         except Exception as e:
             logger.warning(f"⚠️ Prefetch error: {e}")
 
-    async def _fetch_and_cache_segment(self, url, init_url, key, key_id, headers, cache_key):
-        """Scarica, decripta e mette in cache un segmento in background."""
-        try:
-            if decrypt_segment is None:
-                return
+    def _on_prefetch_done(self, task):
+        self.prefetch_tasks.discard(task)
+        if not task.cancelled() and task.exception() is None:
+            segment, from_cache = task.result()
+            if not from_cache and segment.status == 200:
+                logger.info(f"📦 Prefetched segment ({segment.size} bytes)")
+
+    async def _build_decrypted_segment(self, url, init_url, key, key_id, headers, skip_decrypt=False, affinity_key=None) -> CachedSegment:
+        """Scarica init + segmento, decripta e rimuxa in TS. Usato come fetcher della segment cache."""
+        # Get proxy-enabled session for segment fetches
+        segment_session, segment_proxy = await self._get_proxy_session(url, affinity_key)
+        if segment_proxy:
+            logger.info(f"📡 [Decrypt] Using session via proxy: {segment_proxy}")
+
+        # Parallel download of init and media segment
+        async def fetch_init():
+            if not init_url:
+                return b""
+            if init_url in self.init_cache:
+                return self.init_cache[init_url]
+            disable_ssl = get_ssl_setting_for_url(init_url, TRANSPORT_ROUTES)
+            try:
+                async with self.host_governor.slot(init_url, segment_proxy) as slot:
+                    async with segment_session.get(init_url, headers=headers, ssl=not disable_ssl, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                        slot.record_status(resp.status)
+                        if resp.status == 200:
+                            content = await resp.read()
+                            self.init_cache[init_url] = content
+                            return content
+                        logger.error(f"❌ Init segment returned status {resp.status}: {init_url}")
+                        return None
+            except Exception as e:
+                logger.error(f"❌ Failed to fetch init segment: {e}")
+                return None
 
-            session = await self._get_session()
-            
-            # Download Init (usa cache se possibile)
-            init_content = b""
-            if init_url:
-                if init_url in self.init_cache:
-                    init_content = self.init_cache[init_url]
-                else:
-                    disable_ssl = get_ssl_setting_for_url(init_url, TRANSPORT_ROUTES)
-                    try:
-                        async with session.get(init_url, headers=headers, ssl=not disable_ssl, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                            if resp.status == 200:
-                                init_content = await resp.read()
-                                self.init_cache[init_url] = init_content
-                    except Exception:
-                        pass 
-
-            # Download Segment
-            segment_content = None
+        async def fetch_segment():
             disable_ssl = get_ssl_setting_for_url(url, TRANSPORT_ROUTES)
             try:
-                async with session.get(url, headers=headers, ssl=not disable_ssl, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-                    if resp.status == 200:
-                        segment_content = await resp.read()
-            except Exception:
-                pass
+                async with self.host_governor.slot(url, segment_proxy) as slot:
+                    async with segment_session.get(url, headers=headers, ssl=not disable_ssl, timeout=aiohttp.ClientTimeout(total=15)) as resp:
+                        slot.record_status(resp.status)
+                        if resp.status == 200:
+                            return await resp.read()
+                        logger.error(f"❌ Segment returned status {resp.status}: {url}")
+                        return None
+            except Exception as e:
+                logger.error(f"❌ Failed to fetch segment: {e}")
+                return None
 
-            if segment_content:
-                # Decrypt
-                # Decrypt in thread pool to avoid blocking event loop
-                loop = asyncio.get_event_loop()
-                decrypted_content = await loop.run_in_executor(None, decrypt_segment, init_content, segment_content, key_id, key)
-                import time
-                self.segment_cache[cache_key] = (decrypted_content, time.time())
-                logger.info(f"📦 Prefetched segment: {url.split('/')[-1]}")
+        # Parallel fetch
+        init_content, segment_content = await asyncio.gather(fetch_init(), fetch_segment())
 
-        except Exception as e:
-            pass
-        finally:
-            if cache_key in self.prefetch_tasks:
-                self.prefetch_tasks.remove(cache_key)
+        if init_content is None and init_url:
+            logger.error(f"❌ Failed to fetch init segment")
+            return CachedSegment(b"", status=502)
+        if segment_content is None:
+            logger.error(f"❌ Failed to fetch segment")
+            return CachedSegment(b"", status=502)
+
+        init_content = init_content or b""
+
+        if skip_decrypt:
+            # Null key: just concatenate init + segment without decryption
+            logger.info(f"🔓 Skip decrypt mode - remuxing without decryption")
+            combined_content = init_content + segment_content
+        else:
+            # Decripta con PyCryptodome
+            # Decrypt in thread pool to avoid blocking event loop
+            loop = asyncio.get_running_loop()
+            combined_content = await loop.run_in_executor(None, decrypt_segment, init_content, segment_content, key_id, key)
+
+        # Leggero REMUX to TS
+        ts_content = await self._remux_to_ts(combined_content)
+        if not ts_content:
+             logger.warning("⚠️ Remux failed, serving raw fMP4")
+             # Fallback: serve fMP4 if remux fails
+             ts_content = combined_content
+             content_type = 'video/mp4'
+        else:
+             content_type = 'video/MP2T'
+             logger.info("⚡ Remuxed fMP4 -> TS")
+
+        return CachedSegment(ts_content, headers={'Content-Type': content_type})
 
     async def _remux_to_ts(self, content):
         """Converte segmenti (fMP4) in MPEG-TS usando FFmpeg pipe."""
@@ -1932,6 +2051,7 @@ class HLSProxy:
         init_url = request.query.get('init_url')
         key = request.query.get('key')
         key_id = request.query.get('key_id')
+        channel_url = request.query.get('original_channel_url')
         
         if not url or not key or not key_id:
             return web.Response(text="Missing url, key, or key_id", status=400)
@@ -1939,25 +2059,7 @@ class HLSProxy:
         if decrypt_segment is None:
             return web.Response(text="Decrypt not available (MPD_MODE is not legacy)", status=503)
 
-        # Check cache first
-        import time
         cache_key = f"{url}:{key_id}:ts" # Use distinct cache key for TS
-        if cache_key in self.segment_cache:
-            cached_content, cached_time = self.segment_cache[cache_key]
-            if time.time() - cached_time < self.segment_cache_ttl:
-                logger.info(f"📦 Cache HIT for segment: {url.split('/')[-1]}")
-                return web.Response(
-                    body=cached_content,
-                    status=200,
-                    headers={
-                        'Content-Type': 'video/MP2T',
-                        'Access-Control-Allow-Origin': '*',
-                        'Cache-Control': 'no-cache',
-                        'Connection': 'keep-alive'
-                    }
-                )
-            else:
-                del self.segment_cache[cache_key]
 
         try:
             # Ricostruisce gli headers per le richieste upstream
@@ -1970,100 +2072,27 @@ class HLSProxy:
                     header_name = param_name[2:].replace('_', '-')
                     headers[header_name] = param_value
 
-            # Get proxy-enabled session for segment fetches
-            segment_session, segment_proxy = await self._get_proxy_session(url)
-            if segment_proxy:
-                logger.info(f"📡 [Decrypt] Using session via proxy: {segment_proxy}")
-
-            try:
-                # Parallel download of init and media segment
-                async def fetch_init():
-                    if not init_url:
-                        return b""
-                    if init_url in self.init_cache:
-                        return self.init_cache[init_url]
-                    disable_ssl = get_ssl_setting_for_url(init_url, TRANSPORT_ROUTES)
-                    try:
-                        async with segment_session.get(init_url, headers=headers, ssl=not disable_ssl, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                            if resp.status == 200:
-                                content = await resp.read()
-                                self.init_cache[init_url] = content
-                                return content
-                            logger.error(f"❌ Init segment returned status {resp.status}: {init_url}")
-                            return None
-                    except Exception as e:
-                        logger.error(f"❌ Failed to fetch init segment: {e}")
-                        return None
-
-                async def fetch_segment():
-                    disable_ssl = get_ssl_setting_for_url(url, TRANSPORT_ROUTES)
-                    try:
-                        async with segment_session.get(url, headers=headers, ssl=not disable_ssl, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-                            if resp.status == 200:
-                                return await resp.read()
-                            logger.error(f"❌ Segment returned status {resp.status}: {url}")
-                            return None
-                    except Exception as e:
-                        logger.error(f"❌ Failed to fetch segment: {e}")
-                        return None
-
-                # Parallel fetch
-                init_content, segment_content = await asyncio.gather(fetch_init(), fetch_segment())
-            finally:
-                # Session is pooled/cached, so we don't close it
-                pass
-
-            if init_content is None and init_url:
-                logger.error(f"❌ Failed to fetch init segment")
-                return web.Response(status=502)
-            if segment_content is None:
-                logger.error(f"❌ Failed to fetch segment")
-                return web.Response(status=502)
-
-            init_content = init_content or b""
-
             # Check if we should skip decryption (null key case)
             skip_decrypt = request.query.get('skip_decrypt') == '1'
-            
-            if skip_decrypt:
-                # Null key: just concatenate init + segment without decryption
-                logger.info(f"🔓 Skip decrypt mode - remuxing without decryption")
-                combined_content = init_content + segment_content
-            else:
-                # Decripta con PyCryptodome
-                # Decrypt in thread pool to avoid blocking event loop
-                loop = asyncio.get_event_loop()
-                combined_content = await loop.run_in_executor(None, decrypt_segment, init_content, segment_content, key_id, key)
-
-            # Leggero REMUX to TS
-            ts_content = await self._remux_to_ts(combined_content)
-            if not ts_content:
-                 logger.warning("⚠️ Remux failed, serving raw fMP4")
-                 # Fallback: serve fMP4 if remux fails
-                 ts_content = combined_content
-                 content_type = 'video/mp4'
-            else:
-                 content_type = 'video/MP2T'
-                 logger.info("⚡ Remuxed fMP4 -> TS")
 
-            # Store in cache
-            self.segment_cache[cache_key] = (ts_content, time.time())
-            
-            # Clean old cache entries (keep max 50)
-            if len(self.segment_cache) > 50:
-                oldest_keys = sorted(self.segment_cache.keys(), key=lambda k: self.segment_cache[k][1])[:20]
-                for k in oldest_keys:
-                    del self.segment_cache[k]
+            segment, from_cache = await self.segment_cache.get_or_fetch(
+                cache_key,
+                lambda: self._build_decrypted_segment(url, init_url, key, key_id, headers, skip_decrypt, channel_url)
+            )
+            if segment.status != 200:
+                return web.Response(status=segment.status)
+            if from_cache:
+                logger.info(f"📦 Cache HIT for segment: {url.split('/')[-1]}")
 
             # Prefetch next segments in background
-            self._prefetch_next_segments(url, init_url, key, key_id, headers)
+            self._prefetch_next_segments(url, init_url, key, key_id, headers, skip_decrypt, channel_url)
 
             # Invia Risposta
             return web.Response(
-                body=ts_content,
+                body=segment.body,
                 status=200,
                 headers={
-                    'Content-Type': content_type,
+                    'Content-Type': segment.headers.get('Content-Type', 'video/MP2T'),
                     'Access-Control-Allow-Origin': '*',
                     'Cache-Control': 'no-cache',
                     'Connection': 'keep-alive'
@@ -2096,7 +2125,7 @@ class HLSProxy:
             client_ip = request.remote
             exit_strategy = "IP del Server (Diretto)"
             if GLOBAL_PROXIES:
-                exit_strategy = f"Proxy Globale Random (Pool di {len(GLOBAL_PROXIES)} proxy)"
+                exit_strategy = f"Proxy Globale (Pool di {len(GLOBAL_PROXIES)} proxy, scelta pesata per latenza)"
             
             logger.info(f"🔄 [Generate URLs] Richiesta da Client IP: {client_ip}")
             logger.info(f"    -> Strategia di uscita prevista per lo stream: {exit_strategy}")
@@ -2181,6 +2210,15 @@ class HLSProxy:
     async def cleanup(self):
         """Pulizia delle risorse"""
         try:
+            await self.live_poller.stop()
+            await self.segment_prefetcher.stop()
+            await self.token_lifecycle.stop()
+            await self.prewarmer.stop()
+            if self.playlist_builder:
+                await self.playlist_builder.close()
+            await PROXY_POOL.stop()
+            await DNS_RESOLVER.stop()
+            
             if self.session and not self.session.closed:
                 await self.session.close()
             
@@ -2193,5 +2231,8 @@ class HLSProxy:
             for extractor in self.extractors.values():
                 if hasattr(extractor, 'close'):
                     await extractor.close()
+
+            # Dopo gli estrattori: le loro ultime scritture vengono salvate su disco
+            await EXTRACTION_STORE.stop()
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from services.request_priority import ON_DEMAND, Priority, PriorityTicket, current_ticket, effective_priority
+
+logger = logging.getLogger(__name__)
+
+# Risposte upstream che indicano sovraccarico/throttling: dimezzano il limite
+_CONGESTION_STATUSES = (429, 502, 503, 504)
+
+
+class HostBusyError(Exception):
+    """La coda di attesa per l'host upstream è piena o l'attesa ha superato il timeout."""
+    pass
+
+
+class HostSlot:
+    """Handle restituito da HostConcurrencyGovernor.slot(): il chiamante segnala l'esito della richiesta."""
+
+    __slots__ = ("limiter", "proxy", "priority", "ticket", "task", "started_at", "waited", "latency", "status", "preempted")
+
+    def __init__(self, limiter: "HostLimiter", proxy: Optional[str] = None, priority: Priority = Priority.SEGMENT,
+                 ticket: Optional[PriorityTicket] = None, task: Optional[asyncio.Task] = None):
+        self.limiter = limiter
+        self.proxy = proxy
+        self.priority = priority
+        self.ticket = ticket
+        self.task = task
+        self.started_at = time.monotonic()
+        self.waited = 0.0
+        self.latency: Optional[float] = None
+        self.status: Optional[int] = None
+        self.preempted = False
+
+    @property
+    def effective(self) -> Priority:
+        """Classe attuale: un prefetch a cui si è agganciato un client diventa on-demand."""
+        return effective_priority(self.priority, self.ticket)
+
+    def record_status(self, status: int):
+        """Da chiamare appena arrivano gli header: la latenza misurata è il time-to-first-byte."""
+        self.status = status
+        self.latency = time.monotonic() - self.started_at
+
+
+class _Waiter:
+    __slots__ = ("future", "slot", "seq")
+
+    def __init__(self, future: asyncio.Future, slot: HostSlot, seq: int):
+        self.future = future
+        self.slot = slot
+        self.seq = seq
+
+
+class HostLimiter:
+    """
+    Limite di concorrenza AIMD per un singolo host upstream, con code per classe di priorità.
+
+    - Additive increase: +1/limit per ogni risposta sana (≈ +1 per "giro" di richieste)
+    - Multiplicative decrease: ×0.5 su errori/throttling (429/5xx gateway, timeout, connessioni cadute),
+      ×0.8 se il time-to-first-byte supera 3× la latenza di base; al massimo una riduzione per finestra
+    - Le richieste oltre il limite aspettano in una coda limitata (max_queue, queue_timeout), servita
+      per classe (key > manifest > segmento > prefetch > background) e FIFO all'interno della classe
+    - Prefetch e background non usano l'ultimo quarto del limite e vengono rimandati quando la
+      latenza delle richieste on-demand sale; una richiesta on-demand in coda può cancellare un
+      prefetch/background in corso (preemption) per prenderne lo slot
+    """
+
+    def __init__(self, host: str, ceiling: int, initial: int = 8, min_limit: int = 2,
+                 max_queue: int = 256, queue_timeout: float = 10.0):
+        self.host = host
+        self.ceiling = max(ceiling, 1)
+        self.min_limit = min(min_limit, self.ceiling)
+        self.limit = float(min(max(initial, self.min_limit), self.ceiling))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = 0
+        self._active = set()
+        self._last_decrease = 0.0
+        self.base_latency: Optional[float] = None
+        self.last_used = time.monotonic()
+        # Latenza (attesa in coda + TTFB) vista dalle richieste on-demand: segnale di pressione
+        self.ondemand_latency: Optional[float] = None
+        self._last_ondemand = 0.0
+
+        # Metriche
+        self.acquired = 0
+        self.queued = 0
+        self.rejected = 0
+        self.errors = 0
+        self.decreases = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.deferred = 0
+        self.preemptions = 0
+
+    def under_pressure(self) -> bool:
+        """True se le richieste on-demand recenti sono molto più lente della latenza di base dell'host."""
+        if self.ondemand_latency is None or self.base_latency is None:
+            return False
+        if time.monotonic() - self._last_ondemand > 10.0:
+            return False
+        return self.ondemand_latency > max(2 * self.base_latency, 0.3)
+
+    def _has_room(self, priority: Priority) -> bool:
+        limit = int(self.limit)
+        if priority <= ON_DEMAND:
+            return self.in_flight < limit
+        # Lavoro speculativo: lascia margine alle richieste on-demand e si ferma se sono lente
+        reserve = max(1, limit // 4)
+        return self.in_flight < limit - reserve and (self.in_flight == 0 or not self.under_pressure())
+
+    def _admit(self, slot: HostSlot):
+        self.in_flight += 1
+        self._active.add(slot)
+        slot.started_at = time.monotonic()
+
+    async def acquire(self, slot: HostSlot):
+        self.last_used = time.monotonic()
+        priority = slot.effective
+        if self._has_room(priority) and not any(w.slot.effective <= priority for w in self._waiters):
+            self._admit(slot)
+            self.acquired += 1
+            return
+
+        if len(self._waiters) >= self.max_queue and not self._evict_waiter(priority):
+            self.rejected += 1
+            raise HostBusyError(f"Upstream {self.host} busy: queue full ({self.max_queue})")
+
+        self._seq += 1
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), slot, self._seq)
+        self._waiters.append(waiter)
+        self.queued += 1
+        if priority > ON_DEMAND and self.in_flight < int(self.limit):
+            self.deferred += 1
+        elif priority <= ON_DEMAND:
+            self._preempt()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Slot già assegnato ma il richiedente rinuncia (cancellato): passalo al prossimo
+                self.in_flight -= 1
+                self._active.discard(slot)
+                self._wake()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise HostBusyError(f"Upstream {self.host} busy: waited more than {self.queue_timeout}s")
+            raise
+
+        slot.waited = time.monotonic() - start
+        self.queue_time_total += slot.waited
+        self.queue_time_max = max(self.queue_time_max, slot.waited)
+        self.acquired += 1
+
+    def _evict_waiter(self, priority: Priority) -> bool:
+        """Coda piena: una richiesta più urgente prende il posto dell'ultima in coda della classe più bassa."""
+        victim = max(self._waiters, key=lambda w: (w.slot.effective, w.seq))
+        if victim.slot.effective <= priority:
+            return False
+        self._waiters.remove(victim)
+        self.rejected += 1
+        if not victim.future.done():
+            victim.future.set_exception(HostBusyError(f"Upstream {self.host} busy: dropped for a more urgent request"))
+        return True
+
+    def _preempt(self):
+        """Cancella un prefetch/background in corso se ci sono più richieste on-demand in coda che slot in liberazione."""
+        waiting = sum(1 for w in self._waiters if w.slot.effective <= ON_DEMAND)
+        releasing = sum(1 for s in self._active if s.preempted)
+        if waiting <= releasing:
+            return
+        victims = [s for s in self._active if not s.preempted and s.effective > ON_DEMAND and s.task is not None and not s.task.done()]
+        if not victims:
+            return
+        victim = max(victims, key=lambda s: (s.effective, s.started_at))
+        victim.preempted = True
+        if victim.ticket is not None:
+            victim.ticket.preempted = True
+        self.preemptions += 1
+        victim.task.cancel()
+        logger.debug(f"🚦 {self.host}: preempted a {victim.effective.name.lower()} request")
+
+    def _wake(self):
+        while self._waiters:
+            waiter = min(self._waiters, key=lambda w: (w.slot.effective, w.seq))
+            if waiter.future.done():
+                self._waiters.remove(waiter)
+                continue
+            if not self._has_room(waiter.slot.effective):
+                break
+            self._waiters.remove(waiter)
+            self._admit(waiter.slot)
+            waiter.future.set_result(True)
+
+    def release(self, slot: HostSlot, failed: bool = False) -> bool:
+        """Libera lo slot; restituisce True se l'esito conta come errore/congestione."""
+        self.in_flight -= 1
+        self._active.discard(slot)
+        now = time.monotonic()
+        self.last_used = now
+        congested = failed or slot.status in _CONGESTION_STATUSES
+
+        if slot.effective <= ON_DEMAND and slot.latency is not None:
+            sample = slot.waited + slot.latency
+            self._last_ondemand = now
+            if self.ondemand_latency is None:
+                self.ondemand_latency = sample
+            else:
+                self.ondemand_latency += 0.3 * (sample - self.ondemand_latency)
+
+        if congested:
+            self.errors += 1
+            self._decrease(0.5, now)
+        elif slot.latency is not None and slot.status is not None and slot.status < 400:
+            if self.base_latency is None:
+                self.base_latency = slot.latency
+            else:
+                # Baseline lenta: scende subito verso latenze migliori, sale piano
+                alpha = 0.3 if slot.latency < self.base_latency else 0.02
+                self.base_latency += alpha * (slot.latency - self.base_latency)
+            if slot.latency > 3 * self.base_latency and slot.latency > 0.5:
+                self._decrease(0.8, now)
+            elif self.limit < self.ceiling:
+                self.limit = min(self.ceiling, self.limit + 1.0 / self.limit)
+        self._wake()
+        return congested
+
+    def _decrease(self, factor: float, now: float):
+        # Una sola riduzione per "giro" (≈ 2× latenza di base): le risposte già in volo riflettono lo stesso sovraccarico
+        window = max(2 * self.base_latency, 0.1) if self.base_latency is not None else 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        logger.debug(f"🚦 {self.host}: concurrency limit -> {self.limit:.1f}")
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {p.name.lower(): 0 for p in Priority}
+        for waiter in self._waiters:
+            depth[waiter.slot.effective.name.lower()] += 1
+        return depth
+
+    def in_flight_by_class(self) -> Dict[str, int]:
+        counts = {p.name.lower(): 0 for p in Priority}
+        for slot in self._active:
+            counts[slot.effective.name.lower()] += 1
+        return counts
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 1),
+            "ceiling": self.ceiling,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "queue_depth": self.queue_depth(),
+            "under_pressure": self.under_pressure(),
+            "ondemand_latency_ms": round(self.ondemand_latency * 1000, 1) if self.ondemand_latency is not None else None,
+            "deferred": self.deferred,
+            "preemptions": self.preemptions,
+            "acquired": self.acquired,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "decreases": self.decreases,
+            "avg_queue_ms": round(self.queue_time_total / self.queued * 1000, 1) if self.queued else 0.0,
+            "max_queue_ms": round(self.queue_time_max * 1000, 1),
+            "base_latency_ms": round(self.base_latency * 1000, 1) if self.base_latency is not None else None,
+        }
+
+
+class HostConcurrencyGovernor:
+    """
+    Un HostLimiter per ogni host upstream, creato alla prima richiesta.
+
+    `on_release(slot, error)` viene chiamato alla fine di ogni richiesta (error = eccezione sollevata
+    o None): è il punto in cui l'esito viene riportato anche al ProxyPool per il proxy usato. Gli
+    status HTTP restano all'HostLimiter dell'host upstream.
+
+    La classe di priorità è quella passata a slot(), abbassata a prefetch/background se il task
+    corrente gira sotto run_speculative() (vedi services.request_priority).
+    """
+
+    def __init__(self, default_ceiling: int = 32, max_queue: int = 256, queue_timeout: float = 10.0,
+                 ceiling_for_url: Optional[Callable[[str], Optional[int]]] = None, max_hosts: int = 1024,
+                 on_release: Optional[Callable[[HostSlot, Optional[BaseException]], None]] = None):
+        self.default_ceiling = default_ceiling
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.ceiling_for_url = ceiling_for_url
+        self.max_hosts = max_hosts
+        self.on_release = on_release
+        self._limiters: Dict[str, HostLimiter] = {}
+
+    def limiter_for(self, url: str) -> HostLimiter:
+        host = (urlparse(url).hostname or "").lower()
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            ceiling = (self.ceiling_for_url(url) if self.ceiling_for_url else None) or self.default_ceiling
+            limiter = HostLimiter(host, ceiling, max_queue=self.max_queue, queue_timeout=self.queue_timeout)
+            self._limiters[host] = limiter
+            if len(self._limiters) > self.max_hosts:
+                self._prune()
+        return limiter
+
+    def _prune(self):
+        idle = [h for h, l in self._limiters.items() if l.in_flight == 0 and not l._waiters]
+        idle.sort(key=lambda h: self._limiters[h].last_used)
+        for host in idle[:len(self._limiters) - self.max_hosts]:
+            del self._limiters[host]
+
+    @asynccontextmanager
+    async def slot(self, url: str, proxy: Optional[str] = None, priority: Priority = Priority.SEGMENT):
+        """
+        async with governor.slot(url, proxy, Priority.MANIFEST) as slot:
+            async with session.get(url) as resp:
+                slot.record_status(resp.status)
+        """
+        limiter = self.limiter_for(url)
+        slot = HostSlot(limiter, proxy, priority, current_ticket(), asyncio.current_task())
+        await limiter.acquire(slot)
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            # La cancellazione (client andato via) non dice nulla sull'upstream
+            limiter.release(slot)
+            raise
+        except Exception as e:
+            # Timeout e connessioni cadute sono segnali di congestione
+            limiter.release(slot, failed=True)
+            self._released(slot, e)
+            raise
+        else:
+            limiter.release(slot)
+            self._released(slot, None)
+
+    def _released(self, slot: HostSlot, error: Optional[BaseException]):
+        if self.on_release is not None:
+            try:
+                self.on_release(slot, error)
+            except Exception as e:
+                logger.debug(f"on_release callback failed: {e}")
+
+    def stats(self) -> dict:
+        busiest = sorted(self._limiters.items(), key=lambda item: item[1].acquired, reverse=True)[:20]
+        queue_depth = {p.name.lower(): 0 for p in Priority}
+        in_flight = {p.name.lower(): 0 for p in Priority}
+        for limiter in self._limiters.values():
+            for name, count in limiter.queue_depth().items():
+                queue_depth[name] += count
+            for name, count in limiter.in_flight_by_class().items():
+                in_flight[name] += count
+        return {
+            "hosts": len(self._limiters),
+            "default_ceiling": self.default_ceiling,
+            "max_queue": self.max_queue,
+            "queue_depth": queue_depth,
+            "in_flight_by_class": in_flight,
+            "preemptions": sum(limiter.preemptions for limiter in self._limiters.values()),
+            "per_host": {host: limiter.stats() for host, limiter in busiest},
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from services.manifest_cache import ManifestCache, CachedManifest
+from services.request_priority import Priority, run_speculative
+
+logger = logging.getLogger(__name__)
+
+
+class LivePlaylistPoller:
+    """
+    Un task asyncio per ogni media playlist live con viewer attivi.
+
+    Il poller ricarica il manifest upstream alla cadenza di EXT-X-TARGETDURATION (metà se il playlist
+    non è cambiato, come da RFC 8216 §6.3.4) e tiene sempre fresca la versione riscritta nella
+    ManifestCache: le richieste dei client vengono servite dalla memoria senza latenza upstream.
+    Il task si ferma dopo idle_timeout secondi senza richieste o quando il playlist termina (ENDLIST).
+
+    I listener registrati con add_listener ricevono i nuovi segmenti appena compaiono.
+    """
+
+    def __init__(self, cache: ManifestCache, idle_timeout: float = 30.0, max_channels: int = 200):
+        self.cache = cache
+        self.idle_timeout = idle_timeout
+        self.max_channels = max_channels
+        self._tasks: Dict[tuple, asyncio.Task] = {}
+        self._last_access: Dict[tuple, float] = {}
+        self._listeners: List[Callable[[tuple, CachedManifest, List[str]], None]] = []
+
+        # Contatori esposti via /api/info
+        self.polls = 0
+        self.poll_errors = 0
+        self.new_segments = 0
+
+    def add_listener(self, callback: Callable[[tuple, CachedManifest, List[str]], None]):
+        self._listeners.append(callback)
+
+    def touch(self, key: tuple, manifest: CachedManifest, fetcher: Callable[[], Awaitable[CachedManifest]]):
+        """Registra una richiesta client e avvia il poller per il canale se non è già attivo."""
+        self._last_access[key] = time.monotonic()
+        if key in self._tasks or not manifest.is_live:
+            return
+        if len(self._tasks) >= self.max_channels:
+            return
+        # L'entry in cache deve restare valida fino al primo poll
+        manifest.ttl = max(manifest.ttl, manifest.target_duration * 1.5)
+        task = asyncio.ensure_future(self._run(key, manifest, fetcher))
+        self._tasks[key] = task
+        task.add_done_callback(lambda t, k=key: self._on_task_done(k, t))
+        logger.debug(f"▶️ Live poller started ({len(self._tasks)} active)")
+
+    def _on_task_done(self, key: tuple, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            self._last_access.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Live poller crashed: {task.exception()}")
+
+    def _notify(self, key: tuple, manifest: CachedManifest, new_segments: List[str]):
+        self.new_segments += len(new_segments)
+        for callback in self._listeners:
+            try:
+                callback(key, manifest, new_segments)
+            except Exception as e:
+                logger.debug(f"Live poller listener error: {e}")
+
+    async def _run(self, key: tuple, manifest: CachedManifest, fetcher: Callable[[], Awaitable[CachedManifest]]):
+        known = set(manifest.segments)
+        interval = manifest.target_duration
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self._last_access.get(key, 0) > self.idle_timeout:
+                logger.debug("⏹️ Live poller stopped (idle)")
+                return
+
+            self.polls += 1
+            try:
+                fresh = await run_speculative(Priority.BACKGROUND, lambda: self.cache.refresh(key, fetcher))
+            except Exception as e:
+                self.poll_errors += 1
+                logger.debug(f"Live poller refresh failed: {e}")
+                continue
+            if fresh.status != 200 or fresh.target_duration is None:
+                self.poll_errors += 1
+                continue
+
+            # L'entry in cache deve restare valida fino al prossimo poll
+            fresh.ttl = max(fresh.ttl, fresh.target_duration * 1.5)
+
+            new_segments = [url for url in fresh.segments if url not in known]
+            known = set(fresh.segments)
+            if new_segments:
+                self._notify(key, fresh, new_segments)
+                interval = fresh.target_duration
+            else:
+                interval = fresh.target_duration / 2
+
+            if fresh.ended:
+                logger.debug("⏹️ Live poller stopped (ENDLIST)")
+                return
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._last_access.clear()
+
+    def stats(self) -> dict:
+        return {
+            "active_channels": len(self._tasks),
+            "idle_timeout": self.idle_timeout,
+            "polls": self.polls,
+            "poll_errors": self.poll_errors,
+            "new_segments": self.new_segments,
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from services.request_priority import PriorityTicket, current_ticket, join
+
+logger = logging.getLogger(__name__)
+
+_TARGET_DURATION_RE = re.compile(r'#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)')
+
+
+def parse_media_playlist(manifest_text: str, base_url: str) -> Tuple[Optional[float], Tuple[str, ...], bool]:
+    """
+    Estrae da un manifest HLS originale (non riscritto):
+    (target_duration, URL assoluti dei segmenti in ordine, ended).
+    target_duration è None per i master playlist.
+    """
+    match = _TARGET_DURATION_RE.search(manifest_text)
+    if not match:
+        return None, (), True
+    # Stessa risoluzione degli URL di ManifestRewriter.rewrite_manifest_urls (query del manifest ereditata)
+    base_query = urlparse(base_url).query
+    segments = []
+    expect_uri = False
+    for line in manifest_text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF'):
+            expect_uri = True
+        elif expect_uri and line and not line.startswith('#'):
+            url = urljoin(base_url, line) if not line.startswith('http') else line
+            if base_query and '?' not in url:
+                url += f"?{base_query}"
+            segments.append(url)
+            expect_uri = False
+    return float(match.group(1)), tuple(segments), '#EXT-X-ENDLIST' in manifest_text
+
+
+class CachedManifest:
+    """Manifest HLS già riscritto, pronto per essere servito a tutti i viewer."""
+
+    __slots__ = ("body", "status", "content_type", "stored_at", "ttl", "cacheable", "target_duration", "segments", "ended")
+
+    def __init__(self, body: bytes, status: int = 200, content_type: str = 'application/vnd.apple.mpegurl', ttl: float = 0.0, cacheable: bool = True,
+                 target_duration: Optional[float] = None, segments: Tuple[str, ...] = (), ended: bool = True):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.stored_at = 0.0
+        self.ttl = ttl
+        # False per risposte da condividere con i richiedenti concorrenti ma non memorizzare (errori, non-manifest)
+        self.cacheable = cacheable
+        # Media playlist: target duration e URL upstream dei segmenti (vedi parse_media_playlist)
+        self.target_duration = target_duration
+        self.segments = segments
+        self.ended = ended
+
+    @property
+    def is_live(self) -> bool:
+        return self.target_duration is not None and not self.ended
+
+
+class ManifestCache:
+    """
+    Cache breve dei manifest HLS riscritti.
+
+    - Fetch single-flight: N viewer che fanno polling dello stesso manifest generano un solo fetch upstream
+      e una sola riscrittura
+    - TTL = frazione di EXT-X-TARGETDURATION (i master playlist senza target duration usano default_ttl)
+    - Stale-while-revalidate: scaduto il TTL, per un'ulteriore finestra pari al TTL si serve la versione
+      precedente mentre un solo refresh in background la aggiorna
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_fraction: float = 0.5, default_ttl: float = 2.0, max_ttl: float = 10.0):
+        self.max_entries = max_entries
+        self.ttl_fraction = ttl_fraction
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[tuple, CachedManifest]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        # Ticket di priorità dei refresh avviati dal poller in background (promossi se un client si aggancia)
+        self._tickets: Dict[tuple, PriorityTicket] = {}
+
+        # Contatori esposti via /api/info
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, manifest_text: str) -> float:
+        """Calcola il TTL di un manifest riscritto a partire da EXT-X-TARGETDURATION."""
+        match = _TARGET_DURATION_RE.search(manifest_text)
+        if not match:
+            return self.default_ttl
+        return min(max(float(match.group(1)) * self.ttl_fraction, 0.5), self.max_ttl)
+
+    def _put(self, key: tuple, manifest: CachedManifest):
+        manifest.stored_at = time.monotonic()
+        self._entries[key] = manifest
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: tuple):
+        self._entries.pop(key, None)
+
+    def _start_fetch(self, key: tuple, fetcher: Callable[[], Awaitable[CachedManifest]]) -> asyncio.Future:
+        task = asyncio.ensure_future(fetcher())
+        self._inflight[key] = task
+        ticket = current_ticket()
+        if ticket is not None:
+            self._tickets[key] = ticket
+        else:
+            self._tickets.pop(key, None)
+        task.add_done_callback(lambda t, k=key: self._on_fetch_done(k, t))
+        return task
+
+    def _on_fetch_done(self, key: tuple, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._tickets.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            if key in self._entries:
+                self.refresh_errors += 1
+                logger.debug(f"Manifest refresh failed, keeping stale copy: {task.exception()}")
+            return
+        manifest = task.result()
+        if manifest.cacheable and manifest.status == 200:
+            self._put(key, manifest)
+
+    async def refresh(self, key: tuple, fetcher: Callable[[], Awaitable[CachedManifest]]) -> CachedManifest:
+        """Forza un nuovo fetch (o si aggancia a quello già in corso) e restituisce il risultato."""
+        task = self._inflight.get(key)
+        if task is None or not join(self._tickets.get(key)):
+            self.refreshes += 1
+            task = self._start_fetch(key, fetcher)
+        return await asyncio.shield(task)
+
+    async def get_or_fetch(self, key: tuple, fetcher: Callable[[], Awaitable[CachedManifest]]) -> Tuple[CachedManifest, str]:
+        """
+        Restituisce (manifest, stato) con stato in 'hit', 'stale', 'coalesced', 'miss'.
+
+        Le entry scadute ma ancora entro la finestra stale vengono servite subito e innescano
+        un unico refresh in background.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age <= entry.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, 'hit'
+            if age <= entry.ttl * 2:
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start_fetch(key, fetcher)
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                return entry, 'stale'
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None and join(self._tickets.get(key)):
+            self.coalesced += 1
+            return await asyncio.shield(task), 'coalesced'
+
+        self.misses += 1
+        task = self._start_fetch(key, fetcher)
+        return await asyncio.shield(task), 'miss'
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_fraction": self.ttl_fraction,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "inflight": len(self._inflight),
+            "hit_ratio": round((self.hits + self.stale_hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
@@ -6,15 +6,12 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-# Conditional import for DLHD detection
-try:
-    from extractors.dlhd import DLHDExtractor
-except ImportError:
-    DLHDExtractor = None
+# DLHD detection senza importare il modulo (caricato su richiesta dal registry)
+from extractors.registry import EXTRACTOR_REGISTRY
 
 class ManifestRewriter:
     @staticmethod
-    def rewrite_mpd_manifest(manifest_content: str, base_url: str, proxy_base: str, stream_headers: dict, clearkey_param: str = None, api_password: str = None) -> str:
+    def rewrite_mpd_manifest(manifest_content: str, base_url: str, proxy_base: str, stream_headers: dict, clearkey_param: str = None, api_password: str = None, original_channel_url: str = '') -> str:
         """Riscrive i manifest MPD (DASH) per passare attraverso il proxy."""
         try:
             # Aggiungiamo il namespace di default se non presente, per ET
@@ -34,6 +31,9 @@ class ManifestRewriter:
             
             if api_password:
                 header_params += f"&api_password={api_password}"
+            # Segmenti e licenze escono dallo stesso proxy del manifest
+            if original_channel_url:
+                header_params += f"&original_channel_url={urllib.parse.quote(original_channel_url, safe='')}"
 
             def create_proxy_url(relative_url):
                 # Skip proxying if URL contains DASH template variables - player must resolve these
@@ -156,7 +156,7 @@ class ManifestRewriter:
                 if hasattr(extractor, 'is_vixsrc') and extractor.is_vixsrc:
                     is_vixsrc_stream = True
                     logger.info("Detected VixSrc stream.")
-                elif DLHDExtractor and isinstance(extractor, DLHDExtractor):
+                elif EXTRACTOR_REGISTRY.is_instance(extractor, "dlhd"):
                     is_dlhd_stream = True
                     logger.info(f"✅ Detected DLHD stream. Will be fully proxied.")
         except Exception as e:
@@ -205,6 +205,9 @@ class ManifestRewriter:
             header_params += f"&api_password={api_password}"
         if no_bypass:
             header_params += "&no_bypass=1"
+        # Canale di origine: sub-manifest e segmenti restano sullo stesso proxy in uscita (affinità)
+        if original_channel_url:
+            header_params += f"&original_channel_url={urllib.parse.quote(original_channel_url, safe='')}"
 
         # Estrai query params dal base_url per ereditarli se necessario
         base_parsed = urllib.parse.urlparse(base_url)
@@ -289,33 +292,23 @@ class ManifestRewriter:
                 if base_query and '?' not in absolute_url:
                     absolute_url += f"?{base_query}"
 
-                # ✅ BYPASS: Non proxare segmenti di domini con token a scadenza rapida
-                # Freeshot (planetary.lovecdn.ru) ha token che scadono in ~20-30 secondi
-                # Se proxiamo, il token scade prima che il player richieda i segmenti
-                no_proxy_domains = ['planetary.lovecdn.ru', 'lovecdn.ru']
-                should_bypass = not no_bypass and any(domain in absolute_url for domain in no_proxy_domains)
-                
-                if should_bypass:
-                    # Serve l'URL diretto senza passare dal proxy
-                    rewritten_lines.append(absolute_url)
-                else:
-                    encoded_url = urllib.parse.quote(absolute_url, safe='')
+                encoded_url = urllib.parse.quote(absolute_url, safe='')
 
-                    # Se è .m3u8 usa /proxy/manifest.m3u8, altrimenti determina estensione
-                    if '.m3u8' in absolute_url:
-                         proxy_url = f"{proxy_base}/proxy/manifest.m3u8?url={encoded_url}{header_params}"
-                    else:
-                         # ✅ FIX: Determina estensione corretta per il segmento
-                         # Se l'URL originale ha estensione mp4/m4s, usa .mp4, altrimenti default a .ts
-                         # Questo aiuta i player a distinguere tra TS e fMP4
-                         path = urllib.parse.urlparse(absolute_url).path
-                         ext = '.ts'
-                         if path.endswith('.m4s') or path.endswith('.mp4') or path.endswith('.m4v'):
-                             ext = '.mp4'
+                # Se è .m3u8 usa /proxy/manifest.m3u8, altrimenti determina estensione
+                if '.m3u8' in absolute_url:
+                     proxy_url = f"{proxy_base}/proxy/manifest.m3u8?url={encoded_url}{header_params}"
+                else:
+                     # ✅ FIX: Determina estensione corretta per il segmento
+                     # Se l'URL originale ha estensione mp4/m4s, usa .mp4, altrimenti default a .ts
+                     # Questo aiuta i player a distinguere tra TS e fMP4
+                     path = urllib.parse.urlparse(absolute_url).path
+                     ext = '.ts'
+                     if path.endswith('.m4s') or path.endswith('.mp4') or path.endswith('.m4v'):
+                         ext = '.mp4'
 
-                         proxy_url = f"{proxy_base}/proxy/hls/segment{ext}?d={encoded_url}{header_params}"
+                     proxy_url = f"{proxy_base}/proxy/hls/segment{ext}?d={encoded_url}{header_params}"
 
-                    rewritten_lines.append(proxy_url)
+                rewritten_lines.append(proxy_url)
 
             else:
                 # Tutti gli altri tag (es. #EXTINF, #EXT-X-ENDLIST)
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CachedSource:
+    """Voce dell'indice in memoria: una playlist sorgente salvata su disco con i suoi validatori HTTP."""
+
+    __slots__ = ("url", "key", "etag", "last_modified", "charset", "size", "checked_at", "last_access")
+
+    def __init__(self, url: str, key: str, etag: Optional[str], last_modified: Optional[str], charset: Optional[str],
+                 size: int, checked_at: float):
+        self.url = url
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.charset = charset
+        self.size = size
+        # Ultimo download o revalidazione riuscita (epoch)
+        self.checked_at = checked_at
+        self.last_access = time.monotonic()
+
+    def as_meta(self) -> dict:
+        return {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "charset": self.charset,
+            "size": self.size,
+            "checked_at": self.checked_at,
+        }
+
+
+class SourceWriter:
+    """Copia su file temporaneo di una risposta 200 mentre viene inoltrata: diventa la voce in cache solo se completa."""
+
+    def __init__(self, cache: "PlaylistSourceCache", url: str):
+        self.cache = cache
+        self.url = url
+        self.key = cache.key_for(url)
+        self.size = 0
+        self._tmp_path = os.path.join(cache.directory, f"{self.key}.{uuid.uuid4().hex}.tmp")
+        self._file = None
+
+    async def write(self, chunk: bytes):
+        loop = asyncio.get_running_loop()
+        if self._file is None:
+            self._file = await loop.run_in_executor(None, open, self._tmp_path, "wb")
+        await loop.run_in_executor(None, self._file.write, chunk)
+        self.size += len(chunk)
+
+    async def commit(self, etag: Optional[str], last_modified: Optional[str], charset: Optional[str]) -> CachedSource:
+        entry = CachedSource(self.url, self.key, etag, last_modified, charset, self.size, time.time())
+        await asyncio.get_running_loop().run_in_executor(None, self._commit_sync, entry)
+        await self.cache._add(entry)
+        return entry
+
+    def _commit_sync(self, entry: CachedSource):
+        if self._file is None:
+            # Lista vuota: nessun chunk ricevuto
+            self._file = open(self._tmp_path, "wb")
+        self._file.close()
+        self._file = None
+        # os.replace è atomico: gli altri worker leggono la versione vecchia o quella nuova, mai metà file
+        os.replace(self._tmp_path, self.cache._body_path(entry.key))
+        self.cache._write_meta(entry)
+
+    def abort(self):
+        """Download interrotto o fallito: il file temporaneo viene scartato (sincrono, sicuro anche durante una cancellazione)."""
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+        except OSError as e:
+            logger.debug(f"Playlist cache: cannot remove {self._tmp_path}: {e}")
+
+
+class PlaylistSourceCache:
+    """
+    Cache su disco delle playlist sorgente di /playlist, revalidate con GET condizionali.
+
+    - Ogni sorgente è salvata in `directory` (<sha1>.m3u + <sha1>.json con ETag/Last-Modified);
+      l'indice in memoria evita di toccare il disco per sapere cosa c'è in cache
+    - Entro `min_refresh` secondi dall'ultimo controllo la sorgente viene servita dal disco senza
+      richieste; dopo, la richiesta porta If-None-Match/If-Modified-Since e un 304 riusa il file
+    - Le risposte 200 vengono salvate mentre sono inoltrate al client (nessun buffering in memoria)
+    - Se l'upstream non risponde, la copia in cache viene servita comunque (stale-if-error)
+    - Più worker possono condividere la directory: file e metadati sono scritti con rename atomici
+      e una voce mancante nell'indice viene cercata su disco prima di considerarla un miss
+    - Oltre `max_bytes` le voci usate meno di recente vengono rimosse
+    """
+
+    def __init__(self, directory: Optional[str] = None, min_refresh: float = 300.0, max_bytes: int = 500 * 1024 * 1024):
+        self.directory = directory
+        self.min_refresh = min_refresh
+        self.max_bytes = max_bytes
+        self._index: Dict[str, CachedSource] = {}
+        self._total_bytes = 0
+        self._scanned = False
+        self._scan_lock: Optional[asyncio.Lock] = None
+
+        # Contatori esposti via /api/info
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.stale_on_error = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.m3u")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _write_meta(self, entry: CachedSource):
+        tmp_path = f"{self._meta_path(entry.key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry.as_meta(), f)
+        os.replace(tmp_path, self._meta_path(entry.key))
+
+    def _read_meta(self, key: str) -> Optional[CachedSource]:
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+            if not os.path.exists(self._body_path(key)):
+                return None
+            return CachedSource(meta["url"], key, meta.get("etag"), meta.get("last_modified"), meta.get("charset"),
+                                int(meta.get("size", 0)), float(meta.get("checked_at", 0)))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _scan_sync(self) -> Dict[str, CachedSource]:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                # Residui di download interrotti (anche di processi terminati)
+                try:
+                    if time.time() - os.path.getmtime(os.path.join(self.directory, name)) > 3600:
+                        os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            elif name.endswith(".json"):
+                entry = self._read_meta(name[:-5])
+                if entry is not None:
+                    entries[entry.url] = entry
+        return entries
+
+    async def _ensure_index(self):
+        if self._scanned:
+            return
+        if self._scan_lock is None:
+            self._scan_lock = asyncio.Lock()
+        async with self._scan_lock:
+            if self._scanned:
+                return
+            try:
+                entries = await asyncio.get_running_loop().run_in_executor(None, self._scan_sync)
+            except OSError as e:
+                logger.error(f"❌ Playlist cache directory {self.directory} not usable, cache disabled: {e}")
+                self.directory = None
+                return
+            for entry in entries.values():
+                if entry.url not in self._index:
+                    self._index[entry.url] = entry
+                    self._total_bytes += entry.size
+            self._scanned = True
+            logger.info(f"📼 Playlist source cache: {len(self._index)} sources on disk ({self._total_bytes / 1e6:.1f} MB)")
+
+    async def lookup(self, url: str) -> Optional[CachedSource]:
+        if not self.enabled:
+            return None
+        await self._ensure_index()
+        if not self.enabled:
+            return None
+        entry = self._index.get(url)
+        if entry is None:
+            # Magari salvata da un altro worker dopo la scansione
+            entry = await asyncio.get_running_loop().run_in_executor(None, self._read_meta, self.key_for(url))
+            if entry is None:
+                return None
+            await self._add(entry)
+        entry.last_access = time.monotonic()
+        return entry
+
+    def is_fresh(self, entry: CachedSource, min_refresh: Optional[float] = None) -> bool:
+        interval = self.min_refresh if min_refresh is None else min_refresh
+        return time.time() - entry.checked_at < interval
+
+    @staticmethod
+    def conditional_headers(entry: CachedSource) -> Dict[str, str]:
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    async def open(self, entry: CachedSource, revalidated: bool = False, stale: bool = False) -> Optional[AsyncIterator[bytes]]:
+        """Contenuto della voce a blocchi; None se il file non c'è più (es. rimosso da un altro worker)."""
+        loop = asyncio.get_running_loop()
+        try:
+            f = await loop.run_in_executor(None, open, self._body_path(entry.key), "rb")
+        except OSError:
+            self._remove(entry)
+            return None
+        if revalidated:
+            entry.checked_at = time.time()
+            self.revalidated += 1
+            try:
+                await loop.run_in_executor(None, self._write_meta, entry)
+            except OSError as e:
+                logger.debug(f"Playlist cache: cannot update metadata for {entry.url}: {e}")
+        elif stale:
+            self.stale_on_error += 1
+        else:
+            self.fresh_hits += 1
+        self.bytes_saved += entry.size
+        return self._read_chunks(f)
+
+    @staticmethod
+    async def _read_chunks(f, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            f.close()
+
+    def writer(self, url: str) -> SourceWriter:
+        self.downloads += 1
+        return SourceWriter(self, url)
+
+    async def _add(self, entry: CachedSource):
+        previous = self._index.get(entry.url)
+        if previous is not None:
+            self._total_bytes -= previous.size
+        self._index[entry.url] = entry
+        self._total_bytes += entry.size
+        evicted = self._evict(keep=entry)
+        if evicted:
+            await asyncio.get_running_loop().run_in_executor(None, self._delete_files, evicted)
+
+    def _remove(self, entry: CachedSource):
+        if self._index.get(entry.url) is entry:
+            del self._index[entry.url]
+            self._total_bytes -= entry.size
+
+    def _evict(self, keep: CachedSource) -> List[CachedSource]:
+        """Toglie dall'indice le voci usate meno di recente oltre `max_bytes` (mai `keep`, la voce appena aggiunta)."""
+        evicted = []
+        if self._total_bytes <= self.max_bytes:
+            return evicted
+        for entry in sorted(self._index.values(), key=lambda e: e.last_access):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if entry is keep:
+                continue
+            self._remove(entry)
+            evicted.append(entry)
+            self.evictions += 1
+        return evicted
+
+    def _delete_files(self, entries: List[CachedSource]):
+        for entry in entries:
+            for path in (self._meta_path(entry.key), self._body_path(entry.key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sources": len(self._index),
+            "size_mb": round(self._total_bytes / (1024 * 1024), 2),
+            "min_refresh_s": self.min_refresh,
+            "fresh_hits": self.fresh_hits,
+            "revalidated": self.revalidated,
+            "downloads": self.downloads,
+            "stale_on_error": self.stale_on_error,
+            "bytes_saved_mb": round(self.bytes_saved / (1024 * 1024), 2),
+            "evictions": self.evictions,
+        }
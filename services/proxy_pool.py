@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import random
+import statistics
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp import ClientTimeout
+from aiohttp_socks import ProxyError, ProxyConnectionError, ProxyTimeoutError
+
+from services.dns_cache import CachedDNSProxyConnector
+
+logger = logging.getLogger(__name__)
+
+
+# Errori imputabili al proxy (connessione, handshake, timeout). Uno status HTTP dell'upstream
+# (es. 502/503 di un CDN) arriva attraverso un proxy funzionante e non conta contro di lui.
+_PROXY_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError, ProxyError, ProxyConnectionError, ProxyTimeoutError)
+
+
+def is_proxy_error(error: BaseException) -> bool:
+    return isinstance(error, _PROXY_ERRORS)
+
+
+def _redact(proxy: str) -> str:
+    """Nasconde le credenziali del proxy nei log e in /api/info."""
+    parsed = urlparse(proxy)
+    if not parsed.password:
+        return proxy
+    return proxy.replace(f"{parsed.username}:{parsed.password}@", "***@", 1)
+
+
+class ProxyStats:
+    """Statistiche di un singolo proxy in uscita, aggiornate dal traffico reale e dalle probe."""
+
+    __slots__ = ("proxy", "latency", "error_rate", "consecutive_failures", "down_until",
+                 "requests", "failures", "probes", "last_used")
+
+    def __init__(self, proxy: str):
+        self.proxy = proxy
+        self.latency: Optional[float] = None  # EWMA del time-to-first-byte (secondi)
+        self.error_rate = 0.0  # EWMA 0..1 degli esiti falliti
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.probes = 0
+        self.last_used = 0.0
+
+    def is_down(self, now: float) -> bool:
+        return now < self.down_until
+
+    def stats(self, now: float) -> dict:
+        return {
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            "probes": self.probes,
+            "down": self.is_down(now),
+        }
+
+
+class ProxyPool:
+    """
+    Selezione dei proxy in uscita pesata per latenza e tasso di errore.
+
+    - Ogni richiesta upstream riporta l'esito con record(): latenza ed errori sono EWMA per proxy
+    - choose() estrae un proxy con peso (1 - error_rate)² / latenza: i proxy veloci e sani ricevono
+      più traffico, quelli lenti restano in rotazione con una quota minore
+    - Dopo `failure_threshold` errori consecutivi il proxy viene escluso per `down_cooldown` secondi
+      (raddoppiato a ogni ricaduta); se sono tutti esclusi si sceglie comunque tra tutti
+    - Un task in background esegue una probe periodica su ogni proxy noto, così un proxy tornato
+      sano rientra prima della fine del cooldown e i proxy mai usati hanno già una latenza stimata
+    - Affinità: con `affinity_key` (l'URL originale del canale) tutte le richieste di uno stream
+      escono dallo stesso proxy finché questo resta sano. Molti CDN legano il token all'IP del
+      client, e restare sullo stesso proxy riusa anche le connessioni keep-alive della sua sessione
+    """
+
+    def __init__(self, probe_interval: float = 60.0, probe_url: str = "https://www.gstatic.com/generate_204",
+                 probe_timeout: float = 10.0, ewma_alpha: float = 0.2, failure_threshold: int = 3,
+                 down_cooldown: float = 30.0, max_cooldown: float = 600.0,
+                 affinity_ttl: float = 600.0, max_affinities: int = 4096):
+        self.probe_interval = probe_interval
+        self.probe_url = probe_url
+        self.probe_timeout = probe_timeout
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self.down_cooldown = down_cooldown
+        self.max_cooldown = max_cooldown
+        self.affinity_ttl = affinity_ttl
+        self.max_affinities = max_affinities
+        self._proxies: Dict[str, ProxyStats] = {}
+        # affinity_key -> (proxy, ultimo utilizzo), in ordine LRU
+        self._affinity: "OrderedDict[str, tuple]" = OrderedDict()
+        self.rebinds = 0
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def configure(self, **settings):
+        """Applica la configurazione (chiamato da HLSProxy all'avvio con i valori di config.py)."""
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Unknown ProxyPool setting: {name}")
+            setattr(self, name, value)
+
+    def _stats_for(self, proxy: str) -> ProxyStats:
+        stats = self._proxies.get(proxy)
+        if stats is None:
+            stats = self._proxies[proxy] = ProxyStats(proxy)
+        return stats
+
+    def register(self, proxies: Iterable[str]):
+        for proxy in proxies:
+            if proxy:
+                self._stats_for(proxy)
+
+    def weight(self, stats: ProxyStats, default_latency: float) -> float:
+        latency = stats.latency if stats.latency is not None else default_latency
+        return (1.0 - stats.error_rate) ** 2 / max(latency, 0.05) + 1e-6
+
+    def choose(self, proxies, affinity_key: Optional[str] = None) -> Optional[str]:
+        """Sceglie un proxy tra i candidati (None se la lista è vuota)."""
+        if not proxies:
+            return None
+        if len(proxies) == 1:
+            self._stats_for(proxies[0])
+            self._ensure_probing()
+            return proxies[0]
+
+        now = time.monotonic()
+        self._ensure_probing()
+        if affinity_key:
+            bound = self._affinity.get(affinity_key)
+            if bound is not None:
+                proxy, last_used = bound
+                stats = self._proxies.get(proxy)
+                if proxy in proxies and stats is not None and not stats.is_down(now) and now - last_used <= self.affinity_ttl:
+                    self._affinity[affinity_key] = (proxy, now)
+                    self._affinity.move_to_end(affinity_key)
+                    stats.last_used = now
+                    return proxy
+                self.rebinds += 1
+                logger.info(f"🔀 Proxy affinity for {affinity_key} released ({_redact(proxy)})")
+
+        chosen = self._weighted_choice(proxies, now)
+        if affinity_key:
+            self.bind(affinity_key, chosen)
+        return chosen
+
+    def bind(self, affinity_key: str, proxy: str):
+        """Lega affinity_key a un proxy già in uso (es. quello con cui l'estrattore ha ottenuto il token)."""
+        if not affinity_key or not proxy:
+            return
+        self._stats_for(proxy)
+        self._affinity[affinity_key] = (proxy, time.monotonic())
+        self._affinity.move_to_end(affinity_key)
+        while len(self._affinity) > self.max_affinities:
+            self._affinity.popitem(last=False)
+
+    def _weighted_choice(self, proxies, now: float) -> str:
+        candidates = [self._stats_for(proxy) for proxy in proxies]
+        healthy = [stats for stats in candidates if not stats.is_down(now)] or candidates
+
+        # I proxy senza misure partono dalla latenza mediana: vengono provati senza essere favoriti
+        known = [stats.latency for stats in healthy if stats.latency is not None]
+        default_latency = statistics.median(known) if known else 1.0
+        weights = [self.weight(stats, default_latency) for stats in healthy]
+        chosen = random.choices(healthy, weights=weights)[0]
+        chosen.last_used = now
+        return chosen.proxy
+
+    def record(self, proxy: Optional[str], latency: Optional[float], ok: bool, probe: bool = False):
+        """Esito di una richiesta (o di una probe) passata dal proxy."""
+        if not proxy:
+            return
+        stats = self._stats_for(proxy)
+        if probe:
+            stats.probes += 1
+        else:
+            stats.requests += 1
+
+        stats.error_rate += self.ewma_alpha * ((0.0 if ok else 1.0) - stats.error_rate)
+        if ok:
+            # La latenza delle probe include l'handshake di una connessione nuova: conta solo finché manca traffico reale
+            if latency is not None and (not probe or stats.requests == 0):
+                stats.latency = latency if stats.latency is None else stats.latency + self.ewma_alpha * (latency - stats.latency)
+            if stats.down_until:
+                logger.info(f"🌍 Proxy {_redact(proxy)} is healthy again")
+            stats.consecutive_failures = 0
+            stats.down_until = 0.0
+            return
+
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= self.failure_threshold:
+            backoff = 2 ** (stats.consecutive_failures - self.failure_threshold)
+            cooldown = min(self.max_cooldown, self.down_cooldown * backoff)
+            stats.down_until = time.monotonic() + cooldown
+            logger.warning(f"⚠️ Proxy {_redact(proxy)} marked down for {cooldown:.0f}s after {stats.consecutive_failures} consecutive failures")
+
+    def _ensure_probing(self):
+        if self.probe_interval <= 0 or (self._probe_task is not None and not self._probe_task.done()):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            await asyncio.gather(*(self._probe(proxy) for proxy in list(self._proxies)), return_exceptions=True)
+
+    async def _probe(self, proxy: str):
+        start = time.monotonic()
+        try:
+            connector = CachedDNSProxyConnector.from_url(proxy)
+            async with aiohttp.ClientSession(connector=connector, timeout=ClientTimeout(total=self.probe_timeout)) as session:
+                async with session.get(self.probe_url, allow_redirects=False) as resp:
+                    ok = resp.status < 500
+                    latency = time.monotonic() - start
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Proxy probe failed for {_redact(proxy)}: {e}")
+            ok, latency = False, None
+        self.record(proxy, latency, ok, probe=True)
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "proxies": len(self._proxies),
+            "down": sum(1 for stats in self._proxies.values() if stats.is_down(now)),
+            "probe_interval": self.probe_interval,
+            "affinities": len(self._affinity),
+            "affinity_rebinds": self.rebinds,
+            "per_proxy": {_redact(proxy): stats.stats(now) for proxy, stats in self._proxies.items()},
+        }
+
+
+# Istanza condivisa: la usano config.get_proxy_for_url, HLSProxy e gli estrattori
+PROXY_POOL = ProxyPool()
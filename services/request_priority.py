@@ -0,0 +1,85 @@
+import contextvars
+from enum import IntEnum
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Classi di priorità delle richieste upstream (valore più basso = più urgente)."""
+    KEY = 0
+    MANIFEST = 1
+    SEGMENT = 2
+    PREFETCH = 3
+    BACKGROUND = 4
+
+
+# Le classi fino a SEGMENT sono richieste di un player in attesa; le altre sono speculative
+ON_DEMAND = Priority.SEGMENT
+
+
+class PriorityTicket:
+    """
+    Priorità del lavoro speculativo (prefetch, refresh in background) in corso nel task corrente.
+
+    Il ticket è condiviso tra il task che lo ha creato e i fetch single-flight avviati da lì: se un
+    client si aggancia a uno di quei fetch il ticket viene promosso (priority = None, vale la classe
+    del punto di chiamata). Un ticket "preempted" è stato cancellato dallo scheduler per fare posto
+    a una richiesta on-demand: chi lo trova non deve agganciarsi al fetch.
+    """
+
+    __slots__ = ("priority", "preempted")
+
+    def __init__(self, priority: Priority):
+        self.priority: Optional[Priority] = priority
+        self.preempted = False
+
+    def promote(self) -> bool:
+        if self.preempted:
+            return False
+        self.priority = None
+        return True
+
+
+_current_ticket: "contextvars.ContextVar[Optional[PriorityTicket]]" = contextvars.ContextVar("upstream_priority", default=None)
+
+
+def current_ticket() -> Optional[PriorityTicket]:
+    return _current_ticket.get()
+
+
+def is_speculative() -> bool:
+    ticket = _current_ticket.get()
+    return ticket is not None and ticket.priority is not None
+
+
+def effective_priority(call_site: Priority, ticket: Optional[PriorityTicket]) -> Priority:
+    """La classe del punto di chiamata, abbassata a quella del ticket se il lavoro è speculativo."""
+    if ticket is not None and ticket.priority is not None:
+        return max(call_site, ticket.priority)
+    return call_site
+
+
+def join(ticket: Optional[PriorityTicket]) -> bool:
+    """
+    Il task corrente si aggancia a un fetch in corso creato sotto `ticket`.
+
+    Se il task corrente è on-demand il fetch viene promosso. Restituisce False se il fetch è stato
+    preempted: il chiamante deve avviarne uno nuovo.
+    """
+    if ticket is None:
+        return True
+    if ticket.preempted:
+        return False
+    if not is_speculative():
+        ticket.promote()
+    return True
+
+
+async def run_speculative(priority: Priority, factory: Callable[[], Awaitable[T]]) -> T:
+    """Esegue factory() come lavoro di classe `priority` (da usare come corpo di un task in background)."""
+    token = _current_ticket.set(PriorityTicket(priority))
+    try:
+        return await factory()
+    finally:
+        _current_ticket.reset(token)
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import re
+import signal
+import sys
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# scheme://host[:port] (oppure il dominio nudo, es. spec.proxy_domain_for)
+_AUTHORITY_RE = re.compile(r'^(?:[A-Za-z][A-Za-z0-9+.-]*://)?[^/?#]*')
+
+
+class _Automaton:
+    """Aho–Corasick sui pattern delle route: restituisce l'indice minimo (= priorità) tra quelli presenti nel testo."""
+
+    __slots__ = ("goto", "fail", "best")
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.best = [None]
+        for index, pattern in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.best.append(None)
+                state = next_state
+            if self.best[state] is None or index < self.best[state]:
+                self.best[state] = index
+
+        # BFS: link di fallimento e propagazione del miglior indice lungo i suffissi
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        position = 0
+        while position < len(queue):
+            state = queue[position]
+            position += 1
+            inherited = self.best[self.fail[state]]
+            if inherited is not None and (self.best[state] is None or inherited < self.best[state]):
+                self.best[state] = inherited
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0) if state else 0
+                queue.append(next_state)
+
+    def search(self, text: str) -> Optional[int]:
+        goto, fail, best = self.goto, self.fail, self.best
+        state = 0
+        found = None
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            index = best[state]
+            if index is not None and (found is None or index < found):
+                found = index
+                if found == 0:
+                    break
+        return found
+
+
+class RouteMatcher:
+    """
+    TRANSPORT_ROUTES compilate: stessa semantica della scansione lineare (prima route il cui URL
+    è contenuto nell'URL richiesto), ma con un solo passaggio sull'URL.
+
+    - I pattern "di dominio" (senza '/', '?', '#') vengono cercati nello schema+host dell'URL,
+      senza distinzione tra maiuscole e minuscole, e il risultato è memorizzato per host (LRU)
+    - Gli altri pattern (con un path) vengono cercati sull'URL completo
+    """
+
+    def __init__(self, routes: List[dict], memo_size: int = 4096):
+        self.routes = list(routes)
+        self.memo_size = memo_size
+        host_patterns, url_patterns = [], []
+        for index, route in enumerate(self.routes):
+            pattern = route['url']
+            if any(c in pattern for c in '/?#'):
+                url_patterns.append((index, pattern))
+            else:
+                host_patterns.append((index, pattern.lower()))
+        self._host_automaton = _Automaton(host_patterns) if host_patterns else None
+        self._url_automaton = _Automaton(url_patterns) if url_patterns else None
+        # Filtro in C: l'automa (che trova la route con priorità più alta) gira solo se almeno un pattern è presente
+        self._url_prefilter = re.compile('|'.join(re.escape(p) for _, p in url_patterns)) if url_patterns else None
+        self._memo: "OrderedDict[str, Optional[int]]" = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    def _host_index(self, url: str) -> Optional[int]:
+        authority = _AUTHORITY_RE.match(url).group(0).lower()
+        memo = self._memo
+        if authority in memo:
+            self.memo_hits += 1
+            memo.move_to_end(authority)
+            return memo[authority]
+        self.memo_misses += 1
+        index = self._host_automaton.search(authority)
+        memo[authority] = index
+        if len(memo) > self.memo_size:
+            memo.popitem(last=False)
+        return index
+
+    def match(self, url: str) -> Optional[dict]:
+        if not url or not self.routes:
+            return None
+        index = self._host_index(url) if self._host_automaton else None
+        if self._url_automaton and index != 0 and self._url_prefilter.search(url):
+            url_index = self._url_automaton.search(url)
+            if url_index is not None and (index is None or url_index < index):
+                index = url_index
+        return self.routes[index] if index is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "routes": len(self.routes),
+            "memo_entries": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+        }
+
+
+class RouteTable(list):
+    """
+    Lista delle TRANSPORT_ROUTES (resta una list per chi la legge) con il matcher compilato.
+
+    Ricaricabile a caldo senza riavvio: replace() sostituisce il contenuto sul posto, così tutti i
+    moduli che hanno importato TRANSPORT_ROUTES vedono le nuove route. reload() rilegge la
+    sorgente (file o .env) ed è agganciato a SIGHUP e al controllo periodico del file.
+    """
+
+    def __init__(self, routes=(), loader: Optional[Callable[[], List[dict]]] = None, source_file: Optional[str] = None):
+        super().__init__(routes)
+        self.loader = loader
+        self.source_file = source_file
+        self.matcher = RouteMatcher(self)
+        self.reloads = 0
+        self._mtime = self._source_mtime()
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def replace(self, routes: List[dict]):
+        # Matcher nuovo prima del contenuto nuovo: una lettura concorrente vede sempre una coppia coerente
+        matcher = RouteMatcher(routes)
+        self[:] = routes
+        self.matcher = matcher
+        self.reloads += 1
+
+    def match(self, url: str) -> Optional[dict]:
+        return self.matcher.match(url)
+
+    def _source_mtime(self) -> Optional[float]:
+        if not self.source_file:
+            return None
+        try:
+            return os.stat(self.source_file).st_mtime
+        except OSError:
+            return None
+
+    def reload(self) -> bool:
+        if self.loader is None:
+            return False
+        try:
+            routes = self.loader()
+        except Exception as e:
+            logger.error(f"❌ TRANSPORT_ROUTES reload failed, keeping current routes: {e}")
+            return False
+        self.replace(routes)
+        logger.info(f"🚦 Reloaded {len(routes)} transport rules.")
+        return True
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            mtime = self._source_mtime()
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
+
+    def start(self, watch_interval: float = 5.0):
+        """Aggancia SIGHUP e, se le route vengono da un file, ne controlla le modifiche."""
+        if sys.platform != 'win32' and self.loader is not None:
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.reload)
+            except (NotImplementedError, RuntimeError) as e:
+                logger.debug(f"SIGHUP handler not installed: {e}")
+        if self.source_file and watch_interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.ensure_future(self._watch(watch_interval))
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+
+    def stats(self) -> dict:
+        return {**self.matcher.stats(), "reloads": self.reloads, "source_file": self.source_file}
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from services.request_priority import PriorityTicket, current_ticket, join
+
+logger = logging.getLogger(__name__)
+
+
+class CachedSegment:
+    """Corpo di un segmento scaricato dall'upstream, con gli header utili per la risposta."""
+
+    __slots__ = ("body", "status", "headers", "stored_at", "ttl", "oversized")
+
+    def __init__(self, body: bytes, status: int = 200, headers: Optional[Dict[str, str]] = None, ttl: Optional[float] = None, oversized: bool = False):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.stored_at = 0.0
+        self.ttl = ttl
+        # True se il corpo supera max_entry_bytes e non è stato letto: il chiamante deve fare streaming
+        self.oversized = oversized
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+class SegmentCache:
+    """
+    Cache in memoria condivisa per i segmenti (.ts/.m4s/.mp4).
+
+    - Chiave: URL upstream (o una chiave derivata, es. URL + key_id per i segmenti decriptati)
+    - Budget totale in byte con eviction LRU, più TTL per singola entry
+    - Fetch single-flight: richieste concorrenti per la stessa chiave condividono un solo download
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 30.0, max_entry_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, CachedSegment]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Ticket di priorità dei fetch avviati da un prefetch (promossi se un client si aggancia)
+        self._tickets: Dict[str, PriorityTicket] = {}
+        self.current_bytes = 0
+
+        # Contatori esposti via /api/info
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes_served_from_cache = 0
+        self.bytes_fetched = 0
+
+    def __contains__(self, key: str) -> bool:
+        return self._lookup(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _is_expired(self, entry: CachedSegment, now: float) -> bool:
+        ttl = entry.ttl if entry.ttl is not None else self.ttl
+        return now - entry.stored_at > ttl
+
+    def _lookup(self, key: str) -> Optional[CachedSegment]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry, time.monotonic()):
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def _evict(self):
+        """Rimuove le entry meno usate di recente (LRU) finché non si rientra nel budget."""
+        now = time.monotonic()
+        while self._entries and self.current_bytes > self.max_bytes:
+            key, entry = next(iter(self._entries.items()))
+            self._remove(key)
+            if not self._is_expired(entry, now):
+                self.evictions += 1
+
+    def is_pending(self, key: str) -> bool:
+        """True se la chiave è già in cache o in fase di download."""
+        return key in self._inflight or self._lookup(key) is not None
+
+    def get(self, key: str) -> Optional[CachedSegment]:
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, segment: CachedSegment) -> bool:
+        """Memorizza un segmento. Ritorna False se non è cacheabile (errore o troppo grande)."""
+        if segment.status != 200 or segment.size == 0 or segment.size > self.max_entry_bytes:
+            return False
+        self._remove(key)
+        segment.stored_at = time.monotonic()
+        self._entries[key] = segment
+        self.current_bytes += segment.size
+        self._evict()
+        return True
+
+    def invalidate(self, key: str):
+        self._remove(key)
+
+    async def get_or_fetch(self, key: str, fetcher: Callable[[], Awaitable[CachedSegment]]) -> Tuple[CachedSegment, bool]:
+        """
+        Restituisce (segmento, from_cache).
+
+        Se il segmento non è in cache, il download viene avviato una sola volta in un
+        task separato e tutti i richiedenti concorrenti attendono lo stesso risultato.
+        Le risposte di errore vengono condivise ma non memorizzate.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.bytes_served_from_cache += entry.size
+            return entry, True
+
+        task = self._inflight.get(key)
+        if task is not None and join(self._tickets.get(key)):
+            self.coalesced += 1
+            # shield: se un client si disconnette non deve annullare il download per gli altri
+            segment = await asyncio.shield(task)
+            self.bytes_served_from_cache += segment.size
+            return segment, True
+
+        self.misses += 1
+        task = asyncio.ensure_future(fetcher())
+        self._inflight[key] = task
+        ticket = current_ticket()
+        if ticket is not None:
+            self._tickets[key] = ticket
+        else:
+            self._tickets.pop(key, None)
+        task.add_done_callback(lambda t, k=key: self._on_fetch_done(k, t))
+        return await asyncio.shield(task), False
+
+    def _on_fetch_done(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._tickets.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        segment = task.result()
+        self.bytes_fetched += segment.size
+        self.put(key, segment)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "bytes_served_from_cache": self.bytes_served_from_cache,
+            "bytes_fetched": self.bytes_fetched,
+        }
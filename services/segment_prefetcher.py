@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from services.manifest_cache import CachedManifest
+from services.segment_cache import SegmentCache, CachedSegment
+from services.request_priority import Priority, run_speculative
+
+logger = logging.getLogger(__name__)
+
+SegmentFetcherFactory = Callable[[str], Callable[[], Awaitable[CachedSegment]]]
+
+
+class _PlaylistState:
+    __slots__ = ("segments", "positions", "target_duration", "ended", "last_poll", "fetch_ewma", "last_served", "fetcher_factory")
+
+    def __init__(self):
+        self.segments = ()
+        self.positions: Dict[str, int] = {}
+        self.target_duration = 0.0
+        self.ended = False
+        self.last_poll = 0.0
+        self.fetch_ewma: Optional[float] = None
+        self.last_served: Optional[str] = None
+        self.fetcher_factory: Optional[SegmentFetcherFactory] = None
+
+
+class SegmentPrefetcher:
+    """
+    Prefetch look-ahead per HLS "normale" basato sulla lista reale dei segmenti del playlist.
+
+    Dopo aver servito il segmento N scalda N+1..N+k nella SegmentCache. k si adatta al tempo di
+    fetch upstream misurato (EWMA) rispetto alla durata del segmento:
+
+        k = 1 + ceil(2 * fetch_ewma / target_duration), limitato a [1, max_ahead]
+
+    Un CDN veloce resta a 1-2 segmenti di anticipo, uno lento ne tiene in volo di più.
+    Per i playlist live il prefetch si ferma appena il client smette di ricaricare il manifest.
+    """
+
+    def __init__(self, segment_cache: SegmentCache, max_ahead: int = 4, max_playlists: int = 256, ewma_alpha: float = 0.3):
+        self.segment_cache = segment_cache
+        self.max_ahead = max_ahead
+        self.max_playlists = max_playlists
+        self.ewma_alpha = ewma_alpha
+        self._playlists: "OrderedDict[tuple, _PlaylistState]" = OrderedDict()
+        self._index: Dict[str, tuple] = {}
+        self._tasks = set()
+
+        # Contatori esposti via /api/info
+        self.scheduled = 0
+        self.prefetched_bytes = 0
+
+    def update_playlist(self, key: tuple, manifest: CachedManifest):
+        """Aggiorna la lista dei segmenti di un media playlist (chiamato a ogni fetch del manifest)."""
+        if not manifest.segments or manifest.target_duration is None:
+            return
+        state = self._playlists.get(key)
+        if state is None:
+            state = self._playlists[key] = _PlaylistState()
+            while len(self._playlists) > self.max_playlists:
+                old_key, old_state = self._playlists.popitem(last=False)
+                self._drop_index(old_key, old_state)
+        else:
+            self._drop_index(key, state)
+        state.segments = manifest.segments
+        state.positions = {url: i for i, url in enumerate(manifest.segments)}
+        state.target_duration = manifest.target_duration
+        state.ended = manifest.ended
+        for url in manifest.segments:
+            self._index[url] = key
+
+    def _drop_index(self, key: tuple, state: _PlaylistState):
+        for url in state.segments:
+            if self._index.get(url) == key:
+                del self._index[url]
+
+    def touch(self, key: tuple):
+        """Il client ha ricaricato il manifest."""
+        state = self._playlists.get(key)
+        if state is not None:
+            state.last_poll = time.monotonic()
+            self._playlists.move_to_end(key)
+
+    def record_fetch(self, url: str, seconds: float):
+        state = self._state_for(url)
+        if state is None:
+            return
+        if state.fetch_ewma is None:
+            state.fetch_ewma = seconds
+        else:
+            state.fetch_ewma += self.ewma_alpha * (seconds - state.fetch_ewma)
+
+    def target_duration_for(self, url: str) -> Optional[float]:
+        """EXT-X-TARGETDURATION del playlist che contiene il segmento (None se non noto)."""
+        state = self._state_for(url)
+        return state.target_duration if state is not None and state.target_duration > 0 else None
+
+    def _state_for(self, url: str) -> Optional[_PlaylistState]:
+        key = self._index.get(url)
+        return self._playlists.get(key) if key is not None else None
+
+    def lookahead(self, state: _PlaylistState) -> int:
+        if state.fetch_ewma is None or state.target_duration <= 0:
+            return 1
+        return max(1, min(self.max_ahead, 1 + math.ceil(2 * state.fetch_ewma / state.target_duration)))
+
+    def _is_active(self, state: _PlaylistState) -> bool:
+        if state.ended:
+            return True
+        return time.monotonic() - state.last_poll <= max(2 * state.target_duration, 6.0)
+
+    def after_segment(self, url: str, fetcher_factory: SegmentFetcherFactory):
+        """Il segmento `url` è stato servito: avvia il prefetch dei successivi."""
+        state = self._state_for(url)
+        if state is None:
+            return
+        state.last_served = url
+        state.fetcher_factory = fetcher_factory
+        self._schedule(state)
+
+    def on_new_segments(self, key: tuple, manifest: CachedManifest, new_segments):
+        """Listener del LivePlaylistPoller: i segmenti appena pubblicati vengono scaldati subito."""
+        state = self._playlists.get(key)
+        if state is not None and state.last_served and state.fetcher_factory:
+            self._schedule(state)
+
+    def _schedule(self, state: _PlaylistState):
+        if self.max_ahead <= 0 or not self._is_active(state):
+            return
+        position = state.positions.get(state.last_served)
+        if position is None:
+            return
+        for next_url in state.segments[position + 1:position + 1 + self.lookahead(state)]:
+            if self.segment_cache.is_pending(next_url):
+                continue
+            self.scheduled += 1
+            fetcher = state.fetcher_factory(next_url)
+            task = asyncio.ensure_future(run_speculative(
+                Priority.PREFETCH, lambda url=next_url, fetcher=fetcher: self.segment_cache.get_or_fetch(url, fetcher)
+            ))
+            self._tasks.add(task)
+            task.add_done_callback(self._on_prefetch_done)
+
+    def _on_prefetch_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is None:
+            segment, from_cache = task.result()
+            if not from_cache and segment.status == 200:
+                self.prefetched_bytes += segment.size
+                logger.debug(f"📦 Prefetched segment ({segment.size} bytes)")
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "playlists": len(self._playlists),
+            "max_ahead": self.max_ahead,
+            "scheduled": self.scheduled,
+            "inflight": len(self._tasks),
+            "prefetched_bytes": self.prefetched_bytes,
+        }
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from services.token_recovery import TokenRecovery
+
+logger = logging.getLogger(__name__)
+
+
+class _TrackedToken:
+    __slots__ = ("expires_at", "lifetime", "last_viewer", "retry_at", "destination")
+
+    def __init__(self, expires_at: float, destination: str):
+        self.expires_at = expires_at
+        self.lifetime = max(expires_at - time.time(), 0.0)
+        self.last_viewer = time.monotonic()
+        self.retry_at = 0.0
+        self.destination = destination
+
+
+class TokenLifecycle:
+    """
+    Ciclo di vita dei token con scadenza nota (expires_at nel risultato dell'estrazione).
+
+    - track(): registra l'estrazione di un canale e la sua scadenza
+    - touch(): ogni richiesta di manifest/segmento del canale segna un viewer attivo
+    - un task in background ri-estrae il canale quando resta `refresh_fraction` della durata del
+      token (al massimo `max_lead` secondi prima della scadenza), solo finché ci sono viewer
+    - fresh_url(): riscrive l'URL di un sub-manifest/segmento/chiave sul token più recente, così
+      l'upstream riceve sempre un token valido e anche i token da pochi secondi possono passare dal proxy
+
+    Gli URL sono riscritti con le regole di TokenRecovery (prefisso del manifest e parametri di query).
+    """
+
+    def __init__(self, refresh: Callable[[str], Awaitable[dict]], recovery: TokenRecovery,
+                 refresh_fraction: float = 0.5, max_lead: float = 300.0, idle_timeout: float = 60.0,
+                 max_channels: int = 1024):
+        self.refresh = refresh
+        self.recovery = recovery
+        self.refresh_fraction = refresh_fraction
+        self.max_lead = max_lead
+        self.idle_timeout = idle_timeout
+        self.max_channels = max_channels
+        self._tokens: Dict[str, _TrackedToken] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        # Contatori esposti via /api/info
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.rewrites = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.refresh_fraction > 0
+
+    def track(self, channel_url: str, result: dict, viewer: bool = True):
+        """Registra il risultato di un'estrazione del canale (da chiamare a ogni risoluzione)."""
+        destination = result.get("destination_url")
+        if not channel_url or not destination:
+            return
+        self.recovery.remember(channel_url, destination)
+        expires_at = result.get("expires_at")
+        if not self.enabled or not expires_at:
+            return
+        expires_at = float(expires_at)
+        token = self._tokens.get(channel_url)
+        if token is not None and token.expires_at == expires_at:
+            if viewer:
+                token.last_viewer = time.monotonic()
+            return
+        if token is None and (not viewer or len(self._tokens) >= self.max_channels):
+            return
+        fresh = _TrackedToken(expires_at, destination)
+        if token is not None and not viewer:
+            fresh.last_viewer = token.last_viewer
+        self._tokens[channel_url] = fresh
+        self._ensure_task()
+
+    def touch(self, channel_url: Optional[str]):
+        token = self._tokens.get(channel_url) if channel_url else None
+        if token is not None:
+            token.last_viewer = time.monotonic()
+            self._ensure_task()
+
+    def fresh_url(self, channel_url: Optional[str], url: str) -> str:
+        """URL riscritto sul token più recente del canale (invariato se già aggiornato o canale non tracciato)."""
+        token = self._tokens.get(channel_url) if channel_url else None
+        if token is None or url == token.destination:
+            return url
+        rewritten = self.recovery.rewrite(channel_url, url, token.destination)
+        if rewritten != url:
+            self.rewrites += 1
+        return rewritten
+
+    def _refresh_at(self, token: _TrackedToken) -> float:
+        """Istante (epoch) in cui ri-estrarre il canale."""
+        lead = min(token.lifetime * self.refresh_fraction, self.max_lead)
+        return max(token.expires_at - lead, token.retry_at)
+
+    @staticmethod
+    def _backoff(token: _TrackedToken):
+        # Nuovo tentativo a breve, ma prima della scadenza effettiva
+        token.retry_at = time.time() + max(1.0, min(10.0, (token.expires_at - time.time()) / 3))
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self):
+        while self._tokens:
+            now = time.time()
+            idle_before = time.monotonic() - self.idle_timeout
+            next_at = None
+            for channel_url, token in list(self._tokens.items()):
+                if token.last_viewer < idle_before:
+                    # Nessun viewer: il token non viene più rinnovato (la prossima richiesta ri-estrae)
+                    del self._tokens[channel_url]
+                    continue
+                refresh_at = self._refresh_at(token)
+                if refresh_at <= now:
+                    if channel_url not in self._inflight:
+                        self._start_refresh(channel_url)
+                    continue
+                next_at = refresh_at if next_at is None else min(next_at, refresh_at)
+            # Sveglia alla prossima scadenza, a un nuovo track/touch o comunque per il controllo di inattività
+            timeout = self.idle_timeout if next_at is None else max(0.2, min(next_at - now, self.idle_timeout))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_refresh(self, channel_url: str):
+        task = asyncio.ensure_future(self._refresh(channel_url))
+        self._inflight[channel_url] = task
+        task.add_done_callback(lambda t, c=channel_url: self._inflight.pop(c, None))
+
+    async def _refresh(self, channel_url: str):
+        token = self._tokens.get(channel_url)
+        try:
+            result = await self.refresh(channel_url)
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning(f"⚠️ Token refresh-ahead failed for {channel_url}: {e}")
+            if token is not None:
+                self._backoff(token)
+            return
+        finally:
+            if self._wakeup is not None:
+                self._wakeup.set()
+        self.refreshes += 1
+        if token is not None and self._tokens.get(channel_url) is token and result.get("expires_at") == token.expires_at:
+            # L'estrattore ha restituito lo stesso token (es. dalla sua cache): si riprova più tardi
+            self._backoff(token)
+        self.track(channel_url, result, viewer=False)
+        logger.info(f"🔑 Token refreshed ahead of expiry for {channel_url}")
+
+    async def stop(self):
+        tasks = list(self._inflight.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "tracked": len(self._tokens),
+            "refreshing": len(self._inflight),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "rewrites": self.rewrites,
+            "next_refresh_in": round(min((self._refresh_at(t) - now for t in self._tokens.values()), default=0.0), 1),
+        }
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Risposte upstream tipiche di un token scaduto/revocato
+AUTH_FAILURE_STATUSES = (401, 403, 410)
+
+
+def merge_headers(headers, fresh: Optional[dict]):
+    """Sovrascrive in `headers` (dict o CIMultiDict) gli header della nuova estrazione, senza duplicati di maiuscole."""
+    for name, value in (fresh or {}).items():
+        for existing in [k for k in headers.keys() if k.lower() == name.lower()]:
+            del headers[existing]
+        headers[name] = value
+
+
+def _base_dir(url: str) -> str:
+    """URL senza query e senza l'ultimo componente del path ("https://host/live/TOKEN/")."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path.rsplit('/', 1)[0] + '/', '', ''))
+
+
+def _swap_query_tokens(url: str, fresh_url: str) -> str:
+    """Copia nell'URL fallito i valori dei parametri di query presenti anche nell'URL nuovo (token, expires, ...)."""
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    fresh = dict(parse_qsl(urlsplit(fresh_url).query, keep_blank_values=True))
+    if not fresh:
+        return url
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    swapped = [(name, fresh.get(name, value)) for name, value in params]
+    if swapped == params:
+        return url
+    return urlunsplit(parts._replace(query=urlencode(swapped, quote_via=quote, safe='/:=+')))
+
+
+class _Refresh:
+    __slots__ = ("destination", "headers", "completed_at")
+
+    def __init__(self, destination: str, headers: dict):
+        self.destination = destination
+        self.headers = headers
+        self.completed_at = time.monotonic()
+
+
+class TokenRecovery:
+    """
+    Recupero trasparente dei token scaduti per segmenti e chiavi.
+
+    Quando l'upstream risponde 401/403/410 per una risorsa di un canale (original_channel_url),
+    il canale viene ri-estratto una sola volta (single-flight; il risultato è riusato per
+    `reuse_window` secondi dalle altre richieste fallite dello stesso canale) e l'URL fallito viene
+    riscritto sulla nuova base:
+
+    - se l'URL fallito sta sotto la directory di un manifest già servito per il canale
+      (https://host/live/OLD_TOKEN/...), il prefisso viene sostituito con quello del nuovo manifest
+    - i parametri di query presenti in entrambi gli URL (token=, expires=, ...) prendono il valore nuovo
+
+    Se la riscrittura non cambia l'URL il recupero non è possibile e il chiamante restituisce l'errore originale.
+    """
+
+    def __init__(self, extract: Callable[[str], Awaitable[dict]], reuse_window: float = 30.0,
+                 history: int = 4, max_channels: int = 1024):
+        self.extract = extract
+        self.reuse_window = reuse_window
+        self.history = history
+        self.max_channels = max_channels
+        self._destinations: "OrderedDict[str, deque]" = OrderedDict()
+        self._refreshes: Dict[str, _Refresh] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Contatori esposti via /api/info
+        self.recoveries = 0
+        self.extractions = 0
+        self.extraction_errors = 0
+        self.unrewritable = 0
+
+    def remember(self, channel_url: str, destination_url: str):
+        """Registra l'URL di destinazione servito per il canale (base per riscrivere gli URL futuri)."""
+        if not channel_url or not destination_url:
+            return
+        destinations = self._destinations.get(channel_url)
+        if destinations is None:
+            destinations = self._destinations[channel_url] = deque(maxlen=self.history)
+            while len(self._destinations) > self.max_channels:
+                old_channel, _ = self._destinations.popitem(last=False)
+                self._refreshes.pop(old_channel, None)
+        else:
+            self._destinations.move_to_end(channel_url)
+        if not destinations or destinations[-1] != destination_url:
+            destinations.append(destination_url)
+
+    def rewrite(self, channel_url: str, failed_url: str, fresh_url: str) -> str:
+        fresh_dir = _base_dir(fresh_url)
+        rewritten = failed_url
+        for old_url in reversed(self._destinations.get(channel_url, ())):
+            old_dir = _base_dir(old_url)
+            if old_dir != fresh_dir and failed_url.startswith(old_dir):
+                rewritten = fresh_dir + failed_url[len(old_dir):]
+                break
+        return _swap_query_tokens(rewritten, fresh_url)
+
+    async def _refresh(self, channel_url: str) -> Optional[_Refresh]:
+        last = self._refreshes.get(channel_url)
+        if last is not None and time.monotonic() - last.completed_at < self.reuse_window:
+            return last
+
+        task = self._inflight.get(channel_url)
+        if task is None:
+            task = asyncio.ensure_future(self._extract(channel_url))
+            self._inflight[channel_url] = task
+            task.add_done_callback(lambda t, c=channel_url: self._inflight.pop(c, None))
+        # shield: se il client se ne va, la ri-estrazione serve comunque agli altri
+        return await asyncio.shield(task)
+
+    async def _extract(self, channel_url: str) -> Optional[_Refresh]:
+        self.extractions += 1
+        try:
+            result = await self.extract(channel_url)
+        except Exception as e:
+            self.extraction_errors += 1
+            logger.warning(f"⚠️ Token recovery: re-extraction failed for {channel_url}: {e}")
+            return None
+        refresh = _Refresh(result["destination_url"], dict(result.get("request_headers") or {}))
+        self._refreshes[channel_url] = refresh
+        logger.info(f"🔄 Token recovery: channel re-extracted ({channel_url})")
+        return refresh
+
+    async def recover(self, channel_url: str, failed_url: str) -> Optional[Tuple[str, dict]]:
+        """Restituisce (nuovo_url, header_nuovi) per ritentare `failed_url`, o None se non recuperabile."""
+        refresh = await self._refresh(channel_url)
+        if refresh is None:
+            return None
+        new_url = self.rewrite(channel_url, failed_url, refresh.destination)
+        self.remember(channel_url, refresh.destination)
+        if new_url == failed_url:
+            self.unrewritable += 1
+            return None
+        self.recoveries += 1
+        return new_url, refresh.headers
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._destinations),
+            "recoveries": self.recoveries,
+            "extractions": self.extractions,
+            "extraction_errors": self.extraction_errors,
+            "unrewritable": self.unrewritable,
+            "inflight": len(self._inflight),
+        }
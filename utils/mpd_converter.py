@@ -22,6 +22,7 @@ class MPDToHLSConverter:
         - h_* (headers personalizzati)
         - api_password (autenticazione)
         - clearkey (chiavi DRM)
+        - original_channel_url (affinità del proxy dello stream)
         
         Questo evita di passare parametri di controllo duplicati (d=, rep_id=, format=, etc.)
         che possono causare problemi di parsing degli URL.
@@ -31,7 +32,7 @@ class MPDToHLSConverter:
         
         header_params = []
         for param in params.split('&'):
-            if param.startswith('h_') or param.startswith('api_password=') or param.startswith('clearkey=') or param.startswith('ext='):
+            if param.startswith('h_') or param.startswith('api_password=') or param.startswith('clearkey=') or param.startswith('ext=') or param.startswith('original_channel_url='):
                 header_params.append(param)
         
         if header_params: